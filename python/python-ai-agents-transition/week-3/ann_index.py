@@ -0,0 +1,321 @@
+"""
+Approximate Nearest-Neighbour Index Module for Week 3
+IVF-flat index (k-means coarse quantizer + inverted lists) in pure NumPy
+"""
+
+import logging
+import math
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from similarity import normalize, top_k_indices
+
+logger = logging.getLogger(__name__)
+
+
+def _nearest_centroids(vectors: np.ndarray, centroids: np.ndarray, block_size: int = 4096) -> np.ndarray:
+    # Score in blocks so an (n, k) matrix never has to exist at once
+    assignments = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], block_size):
+        block = vectors[start:start + block_size]
+        assignments[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """
+    Spherical k-means over normalized vectors
+
+    Args:
+        vectors: Normalized float32 vectors of shape (n, d)
+        k: Number of centroids
+        iterations: Number of Lloyd iterations
+        seed: Random seed for initialization
+
+    Returns:
+        Normalized centroids of shape (k, d)
+    """
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    k = min(k, n)
+    centroids = vectors[rng.choice(n, size=k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = _nearest_centroids(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=k)
+
+        # Re-seed empty clusters with random points so every list gets used
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            sums[empty] = vectors[rng.choice(n, size=empty.size, replace=False)]
+        centroids = normalize(sums)
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index for approximate cosine similarity search
+
+    Vectors are grouped into nlist clusters by k-means. A query scores only the
+    nprobe clusters whose centroids are closest, so nprobe trades recall for
+    latency: nprobe == nlist is an exact search.
+
+    Until the index is trained, vectors are kept in a flat buffer and searched
+    exhaustively. Training happens automatically once enough vectors have been
+    added. Inserts after training go straight into their nearest list.
+    Ids are assigned sequentially in insertion order, starting at 0.
+    """
+
+    def __init__(
+        self,
+        dimensions: int,
+        nlist: Optional[int] = None,
+        nprobe: int = 8,
+        train_threshold: Optional[int] = None,
+        iterations: int = 10,
+        seed: int = 0
+    ):
+        self.dimensions = dimensions
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_threshold = train_threshold
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self._next_id = 0
+        # Each list is a list of (ids, vectors) blocks, merged lazily on search
+        self._lists: List[List[Tuple[np.ndarray, np.ndarray]]] = []
+        self._buffer: List[Tuple[np.ndarray, np.ndarray]] = []
+
+    def __len__(self) -> int:
+        return self._next_id
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def add(self, vectors: Sequence[Sequence[float]]) -> List[int]:
+        """
+        Add vectors to the index
+
+        Args:
+            vectors: Vectors of shape (n, d)
+
+        Returns:
+            Ids assigned to the new vectors
+
+        Raises:
+            ValueError: If the vector dimensions don't match the index
+        """
+        rows = normalize(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+        if rows.shape[1] != self.dimensions:
+            raise ValueError(f"Expected vectors with {self.dimensions} dimensions, got {rows.shape[1]}")
+
+        ids = np.arange(self._next_id, self._next_id + rows.shape[0], dtype=np.int64)
+        self._next_id += rows.shape[0]
+
+        if self.is_trained:
+            self._assign(ids, rows)
+        else:
+            self._buffer.append((ids, rows))
+            threshold = self.train_threshold
+            if threshold is None and self.nlist is not None:
+                # k-means needs a few dozen points per centroid to be useful
+                threshold = self.nlist * 39
+            if threshold is not None and len(self) >= threshold:
+                self.train()
+
+        return ids.tolist()
+
+    def _assign(self, ids: np.ndarray, rows: np.ndarray) -> None:
+        assignments = _nearest_centroids(rows, self.centroids)
+        order = np.argsort(assignments, kind="stable")
+        lists, starts = np.unique(assignments[order], return_index=True)
+        for list_id, start, end in zip(lists, starts, list(starts[1:]) + [len(order)]):
+            members = order[start:end]
+            self._lists[list_id].append((ids[members], rows[members]))
+
+    def _merged_list(self, list_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        blocks = self._lists[list_id]
+        if not blocks:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.dimensions), dtype=np.float32)
+        if len(blocks) > 1:
+            blocks[:] = [(np.concatenate([b[0] for b in blocks]), np.concatenate([b[1] for b in blocks]))]
+        return blocks[0]
+
+    def _all_vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        blocks = list(self._buffer)
+        for list_id in range(len(self._lists)):
+            blocks.append(self._merged_list(list_id))
+        blocks = [block for block in blocks if block[0].size]
+        if not blocks:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.dimensions), dtype=np.float32)
+        return np.concatenate([b[0] for b in blocks]), np.concatenate([b[1] for b in blocks])
+
+    def train(self, max_train_points: Optional[int] = None) -> None:
+        """
+        Fit the coarse quantizer on the stored vectors and rebuild the inverted lists
+
+        Args:
+            max_train_points: Cap on the k-means sample size (default 256 per list)
+        """
+        ids, rows = self._all_vectors()
+        if ids.size == 0:
+            raise ValueError("Cannot train an empty index")
+
+        nlist = self.nlist or max(1, int(round(math.sqrt(ids.size))))
+        nlist = min(nlist, ids.size)
+        max_train_points = max_train_points or nlist * 256
+
+        sample = rows
+        if rows.shape[0] > max_train_points:
+            rng = np.random.default_rng(self.seed)
+            sample = rows[rng.choice(rows.shape[0], size=max_train_points, replace=False)]
+
+        self.centroids = kmeans(sample, nlist, self.iterations, self.seed)
+        self.nlist = self.centroids.shape[0]
+        self._lists = [[] for _ in range(self.nlist)]
+        self._buffer = []
+        self._assign(ids, rows)
+        logger.info("Trained IVF index with %d lists over %d vectors", self.nlist, ids.size)
+
+    def search(
+        self,
+        query: Sequence[float],
+        top_k: int = 3,
+        nprobe: Optional[int] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        Find approximately the most similar vectors to a query
+
+        Args:
+            query: Query vector of shape (d,)
+            top_k: Number of results to return
+            nprobe: Lists to scan for this query (defaults to self.nprobe)
+
+        Returns:
+            (id, cosine similarity) pairs, best first
+        """
+        query = normalize(query)
+        if query.shape[-1] != self.dimensions:
+            raise ValueError(f"Expected a query with {self.dimensions} dimensions, got {query.shape[-1]}")
+
+        if self.is_trained:
+            probe = top_k_indices(self.centroids @ query, nprobe or self.nprobe)
+            blocks = [self._merged_list(int(list_id)) for list_id in probe]
+        else:
+            blocks = self._buffer
+
+        blocks = [block for block in blocks if block[0].size]
+        if not blocks:
+            return []
+
+        ids = np.concatenate([block[0] for block in blocks])
+        scores = np.concatenate([block[1] @ query for block in blocks])
+        return [(int(ids[i]), float(scores[i])) for i in top_k_indices(scores, top_k)]
+
+    def search_batch(
+        self,
+        queries: Sequence[Sequence[float]],
+        top_k: int = 3,
+        nprobe: Optional[int] = None
+    ) -> List[List[Tuple[int, float]]]:
+        """Run search() for each query"""
+        return [self.search(query, top_k, nprobe) for query in np.atleast_2d(queries)]
+
+    def save(self, path: str) -> None:
+        """
+        Save the index to a .npz file
+
+        Args:
+            path: Destination file path (NumPy appends .npz if it is missing)
+        """
+        ids, rows = self._all_vectors()
+        list_ids = np.full(ids.size, -1, dtype=np.int64)
+        if self.is_trained:
+            offset = 0
+            for list_id in range(self.nlist):
+                members = self._merged_list(list_id)[0].size
+                list_ids[offset:offset + members] = list_id
+                offset += members
+
+        np.savez(
+            path,
+            ids=ids,
+            vectors=rows,
+            list_ids=list_ids,
+            centroids=self.centroids if self.is_trained else np.empty((0, self.dimensions), dtype=np.float32),
+            config=np.array([
+                self.dimensions, self.nlist or 0, self.nprobe,
+                self.train_threshold or 0, self.iterations, self.seed, self._next_id
+            ], dtype=np.int64),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        """
+        Load an index saved with save()
+
+        Args:
+            path: Path of the .npz file
+
+        Returns:
+            The restored index, with the same lists and ids
+        """
+        with np.load(path) as data:
+            dimensions, nlist, nprobe, threshold, iterations, seed, next_id = data["config"].tolist()
+            index = cls(
+                dimensions=dimensions,
+                nlist=nlist or None,
+                nprobe=nprobe,
+                train_threshold=threshold or None,
+                iterations=iterations,
+                seed=seed
+            )
+            ids, rows, list_ids = data["ids"], data["vectors"], data["list_ids"]
+            index._next_id = next_id
+
+            if data["centroids"].size:
+                index.centroids = data["centroids"]
+                index.nlist = index.centroids.shape[0]
+                index._lists = [[] for _ in range(index.nlist)]
+                for list_id in range(index.nlist):
+                    members = list_ids == list_id
+                    if members.any():
+                        index._lists[list_id].append((ids[members], rows[members]))
+            elif ids.size:
+                index._buffer.append((ids, rows))
+
+        return index
+
+
+def recall_at_k(
+    approximate: List[List[Tuple[int, float]]],
+    exact: List[List[Tuple[int, float]]],
+    k: int
+) -> float:
+    """
+    Fraction of the exact top-k neighbours that the approximate search also returned
+
+    Args:
+        approximate: Per-query results from the approximate index
+        exact: Per-query results from an exact search
+        k: Cutoff to compare at
+
+    Returns:
+        Mean recall@k over all queries, between 0.0 and 1.0
+    """
+    if not exact:
+        return 0.0
+
+    total = 0.0
+    for approx_results, exact_results in zip(approximate, exact):
+        truth = {i for i, _ in exact_results[:k]}
+        if truth:
+            found = {i for i, _ in approx_results[:k]}
+            total += len(truth & found) / len(truth)
+    return total / len(exact)
@@ -0,0 +1,380 @@
+"""
+LLM Backends Module for Week 3
+Provider interface with an OpenAI implementation and a deterministic offline fake
+"""
+
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import os
+import random
+import re
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+
+
+class BackendError(Exception):
+    """Raised by a backend when the provider call fails"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ChatResult(NamedTuple):
+    content: Optional[str]
+    usage: Optional[Dict[str, int]] = None
+    function_call: Optional[Dict[str, str]] = None
+    # Tool calls requested by the model: {"id", "name", "arguments" (a JSON string)}
+    tool_calls: Optional[List[Dict[str, str]]] = None
+    # Set by llm_utils when the answer came from the response cache
+    cached: bool = False
+
+
+class ChatChunk(NamedTuple):
+    delta: Optional[str]
+    usage: Optional[Dict[str, int]] = None
+
+
+class EmbeddingResult(NamedTuple):
+    embeddings: List[List[float]]
+    usage: Optional[Dict[str, int]] = None
+
+
+def _usage(usage: Any) -> Optional[Dict[str, int]]:
+    if not usage:
+        return None
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "total_tokens": usage.total_tokens,
+    }
+
+
+class LLMBackend(ABC):
+    """
+    Interface llm_utils uses to reach a model provider
+
+    Backends make exactly one provider call per method call; retries, rate
+    limiting and caching stay in llm_utils so every backend gets them.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    async def chat(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float,
+        **options: Any
+    ) -> ChatResult:
+        """Create one chat completion; options are passed through to the provider"""
+
+    @abstractmethod
+    def stream_chat(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float
+    ) -> AsyncIterator[ChatChunk]:
+        """Stream one chat completion; the last chunk carries usage"""
+
+    @abstractmethod
+    async def embed(self, inputs: List[str], model: str) -> EmbeddingResult:
+        """Embed inputs in one call, returning vectors in input order"""
+
+    async def warmup(self) -> None:
+        """Prepare connections before the first request; must not raise"""
+
+    async def close(self) -> None:
+        """Release any connections held by the backend"""
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    Backend for the OpenAI API
+
+    The AsyncOpenAI client is created on first use, so importing and
+    constructing the backend needs neither an API key nor the network.
+    It sends every request through one pooled httpx client: connections
+    are kept alive between requests and, when the h2 package is installed,
+    multiplexed over HTTP/2, so the hot path doesn't pay for TCP and TLS
+    handshakes.
+    """
+
+    name = "openai"
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        client: Any = None,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 60.0,
+        connect_timeout: float = 5.0,
+        http2: bool = True
+    ):
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.http2 = http2
+        self._client = client
+
+    def _http_client(self) -> Any:
+        import httpx
+
+        http2 = self.http2
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 requested but the h2 package is not installed; using HTTP/1.1")
+            http2 = False
+
+        return httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+        )
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(
+                api_key=self.api_key or os.getenv("OPENAI_API_KEY"),
+                http_client=self._http_client(),
+                # llm_utils owns retries; SDK retries would multiply attempts and hide errors
+                max_retries=0,
+            )
+        return self._client
+
+    async def chat(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float,
+        **options: Any
+    ) -> ChatResult:
+        response = await self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            **options
+        )
+        message = response.choices[0].message
+        function_call = getattr(message, "function_call", None)
+        tool_calls = getattr(message, "tool_calls", None)
+        return ChatResult(
+            content=message.content,
+            usage=_usage(response.usage),
+            function_call={"name": function_call.name, "arguments": function_call.arguments}
+            if function_call else None,
+            tool_calls=[
+                {"id": call.id, "name": call.function.name, "arguments": call.function.arguments}
+                for call in tool_calls
+            ] if tool_calls else None,
+        )
+
+    async def stream_chat(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float
+    ) -> AsyncIterator[ChatChunk]:
+        stream = await self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        try:
+            async for chunk in stream:
+                # The final chunk carries usage and no choices
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                usage = _usage(chunk.usage)
+                if delta or usage:
+                    yield ChatChunk(delta=delta, usage=usage)
+        finally:
+            # Return the pooled connection even when the consumer stops early (e.g. a client disconnect)
+            await stream.close()
+
+    async def embed(self, inputs: List[str], model: str) -> EmbeddingResult:
+        response = await self.client.embeddings.create(model=model, input=inputs)
+        # The API reports each vector's position; don't rely on response order
+        ordered = sorted(response.data, key=lambda item: item.index)
+        return EmbeddingResult(
+            embeddings=[item.embedding for item in ordered],
+            usage=_usage(response.usage),
+        )
+
+    async def warmup(self) -> None:
+        # A cheap authenticated call opens a pooled connection and checks the key
+        try:
+            await self.client.models.list()
+            logger.info("OpenAI backend warmed up")
+        except Exception as e:
+            logger.warning("OpenAI backend warm-up failed: %s", e)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+class FakeBackend(LLMBackend):
+    """
+    Deterministic local backend for tests, benchmarks and load tests
+
+    Embeddings hash each word into one of `dimensions` buckets (the hashing
+    trick), so equal texts get equal vectors and texts sharing words score
+    as similar. Completions echo the last user message. Every call sleeps
+    for latency_ms and fails with probability error_rate, drawn from a
+    seeded generator so runs are reproducible.
+
+    Given tools, it calls (with no arguments) every tool named in the last
+    user message, then answers with the tool results once they are sent back.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        latency_ms: float = 0,
+        error_rate: float = 0.0,
+        dimensions: int = 1536,
+        seed: int = 0
+    ):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.dimensions = dimensions
+        self._random = random.Random(seed)
+        self.calls = 0
+
+    async def _simulate(self) -> None:
+        self.calls += 1
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise BackendError("Simulated upstream error", status_code=503)
+
+    @staticmethod
+    def _tokens(text: str) -> int:
+        return len(_WORD.findall(text))
+
+    def reply(self, messages: List[Dict[str, Any]], model: str) -> str:
+        """The canned completion for a conversation"""
+        last = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        return f"[{model}] You said: {last}"
+
+    def _chat_usage(self, messages: List[Dict[str, Any]], content: str) -> Dict[str, int]:
+        prompt = sum(self._tokens(m.get("content") or "") for m in messages)
+        completion = self._tokens(content)
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    async def chat(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float,
+        **options: Any
+    ) -> ChatResult:
+        await self._simulate()
+        tool_calls = self._tool_calls(messages, options.get("tools"), options.get("tool_choice"))
+        if tool_calls:
+            return ChatResult(content=None, usage=self._chat_usage(messages, ""), tool_calls=tool_calls)
+        if messages and messages[-1].get("role") == "tool":
+            results = [m.get("content") or "" for m in messages if m.get("role") == "tool"]
+            content = "Tool results: " + "; ".join(results)
+        else:
+            content = self.reply(messages, model)
+        return ChatResult(content=content, usage=self._chat_usage(messages, content))
+
+    @staticmethod
+    def _tool_calls(
+        messages: List[Dict[str, Any]],
+        tools: Optional[List[Dict[str, Any]]],
+        tool_choice: Any
+    ) -> Optional[List[Dict[str, str]]]:
+        if not tools or tool_choice == "none" or not messages or messages[-1].get("role") != "user":
+            return None
+        text = messages[-1].get("content") or ""
+        names = [tool["function"]["name"] for tool in tools if tool["function"]["name"] in text]
+        return [
+            {"id": f"call_{i}", "name": name, "arguments": "{}"} for i, name in enumerate(names)
+        ] or None
+
+    async def stream_chat(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float
+    ) -> AsyncIterator[ChatChunk]:
+        await self._simulate()
+        content = self.reply(messages, model)
+        for delta in re.findall(r"\s*\S+", content):
+            yield ChatChunk(delta=delta)
+        yield ChatChunk(delta=None, usage=self._chat_usage(messages, content))
+
+    def embed_text(self, text: str) -> List[float]:
+        """The deterministic embedding of one text"""
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in _WORD.findall(text.lower()) or [text]:
+            digest = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dimensions] += 1.0 if digest >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    async def embed(self, inputs: List[str], model: str) -> EmbeddingResult:
+        await self._simulate()
+        tokens = sum(self._tokens(text) for text in inputs)
+        return EmbeddingResult(
+            embeddings=[self.embed_text(text) for text in inputs],
+            usage={"prompt_tokens": tokens, "completion_tokens": 0, "total_tokens": tokens},
+        )
+
+
+def create_backend(name: Optional[str] = None) -> LLMBackend:
+    """
+    Build the backend named by name or the LLM_BACKEND environment variable
+
+    Args:
+        name: "openai" or "fake" (defaults to LLM_BACKEND, then "openai")
+
+    Returns:
+        The configured backend
+
+    Raises:
+        ValueError: If the name is unknown
+    """
+    name = (name or os.getenv("LLM_BACKEND") or "openai").lower()
+    if name == "openai":
+        return OpenAIBackend(
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20")),
+            keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30")),
+            timeout=float(os.getenv("LLM_TIMEOUT", "60")),
+            connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT", "5")),
+            http2=os.getenv("LLM_HTTP2", "true").lower() in ("1", "true", "yes"),
+        )
+    if name == "fake":
+        return FakeBackend(
+            latency_ms=float(os.getenv("FAKE_LLM_LATENCY_MS", "0")),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+            dimensions=int(os.getenv("FAKE_EMBEDDING_DIMENSIONS", "1536")),
+        )
+    raise ValueError(f"Unknown LLM backend '{name}' (expected 'openai' or 'fake')")
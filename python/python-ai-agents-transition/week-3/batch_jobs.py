@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Batch Jobs Module for Week 3
+Offline JSONL embedding and chat workloads with checkpointing and retry of failed lines
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import llm_utils
+from backends import LLMBackend
+from concurrency import ConcurrencyLimiter, RateLimiter
+
+logger = logging.getLogger(__name__)
+
+INPUT_FILE = "input.jsonl"
+OUTPUT_FILE = "output.jsonl"
+OPTIONS_FILE = "options.json"
+
+KINDS = ("chat", "embedding")
+
+
+class BatchJobError(Exception):
+    """Raised for unknown batch jobs or invalid batch input"""
+    pass
+
+
+class BatchLine(NamedTuple):
+    custom_id: str
+    kind: str
+    body: Dict[str, Any]
+
+
+def parse_line(line: str, number: int) -> BatchLine:
+    """
+    Parse one input line: {"custom_id": ..., "kind": "chat" | "embedding", "body": {...}}
+
+    Chat bodies hold messages (and optionally model and temperature);
+    embedding bodies hold input (and optionally model).
+
+    Raises:
+        BatchJobError: If the line is malformed
+    """
+    try:
+        record = json.loads(line)
+        custom_id, kind, body = str(record["custom_id"]), record["kind"], record["body"]
+    except (json.JSONDecodeError, KeyError, TypeError) as e:
+        raise BatchJobError(f"Line {number}: expected custom_id, kind and body ({e})")
+    if not isinstance(body, dict):
+        raise BatchJobError(f"Line {number}: body must be a JSON object")
+    if kind not in KINDS:
+        raise BatchJobError(f"Line {number}: kind must be one of {KINDS}, got '{kind}'")
+    if kind == "chat" and not isinstance(body.get("messages"), list):
+        raise BatchJobError(f"Line {number}: chat body needs a messages list")
+    if kind == "embedding" and not isinstance(body.get("input"), str):
+        raise BatchJobError(f"Line {number}: embedding body needs an input string")
+    return BatchLine(custom_id, kind, body)
+
+
+def _scan_results(output_path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """(byte offset, result) for each complete line of an output file"""
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb") as f:
+        offset = 0
+        for line in f:
+            try:
+                yield offset, json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a partial last line
+                pass
+            offset += len(line)
+
+
+def _drop_torn_line(output_path: str) -> None:
+    """Cut a partial last line left by a crash, so appended results start on a fresh line"""
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        # Walk back in blocks to the last newline
+        while end > 0:
+            start = max(0, end - 4096)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end < size:
+            f.truncate(end)
+
+
+def read_outcomes(output_path: str) -> Dict[str, bool]:
+    """
+    Whether the latest result per custom_id succeeded (later lines win)
+
+    Only the outcome is kept, not the response, so large embedding
+    outputs can be counted without holding their vectors in memory.
+    """
+    return {result["custom_id"]: result.get("error") is None for _, result in _scan_results(output_path)}
+
+
+def _units(lines: Iterator[BatchLine], embed_batch_size: int) -> Iterator[List[BatchLine]]:
+    """Group consecutive embedding lines for the same model; chat lines go alone"""
+    pending: List[BatchLine] = []
+    for line in lines:
+        if line.kind == "chat":
+            yield [line]
+            continue
+        if pending and (len(pending) >= embed_batch_size or pending[0].body.get("model") != line.body.get("model")):
+            yield pending
+            pending = []
+        pending.append(line)
+    if pending:
+        yield pending
+
+
+async def run_batch(
+    input_path: str,
+    output_path: str,
+    concurrency: int = 4,
+    requests_per_minute: int = 0,
+    embed_batch_size: int = 256,
+    llm_backend: Optional[LLMBackend] = None,
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> Dict[str, Any]:
+    """
+    Process a JSONL batch file, appending one result line per input line
+
+    Lines that already have a successful result in output_path are skipped,
+    so rerunning a job resumes it and retries only the lines that failed.
+    Every call goes through llm_utils (its retries, caches and the shared
+    limiter); on top of that, requests_per_minute paces the job itself so
+    it runs at a steady rate and leaves headroom for interactive traffic.
+    When the run ends, the output is rewritten with one line per custom_id,
+    in input order.
+
+    Args:
+        input_path: JSONL input (see parse_line)
+        output_path: JSONL results: {"custom_id", "response", "error"}
+        concurrency: Upstream requests the job keeps in flight
+        requests_per_minute: Target request rate for the job (0 for no pacing)
+        embed_batch_size: Embedding lines sent per request
+        llm_backend: Backend to call (defaults to get_llm_backend())
+        on_progress: Called with counters after each finished request
+
+    Returns:
+        Counters: total, succeeded, failed, skipped, and elapsed seconds
+    """
+    done = {cid for cid, succeeded in read_outcomes(output_path).items() if succeeded}
+    pacing = ConcurrencyLimiter(concurrency, RateLimiter(requests_per_minute=requests_per_minute))
+    counts = {"total": 0, "succeeded": 0, "failed": 0, "skipped": 0}
+    started = time.perf_counter()
+    units: "asyncio.Queue[Optional[List[BatchLine]]]" = asyncio.Queue(concurrency * 2)
+
+    _drop_torn_line(output_path)
+    output = open(output_path, "a")
+
+    def write(line: BatchLine, response: Any = None, error: Optional[str] = None) -> None:
+        output.write(json.dumps({"custom_id": line.custom_id, "response": response, "error": error}) + "\n")
+        counts["failed" if error else "succeeded"] += 1
+
+    def lines() -> Iterator[BatchLine]:
+        with open(input_path) as f:
+            for number, raw in enumerate(f, 1):
+                if not raw.strip():
+                    continue
+                counts["total"] += 1
+                try:
+                    line = parse_line(raw, number)
+                except BatchJobError as e:
+                    write(BatchLine(f"line-{number}", "invalid", {}), error=str(e))
+                    continue
+                if line.custom_id in done:
+                    counts["skipped"] += 1
+                    continue
+                yield line
+
+    async def call(unit: List[BatchLine]) -> None:
+        first = unit[0]
+        if first.kind == "chat":
+            result = await llm_utils.get_chat_completion(
+                first.body["messages"],
+                model=first.body.get("model", "gpt-4o-mini"),
+                temperature=first.body.get("temperature", 0.7),
+                llm_backend=llm_backend
+            )
+            write(first, {"content": result.content, "usage": result.usage})
+        else:
+            vectors = await llm_utils.get_embeddings(
+                [line.body["input"] for line in unit],
+                model=first.body.get("model", "text-embedding-3-small"),
+                llm_backend=llm_backend
+            )
+            for line, vector in zip(unit, vectors):
+                write(line, {"embedding": vector})
+
+    async def process(unit: List[BatchLine]) -> None:
+        try:
+            async with pacing.limit():
+                await call(unit)
+        except Exception as e:
+            if len(unit) > 1:
+                # One bad input fails a whole embedding request; retry the lines alone to isolate it
+                for line in unit:
+                    await process([line])
+                return
+            write(unit[0], error=str(e))
+        output.flush()
+        if on_progress:
+            on_progress(snapshot())
+
+    def snapshot() -> Dict[str, Any]:
+        return {**counts, "elapsed_seconds": round(time.perf_counter() - started, 2)}
+
+    async def worker() -> None:
+        while (unit := await units.get()) is not None:
+            await process(unit)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        # The bounded queue keeps the reader at most a few units ahead of the workers
+        for unit in _units(lines(), embed_batch_size):
+            await units.put(unit)
+        for _ in workers:
+            await units.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+        output.close()
+
+    _compact(input_path, output_path)
+    logger.info("Batch %s finished: %s", input_path, snapshot())
+    return snapshot()
+
+
+def _compact(input_path: str, output_path: str) -> None:
+    """Rewrite the output with the latest result per custom_id, in input order"""
+    # Remember where each latest line starts and copy lines one at a time, so no response is held in memory
+    offsets = {result["custom_id"]: offset for offset, result in _scan_results(output_path)}
+    order = []
+    with open(input_path) as f:
+        for number, raw in enumerate(f, 1):
+            if raw.strip():
+                try:
+                    order.append(parse_line(raw, number).custom_id)
+                except BatchJobError:
+                    order.append(f"line-{number}")
+    tmp = output_path + ".tmp"
+    with open(output_path, "rb") as source, open(tmp, "wb") as f:
+        for custom_id in dict.fromkeys(order):
+            if custom_id in offsets:
+                source.seek(offsets[custom_id])
+                f.write(source.readline().rstrip(b"\n") + b"\n")
+    os.replace(tmp, output_path)
+
+
+class BatchStore:
+    """
+    Directory of batch jobs, one subdirectory per job holding its input,
+    output and options, so jobs can be resumed after a restart
+    """
+
+    def __init__(self, root: str = "batch_jobs"):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, batch_id: str, name: str = "") -> str:
+        """
+        Raises:
+            BatchJobError: If the batch does not exist
+        """
+        directory = os.path.join(self.root, batch_id)
+        if not batch_id.isalnum() or not os.path.isdir(directory):
+            raise BatchJobError(f"Batch job '{batch_id}' not found")
+        return os.path.join(directory, name)
+
+    def create(self, lines: List[Dict[str, Any]], options: Dict[str, Any]) -> str:
+        """
+        Store a new batch's input lines and run options
+
+        Raises:
+            BatchJobError: If a line is malformed or custom_ids repeat
+        """
+        encoded = [json.dumps(line) for line in lines]
+        ids = [parse_line(line, number).custom_id for number, line in enumerate(encoded, 1)]
+        if len(set(ids)) != len(ids):
+            raise BatchJobError("custom_id values must be unique")
+
+        batch_id = uuid.uuid4().hex
+        directory = os.path.join(self.root, batch_id)
+        os.makedirs(directory)
+        with open(os.path.join(directory, INPUT_FILE), "w") as f:
+            f.write("\n".join(encoded) + "\n")
+        with open(os.path.join(directory, OPTIONS_FILE), "w") as f:
+            json.dump(options, f)
+        return batch_id
+
+    def options(self, batch_id: str) -> Dict[str, Any]:
+        with open(self.path(batch_id, OPTIONS_FILE)) as f:
+            return json.load(f)
+
+    def summary(self, batch_id: str) -> Dict[str, int]:
+        """Line counts from the input and the results written so far"""
+        with open(self.path(batch_id, INPUT_FILE)) as f:
+            total = sum(1 for line in f if line.strip())
+        outcomes = read_outcomes(self.path(batch_id, OUTPUT_FILE)).values()
+        succeeded = sum(outcomes)
+        return {"total": total, "succeeded": succeeded, "failed": len(outcomes) - succeeded}
+
+    async def run(
+        self,
+        batch_id: str,
+        llm_backend: Optional[LLMBackend] = None,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """Run (or resume) a stored batch with its saved options"""
+        return await run_batch(
+            self.path(batch_id, INPUT_FILE),
+            self.path(batch_id, OUTPUT_FILE),
+            llm_backend=llm_backend,
+            on_progress=on_progress,
+            **self.options(batch_id)
+        )
+
+
+def main():
+    from logging_config import configure_logging, shutdown_logging
+
+    parser = argparse.ArgumentParser(description="Run a JSONL batch of chat or embedding requests")
+    parser.add_argument("input", help="Input JSONL file")
+    parser.add_argument("output", help="Output JSONL file (rerun to retry failed lines)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight")
+    parser.add_argument("--requests-per-minute", type=int, default=0, help="Target request rate (0 for unpaced)")
+    parser.add_argument("--embed-batch-size", type=int, default=256, help="Embedding lines per request")
+    args = parser.parse_args()
+
+    configure_logging()
+
+    async def run() -> Dict[str, Any]:
+        try:
+            return await run_batch(
+                args.input, args.output,
+                concurrency=args.concurrency,
+                requests_per_minute=args.requests_per_minute,
+                embed_batch_size=args.embed_batch_size,
+            )
+        finally:
+            await llm_utils.close()
+
+    try:
+        print(json.dumps(asyncio.run(run()), indent=2))
+    finally:
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for Week 3
+Offline performance checks for the similarity search backends and the API
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+import numpy as np
+
+from ann_index import IVFIndex, recall_at_k
+from logging_config import configure_logging, shutdown_logging
+from similarity import SimilarityEngine
+
+
+def make_clustered_vectors(count, dimensions, clusters, seed=0):
+    """Generate normalized vectors grouped around random centres, like real embeddings"""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dimensions)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=count)
+    noise = rng.standard_normal((count, dimensions)).astype(np.float32) * 0.6
+    return centres[labels] + noise
+
+
+def bench_ann(args):
+    """Compare IVF recall and latency against exact search"""
+    vectors = make_clustered_vectors(args.count, args.dimensions, args.clusters, args.seed)
+    queries = make_clustered_vectors(args.queries, args.dimensions, args.clusters, args.seed + 1)
+
+    start = time.perf_counter()
+    exact = SimilarityEngine.from_vectors(vectors)
+    exact_build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    exact_results = [exact.search(query, args.top_k) for query in queries]
+    exact_latency = (time.perf_counter() - start) / len(queries)
+
+    start = time.perf_counter()
+    index = IVFIndex(dimensions=args.dimensions, nlist=args.nlist)
+    index.add(vectors)
+    if not index.is_trained:
+        index.train()
+    ivf_build = time.perf_counter() - start
+
+    print(f"{args.count} vectors x {args.dimensions} dims, {args.queries} queries, top_k={args.top_k}")
+    print(f"exact: build {exact_build:.2f}s, {exact_latency * 1000:.2f} ms/query")
+    print(f"ivf:   build {ivf_build:.2f}s, nlist={index.nlist}")
+    print(f"{'nprobe':>8} {'ms/query':>10} {'recall@k':>10} {'speedup':>8}")
+
+    for nprobe in args.nprobe:
+        start = time.perf_counter()
+        ivf_results = [index.search(query, args.top_k, nprobe=nprobe) for query in queries]
+        latency = (time.perf_counter() - start) / len(queries)
+        recall = recall_at_k(ivf_results, exact_results, args.top_k)
+        print(f"{nprobe:>8} {latency * 1000:>10.2f} {recall:>10.3f} {exact_latency / latency:>7.1f}x")
+
+
+def percentile(values, q):
+    """q-th percentile (0-100) of values by nearest rank"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def make_payload(endpoint, i):
+    """Request body for the i-th request; texts differ per request so caches miss"""
+    text = f"Request {i}: how do vector databases index embeddings for search?"
+    if endpoint == "/chat":
+        return {"messages": [{"role": "user", "content": text}]}
+    if endpoint == "/embed":
+        return {"text": text}
+    return {"query": text, "chunks": [f"chunk {j} about embeddings and search" for j in range(20)]}
+
+
+async def run_throughput(args):
+    # Imported here so the ann benchmark doesn't need the web stack
+    from httpx import AsyncClient, ASGITransport
+
+    import llm_utils
+    from backends import FakeBackend
+    from concurrency import ConcurrencyLimiter
+    from embedding_cache import EmbeddingCache
+    from main import app
+
+    logging.disable(logging.INFO)
+    llm_utils.llm_backend = FakeBackend(latency_ms=args.latency_ms, error_rate=args.error_rate)
+    llm_utils.embedding_cache = EmbeddingCache(path=None)
+    if not args.rate_limited:
+        # Upstream rate limits would dominate a benchmark of the service itself
+        llm_utils.limiter = ConcurrencyLimiter(max_concurrency=llm_utils.LLM_MAX_CONCURRENCY)
+
+    print(f"fake backend: {args.latency_ms} ms latency, {args.error_rate:.0%} errors, "
+          f"{args.requests} requests/endpoint at concurrency {args.concurrency}")
+    print(f"{'endpoint':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for endpoint in args.endpoints:
+            semaphore = asyncio.Semaphore(args.concurrency)
+            latencies = []
+            errors = 0
+
+            async def one(i):
+                nonlocal errors
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.post(endpoint, json=make_payload(endpoint, i))
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        errors += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(args.requests)))
+            elapsed = time.perf_counter() - start
+
+            print(f"{endpoint:<10} {args.requests / elapsed:>8.1f} "
+                  f"{percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 95) * 1000:>8.1f} "
+                  f"{percentile(latencies, 99) * 1000:>8.1f} {errors:>7}")
+
+
+def bench_throughput(args):
+    """Load-test API endpoints in-process against the fake LLM backend"""
+    asyncio.run(run_throughput(args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Week 3 offline benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ann = subparsers.add_parser("ann", help="IVF recall@k and latency vs exact search")
+    ann.add_argument("--count", type=int, default=100_000, help="Number of indexed vectors")
+    ann.add_argument("--dimensions", type=int, default=1536, help="Vector dimensions")
+    ann.add_argument("--clusters", type=int, default=200, help="Clusters in the synthetic data")
+    ann.add_argument("--queries", type=int, default=100, help="Number of queries")
+    ann.add_argument("--top-k", type=int, default=10, help="Neighbours per query")
+    ann.add_argument("--nlist", type=int, default=None, help="IVF lists (default sqrt(count))")
+    ann.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32],
+                     help="nprobe values to sweep")
+    ann.add_argument("--seed", type=int, default=0, help="Random seed")
+    ann.set_defaults(func=bench_ann)
+
+    throughput = subparsers.add_parser("throughput", help="API throughput against the fake LLM backend")
+    throughput.add_argument("--endpoints", nargs="+", default=["/chat", "/embed", "/similar"],
+                            choices=["/chat", "/embed", "/similar"], help="Endpoints to load")
+    throughput.add_argument("--requests", type=int, default=500, help="Requests per endpoint")
+    throughput.add_argument("--concurrency", type=int, default=50, help="Requests in flight at once")
+    throughput.add_argument("--latency-ms", type=float, default=20, help="Simulated upstream latency")
+    throughput.add_argument("--error-rate", type=float, default=0.0, help="Simulated upstream error rate")
+    throughput.add_argument("--rate-limited", action="store_true",
+                            help="Keep the configured RPM/TPM limits")
+    throughput.set_defaults(func=bench_throughput)
+
+    args = parser.parse_args()
+    configure_logging()
+    try:
+        args.func(args)
+    finally:
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
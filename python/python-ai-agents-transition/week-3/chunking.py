@@ -0,0 +1,263 @@
+"""
+Chunking Module for Week 3
+Streaming token-aware chunking for large documents and boundary-aware recursive splitting
+"""
+
+import re
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+import llm_utils
+
+# Characters per token when no tokenizer is available (matches chunk_text)
+CHARS_PER_TOKEN = 4
+
+_LAST_WHITESPACE = re.compile(r"\s(?=\S*\Z)")
+
+# Boundaries tried in order by split_recursive: paragraphs, sentences, words.
+# Each match marks where a new segment starts, so whitespace leads the next
+# segment the same way BPE attaches a leading space to the following word.
+SEPARATORS = [
+    re.compile(r"\n[ \t]*\n\s*"),
+    re.compile(r"(?<=[.!?])\s+"),
+    re.compile(r"\s+"),
+]
+
+
+def _codec(model: str) -> Tuple[Callable[[str], List[int]], Callable[[List[int]], str], int]:
+    # Without tiktoken, characters stand in for tokens at CHARS_PER_TOKEN per token
+    encoder = llm_utils.get_encoder(model)
+    if encoder is None:
+        return list, "".join, CHARS_PER_TOKEN
+    return encoder.encode_ordinary, encoder.decode, 1
+
+
+def _safe_cut(text: str, max_carry: int) -> int:
+    """Index up to which text can be tokenized without splitting a word"""
+    match = _LAST_WHITESPACE.search(text)
+    if match:
+        return match.start()
+    # No whitespace at all: give up on a clean cut rather than buffer forever
+    return len(text) if len(text) > max_carry else 0
+
+
+def iter_chunks(
+    windows: Iterable[str],
+    max_tokens: int = 1000,
+    overlap: int = 0,
+    model: str = "gpt-4o-mini",
+    max_carry: int = 64 * 1024
+) -> Iterator[str]:
+    """
+    Lazily split a stream of text windows into token-bounded chunks
+
+    Each window is tokenized up to its last whitespace; the remainder is
+    carried into the next window, so no word (and no multi-byte character)
+    is split into tokens that would differ from tokenizing the whole text.
+    Only the current window and the tokens not yet emitted are held in
+    memory, so peak memory depends on the window size, not the document.
+
+    Args:
+        windows: Iterable of text pieces, e.g. fixed-size reads from a file
+        max_tokens: Maximum tokens per chunk
+        overlap: Tokens repeated at the start of each following chunk
+        model: Model to use for tokenization
+        max_carry: Longest whitespace-free run carried between windows
+
+    Yields:
+        Text chunks in document order
+
+    Raises:
+        ValueError: If overlap is negative or not smaller than max_tokens
+    """
+    if not 0 <= overlap < max_tokens:
+        raise ValueError("overlap must be at least 0 and smaller than max_tokens")
+
+    encode, decode, scale = _codec(model)
+    size = max_tokens * scale
+    step = (max_tokens - overlap) * scale
+
+    carry = ""
+    tokens: List[int] = []
+    emitted = False
+
+    for window in windows:
+        text = carry + window
+        cut = _safe_cut(text, max_carry)
+        tokens.extend(encode(text[:cut]))
+        carry = text[cut:]
+
+        start = 0
+        while len(tokens) - start >= size:
+            yield decode(tokens[start:start + size])
+            emitted = True
+            start += step
+        # Trim once per window instead of re-slicing after every chunk
+        del tokens[:start]
+
+    tokens.extend(encode(carry))
+    start = 0
+    while len(tokens) - start > 0:
+        # Don't emit a tail made only of overlap from the previous chunk
+        if emitted and len(tokens) - start <= overlap * scale:
+            break
+        yield decode(tokens[start:start + size])
+        emitted = True
+        start += step
+
+
+def iter_file_chunks(
+    path: str,
+    max_tokens: int = 1000,
+    overlap: int = 0,
+    model: str = "gpt-4o-mini",
+    window_chars: int = 1024 * 1024,
+    encoding: str = "utf-8"
+) -> Iterator[str]:
+    """
+    Lazily chunk a text file without reading it into memory
+
+    Args:
+        path: Path of the file to chunk
+        max_tokens: Maximum tokens per chunk
+        overlap: Tokens repeated at the start of each following chunk
+        model: Model to use for tokenization
+        window_chars: Characters read per window
+        encoding: File encoding
+
+    Yields:
+        Text chunks in document order
+    """
+    def read_windows() -> Iterator[str]:
+        with open(path, encoding=encoding) as f:
+            while True:
+                window = f.read(window_chars)
+                if not window:
+                    return
+                yield window
+
+    yield from iter_chunks(read_windows(), max_tokens, overlap, model)
+
+
+def _split_at(text: str, separator: "re.Pattern[str]") -> List[str]:
+    cuts = [m.start() for m in separator.finditer(text) if m.start() > 0]
+    bounds = [0] + cuts + [len(text)]
+    return [text[a:b] for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+def split_segments(
+    text: str,
+    max_tokens: int = 1000,
+    model: str = "gpt-4o-mini",
+    level: int = 0
+) -> List[Tuple[str, int]]:
+    """
+    Break text into (segment, tokens) pairs that each fit in max_tokens
+
+    Segments are cut at the coarsest boundary in SEPARATORS that works; only
+    segments that are still too long are cut again at the next level.
+    Concatenating the segments gives back the original text.
+
+    Args:
+        text: Text to split
+        max_tokens: Maximum tokens per segment
+        model: Model to use for tokenization
+        level: Index of the first separator in SEPARATORS to try
+
+    Returns:
+        List of (segment text, token count) pairs
+    """
+    if level == len(SEPARATORS):
+        # Nothing left to split on (e.g. one enormous word): cut by tokens
+        chunks, chunk_tokens, _ = llm_utils.chunk_text_with_counts(text, max_tokens, model)
+        return list(zip(chunks, chunk_tokens))
+
+    pieces = _split_at(text, SEPARATORS[level])
+    segments = []
+    for piece, tokens in zip(pieces, llm_utils.count_tokens_many(pieces, model)):
+        if tokens <= max_tokens:
+            segments.append((piece, tokens))
+        else:
+            segments.extend(split_segments(piece, max_tokens, model, level + 1))
+    return segments
+
+
+def merge_segments(
+    segments: List[Tuple[str, int]],
+    max_tokens: int = 1000,
+    overlap: int = 0
+) -> List[Tuple[str, int]]:
+    """
+    Greedily merge adjacent segments into chunks of at most max_tokens
+
+    Chunk sizes are the sum of their segments' counts, so merged chunks are
+    never re-encoded. With overlap, each chunk starts with the trailing whole
+    segments of the previous chunk that fit in overlap tokens.
+
+    Args:
+        segments: (segment text, token count) pairs from split_segments
+        max_tokens: Maximum tokens per chunk
+        overlap: Maximum tokens repeated at the start of each following chunk
+
+    Returns:
+        List of (chunk text, token count) pairs
+
+    Raises:
+        ValueError: If overlap is negative or not smaller than max_tokens
+    """
+    if not 0 <= overlap < max_tokens:
+        raise ValueError("overlap must be at least 0 and smaller than max_tokens")
+
+    chunks: List[Tuple[str, int]] = []
+    current: List[Tuple[str, int]] = []
+    current_tokens = 0
+
+    for segment, tokens in segments:
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(("".join(piece for piece, _ in current), current_tokens))
+
+            # Seed the next chunk with trailing segments that fit in the overlap
+            carried: List[Tuple[str, int]] = []
+            carried_tokens = 0
+            for piece, piece_tokens in reversed(current):
+                if carried_tokens + piece_tokens > overlap or carried_tokens + piece_tokens + tokens > max_tokens:
+                    break
+                carried.insert(0, (piece, piece_tokens))
+                carried_tokens += piece_tokens
+            current, current_tokens = carried, carried_tokens
+
+        current.append((segment, tokens))
+        current_tokens += tokens
+
+    if current:
+        chunks.append(("".join(piece for piece, _ in current), current_tokens))
+    return chunks
+
+
+def split_recursive(
+    text: str,
+    max_tokens: int = 1000,
+    overlap: int = 0,
+    model: str = "gpt-4o-mini"
+) -> List[Tuple[str, int]]:
+    """
+    Split text at the coarsest natural boundary that keeps chunks within max_tokens
+
+    Text is cut into paragraphs; paragraphs that are too long are cut into
+    sentences, and sentences into words. Adjacent segments are then merged
+    greedily up to max_tokens (see merge_segments).
+
+    Args:
+        text: Text to chunk
+        max_tokens: Maximum tokens per chunk
+        overlap: Maximum tokens repeated at the start of each following chunk
+        model: Model to use for tokenization
+
+    Returns:
+        List of (chunk text, token count) pairs
+
+    Raises:
+        ValueError: If overlap is negative or not smaller than max_tokens
+    """
+    if not 0 <= overlap < max_tokens:
+        raise ValueError("overlap must be at least 0 and smaller than max_tokens")
+    return merge_segments(split_segments(text, max_tokens, model), max_tokens, overlap)
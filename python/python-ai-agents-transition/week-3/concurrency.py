@@ -0,0 +1,299 @@
+"""
+Concurrency Utilities for Week 3
+Bounded fan-out, rate limiting, request coalescing and micro-batching for upstream LLM calls
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter for requests per minute (RPM) and tokens per minute (TPM)
+
+    Each bucket refills continuously at its per-minute rate and holds at most
+    one minute's worth of capacity. Callers wait until both buckets can cover
+    the request instead of sending it and getting a 429 back.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None
+    ):
+        self.requests_per_minute = requests_per_minute or None
+        self.tokens_per_minute = tokens_per_minute or None
+        self._available_requests = float(self.requests_per_minute or 0)
+        self._available_tokens = float(self.tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        # asyncio primitives are bound to one event loop, so rebuild on a new loop
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+        return self._lock
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+
+        if self.requests_per_minute:
+            self._available_requests = min(
+                self.requests_per_minute,
+                self._available_requests + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute:
+            self._available_tokens = min(
+                self.tokens_per_minute,
+                self._available_tokens + elapsed * self.tokens_per_minute / 60
+            )
+
+    def _wait_time(self, tokens: int) -> float:
+        wait = 0.0
+        if self.requests_per_minute and self._available_requests < 1:
+            wait = max(wait, (1 - self._available_requests) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and self._available_tokens < tokens:
+            wait = max(wait, (tokens - self._available_tokens) * 60 / self.tokens_per_minute)
+        return wait
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """
+        Wait until one request and the given number of tokens are available
+
+        Args:
+            tokens: Estimated tokens the request will consume
+        """
+        if self.tokens_per_minute:
+            # A request larger than the whole bucket could never fit; let it through once full
+            tokens = min(tokens, self.tokens_per_minute)
+
+        # Waiters queue on the lock, so capacity is handed out in arrival order
+        async with self._get_lock():
+            while True:
+                self._refill()
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            if self.requests_per_minute:
+                self._available_requests -= 1
+            if self.tokens_per_minute:
+                self._available_tokens -= tokens
+
+    def adjust(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """
+        Correct the token bucket once the real usage of a request is known
+
+        Args:
+            estimated_tokens: Tokens reserved when the request was acquired
+            actual_tokens: Tokens the API reported as used
+        """
+        if self.tokens_per_minute:
+            self._available_tokens -= actual_tokens - estimated_tokens
+
+
+class ConcurrencyLimiter:
+    """
+    Caps in-flight upstream requests with a semaphore and paces them with a RateLimiter
+
+    Callers can fan out freely with asyncio.gather; every request goes through
+    limit(), so at most max_concurrency of them run at once. Rate-limit
+    capacity is taken before a slot, so callers waiting on the RPM/TPM budget
+    don't hold slots that requests with budget could use.
+    """
+
+    def __init__(self, max_concurrency: int = 8, rate_limiter: Optional[RateLimiter] = None):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = rate_limiter
+        self.in_flight = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    @asynccontextmanager
+    async def limit(self, tokens: int = 0) -> AsyncIterator[None]:
+        """
+        Hold a concurrency slot and rate-limit capacity for one upstream request
+
+        Args:
+            tokens: Estimated tokens the request will consume
+        """
+        if self.rate_limiter:
+            await self.rate_limiter.acquire(tokens)
+        async with self._get_semaphore():
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    def report_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Feed actual token usage back into the rate limiter"""
+        if self.rate_limiter:
+            self.rate_limiter.adjust(estimated_tokens, actual_tokens)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one execution
+
+    The first caller for a key starts the call; callers arriving while it is
+    still running await the same task instead of starting their own. Once it
+    finishes the key is forgotten, so later calls run again (pair this with a
+    cache to reuse finished results).
+
+    Waiters are shielded from each other: a caller that is cancelled stops
+    waiting without cancelling the shared call for everyone else.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, "asyncio.Task"] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run fn() unless a call with the same key is already in flight
+
+        Args:
+            key: Identity of the call; equal keys must mean equal results
+            fn: Zero-argument coroutine function that performs the call
+
+        Returns:
+            The result of the (possibly shared) call
+
+        Raises:
+            Exception: Whatever the shared call raised, re-raised to every waiter
+        """
+        task = self._calls.get(key)
+        # Tasks are bound to one event loop, so never share across loops
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            self.shared += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(fn())
+        self._calls[key] = task
+        self.calls += 1
+
+        def forget(done: "asyncio.Task") -> None:
+            if self._calls.get(key) is done:
+                del self._calls[key]
+            if not done.cancelled():
+                # Mark the exception as retrieved even if every waiter was cancelled
+                done.exception()
+
+        task.add_done_callback(forget)
+        return await asyncio.shield(task)
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Groups individually submitted items into batches for one upstream call
+
+    The first item of a batch starts a max_wait_ms timer. The batch is sent
+    when the timer fires or as soon as it holds max_batch_size items,
+    whichever comes first, so a lone request waits at most max_wait_ms.
+
+    fn receives the batch in submission order and must return one result per
+    item. A result that is an exception is raised to that item's caller only;
+    if fn itself raises, every caller in the batch gets the error.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[T]], Awaitable[List[R]]],
+        max_batch_size: int = 64,
+        max_wait_ms: float = 10
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.batches = 0
+        self.items = 0
+        self._pending: List[Tuple[T, "asyncio.Future[R]"]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: set = set()
+
+    async def submit(self, item: T) -> R:
+        """
+        Add an item to the current batch and wait for its result
+
+        Args:
+            item: Input for fn
+
+        Returns:
+            The result fn produced for this item
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Pending futures and timers belong to the old loop; start fresh
+            self._pending = []
+            self._timer = None
+            self._loop = loop
+
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # Keep a reference so the task isn't garbage collected mid-flight
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[T, "asyncio.Future[R]"]]) -> None:
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await self.fn([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"Batch function returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,168 @@
+"""
+Context Window Module for Week 3
+Token-budgeted conversation history: incremental counting, trimming and summarization of old turns
+"""
+
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import llm_utils
+from backends import LLMBackend
+
+# Tokens the chat format adds around each message, and to prime the reply
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+Summarizer = Callable[[List[Dict[str, Any]]], Awaitable[str]]
+
+
+def count_messages(messages: List[Dict[str, Any]], model: str = "gpt-4o-mini") -> List[Tuple[Dict[str, Any], int]]:
+    """Pair each message with its token count, including MESSAGE_OVERHEAD"""
+    counts = llm_utils.count_tokens_many([m.get("content") or "" for m in messages], model)
+    return [(message, count + MESSAGE_OVERHEAD) for message, count in zip(messages, counts)]
+
+
+class ConversationContext:
+    """
+    Conversation history that stays within a token budget
+
+    Each message is counted once, when it is appended, and the running
+    total is kept up to date, so appending a turn never recounts the
+    history. When the total exceeds max_tokens the oldest turns are
+    dropped; the system prompt and the latest turn are always kept.
+    Dropped turns are held until summarize() folds them into a summary
+    message placed right after the system prompt.
+    """
+
+    def __init__(self, max_tokens: int, model: str = "gpt-4o-mini"):
+        if max_tokens < 1:
+            raise ValueError("max_tokens must be at least 1")
+
+        self.max_tokens = max_tokens
+        self.model = model
+        self.system: Optional[Tuple[Dict[str, Any], int]] = None
+        self.summary: Optional[Tuple[Dict[str, Any], int]] = None
+        self._turns: Deque[Tuple[Dict[str, Any], int]] = deque()
+        self._turn_tokens = 0
+        # Turns trimmed since the last summarize()
+        self.dropped: List[Dict[str, Any]] = []
+
+    @property
+    def tokens(self) -> int:
+        """Tokens the current messages take up, including the reply priming"""
+        fixed = sum(entry[1] for entry in (self.system, self.summary) if entry is not None)
+        return fixed + self._turn_tokens + REPLY_OVERHEAD
+
+    @property
+    def messages(self) -> List[Dict[str, Any]]:
+        """Messages to send: system prompt, summary of dropped turns, then recent turns"""
+        head = [entry[0] for entry in (self.system, self.summary) if entry is not None]
+        return head + [message for message, _ in self._turns]
+
+    def append(self, message: Dict[str, Any]) -> None:
+        """Add one message, trimming old turns if the budget is exceeded"""
+        self.extend([message])
+
+    def extend(self, messages: List[Dict[str, Any]]) -> None:
+        """
+        Add messages in order, trimming old turns if the budget is exceeded
+
+        The texts are counted in one count_tokens_many call. A system message
+        arriving before any turn becomes the system prompt.
+        """
+        self.extend_counted(count_messages(messages, self.model))
+
+    def extend_counted(self, entries: List[Tuple[Dict[str, Any], int]]) -> None:
+        """Add (message, tokens) pairs counted earlier, e.g. history loaded from a session store"""
+        for message, tokens in entries:
+            if message.get("role") == "system" and self.system is None and not self._turns:
+                self.system = (message, tokens)
+            else:
+                self._turns.append((message, tokens))
+                self._turn_tokens += tokens
+        self._trim()
+
+    def _trim(self) -> None:
+        while self.tokens > self.max_tokens and len(self._turns) > 1:
+            self._drop_oldest()
+            # Tool results are meaningless without the assistant turn that called the tool
+            while len(self._turns) > 1 and self._turns[0][0].get("role") == "tool":
+                self._drop_oldest()
+
+    def _drop_oldest(self) -> None:
+        message, tokens = self._turns.popleft()
+        self._turn_tokens -= tokens
+        self.dropped.append(message)
+
+    async def summarize(self, summarizer: Summarizer) -> None:
+        """
+        Fold the dropped turns (and any previous summary) into one summary message
+
+        Args:
+            summarizer: Coroutine function turning messages into summary text
+        """
+        if not self.dropped:
+            return
+
+        earlier = [self.summary[0]] if self.summary else []
+        text = await summarizer(earlier + self.dropped)
+        message = {"role": "system", "content": SUMMARY_PREFIX + text}
+        self.summary = (message, llm_utils.count_tokens(message["content"], self.model) + MESSAGE_OVERHEAD)
+        self.dropped = []
+        self._trim()
+
+
+async def summarize_turns(
+    messages: List[Dict[str, Any]],
+    model: str = "gpt-4o-mini",
+    llm_backend: Optional[LLMBackend] = None
+) -> str:
+    """
+    Summarize conversation turns with one chat completion
+
+    Args:
+        messages: Turns to summarize
+        model: Model to use
+        llm_backend: Backend to call (defaults to llm_utils' backend)
+
+    Returns:
+        Summary text
+    """
+    transcript = "\n".join(f"{m.get('role')}: {m.get('content') or ''}" for m in messages)
+    return await llm_utils.get_chat_response(
+        [
+            {"role": "system", "content": "Summarize this conversation in a few sentences. "
+                                          "Keep the facts, names and decisions needed to continue it."},
+            {"role": "user", "content": transcript},
+        ],
+        model=model,
+        temperature=0.0,
+        llm_backend=llm_backend
+    )
+
+
+async def fit_messages(
+    messages: List[Dict[str, Any]],
+    max_tokens: int,
+    model: str = "gpt-4o-mini",
+    summarizer: Optional[Summarizer] = None
+) -> List[Dict[str, Any]]:
+    """
+    Fit a conversation into max_tokens
+
+    Args:
+        messages: Full conversation, system prompt first
+        max_tokens: Token budget for the prompt
+        model: Model to use for tokenization
+        summarizer: If given, dropped turns are summarized instead of discarded
+
+    Returns:
+        The messages to send
+    """
+    context = ConversationContext(max_tokens, model)
+    context.extend(messages)
+    if summarizer is not None:
+        await context.summarize(summarizer)
+    return context.messages
@@ -0,0 +1,7 @@
+import llm_utils
+from backends import LLMBackend
+
+async def get_llm_backend() -> LLMBackend:
+    """Dependency to get the LLM backend (override it in tests via app.dependency_overrides)"""
+    # async so FastAPI resolves it inline instead of in its threadpool
+    return llm_utils.get_llm_backend()
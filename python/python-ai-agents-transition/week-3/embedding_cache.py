@@ -0,0 +1,306 @@
+"""
+Embedding Cache Module for Week 3
+Content-addressed two-tier cache: in-memory LRU in front of a size-bounded SQLite store
+"""
+
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """
+    Cache embeddings keyed by (model, SHA-256 of text)
+
+    Lookups hit the in-memory LRU first, then the SQLite tier, where vectors are
+    stored as float32 blobs. Disk hits are promoted into memory. When the SQLite
+    tier grows past max_disk_bytes, the least recently used rows are evicted.
+
+    The database is opened on first disk access (or by open()), not when the
+    cache is built. Memory entries are tuples and callers get fresh lists, so
+    mutating a returned vector can't corrupt the cache. Disk hits only note
+    their access time; the updates are written with the next store, or once
+    TOUCH_FLUSH_SIZE have piled up, instead of committing on every read.
+    get_many_async and put_many_async run the SQLite work in a thread.
+    """
+
+    TOUCH_FLUSH_SIZE = 1000
+
+    def __init__(
+        self,
+        path: Optional[str] = "embedding_cache.sqlite3",
+        max_memory_items: int = 10_000,
+        max_disk_bytes: int = 512 * 1024 * 1024
+    ):
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, Tuple[float, ...]]" = OrderedDict()
+        # Guards the memory tier and counters; _disk_lock serializes SQLite work
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._touched: Dict[str, float] = {}
+        self._disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def open(self) -> None:
+        """Open the SQLite tier; a no-op when already open or memory-only"""
+        with self._disk_lock:
+            self._connect()
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self._conn is None and self.path:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)"
+            )
+            self._conn.commit()
+            row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()
+            self._disk_bytes = row[0]
+        return self._conn
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        """Build the content address for a (model, text) pair"""
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model}:{digest}"
+
+    def _remember(self, key: str, embedding: Tuple[float, ...]) -> None:
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Look up embeddings for several texts
+
+        Args:
+            model: Embedding model the vectors were produced with
+            texts: Texts to look up
+
+        Returns:
+            One entry per text: the cached vector, or None on a miss
+        """
+        results, missing = self._get_memory(model, texts)
+        if missing and self.path:
+            self._get_disk(results, missing)
+        return self._finish_get(results, missing)
+
+    async def get_many_async(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """get_many that reads the SQLite tier in a worker thread"""
+        results, missing = self._get_memory(model, texts)
+        if missing and self.path:
+            await asyncio.to_thread(self._get_disk, results, missing)
+        return self._finish_get(results, missing)
+
+    def _get_memory(
+        self, model: str, texts: List[str]
+    ) -> Tuple[List[Optional[List[float]]], Dict[str, List[int]]]:
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        missing: Dict[str, List[int]] = {}
+        with self._lock:
+            for i, text in enumerate(texts):
+                key = self.make_key(model, text)
+                embedding = self._memory.get(key)
+                if embedding is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = list(embedding)
+                    self.memory_hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+        return results, missing
+
+    def _get_disk(self, results: List[Optional[List[float]]], missing: Dict[str, List[int]]) -> None:
+        """Fill results from the SQLite tier, removing the keys found from missing"""
+        with self._disk_lock:
+            if self._connect() is None:
+                return
+            found = self._load(list(missing))
+        with self._lock:
+            for key, embedding in found.items():
+                self._remember(key, embedding)
+                for i in missing.pop(key):
+                    results[i] = list(embedding)
+                    self.disk_hits += 1
+
+    def _finish_get(
+        self, results: List[Optional[List[float]]], missing: Dict[str, List[int]]
+    ) -> List[Optional[List[float]]]:
+        with self._lock:
+            self.misses += sum(len(indices) for indices in missing.values())
+        return results
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """Look up the embedding for one text, or None on a miss"""
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, texts: List[str], embeddings: List[List[float]]) -> None:
+        """
+        Store embeddings for several texts in both tiers
+
+        Args:
+            model: Embedding model the vectors were produced with
+            texts: Texts that were embedded
+            embeddings: Vectors in the same order as texts
+        """
+        rows = self._put_memory(model, texts, embeddings)
+        if rows:
+            self._put_disk(rows)
+
+    async def put_many_async(self, model: str, texts: List[str], embeddings: List[List[float]]) -> None:
+        """put_many that writes the SQLite tier in a worker thread"""
+        rows = self._put_memory(model, texts, embeddings)
+        if rows:
+            await asyncio.to_thread(self._put_disk, rows)
+
+    def _put_memory(self, model: str, texts: List[str], embeddings: List[List[float]]) -> List[tuple]:
+        """Store in memory and return the rows for the SQLite tier"""
+        rows = []
+        now = time.time()
+
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = self.make_key(model, text)
+                self._remember(key, tuple(embedding))
+                if self.path:
+                    blob = array("f", embedding).tobytes()
+                    rows.append((key, model, blob, len(blob), now))
+        return rows
+
+    def _put_disk(self, rows: List[tuple]) -> None:
+        with self._disk_lock:
+            if self._connect() is not None:
+                self._store(rows)
+
+    def put(self, model: str, text: str, embedding: List[float]) -> None:
+        """Store the embedding for one text"""
+        self.put_many(model, [text], [embedding])
+
+    def _load(self, keys: Sequence[str]) -> Dict[str, Tuple[float, ...]]:
+        found: Dict[str, Tuple[float, ...]] = {}
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            for key, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[key] = tuple(vector)
+
+        if found:
+            now = time.time()
+            self._touched.update((key, now) for key in found)
+            if len(self._touched) >= self.TOUCH_FLUSH_SIZE:
+                self._flush_touched()
+                self._conn.commit()
+        return found
+
+    def _flush_touched(self) -> None:
+        """Write the access times of disk hits noted since the last flush"""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(now, key) for key, now in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def _store(self, rows: List[tuple]) -> None:
+        # Identical texts in one call map to one row
+        rows = list({row[0]: row for row in rows}.values())
+        keys = [row[0] for row in rows]
+        replaced = 0
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            replaced += self._conn.execute(
+                f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({placeholders})",
+                batch
+            ).fetchone()[0]
+
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, model, vector, size, last_access) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        self._disk_bytes += sum(row[3] for row in rows) - replaced
+        # Eviction orders by access time, so pending touches must land first
+        self._flush_touched()
+        self._evict()
+        self._conn.commit()
+
+    def _evict(self) -> None:
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+
+        # Evict down to 90% of the budget so we don't evict on every insert
+        target = int(self.max_disk_bytes * 0.9)
+        freed = 0
+        evicted = []
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM embeddings ORDER BY last_access ASC"
+        ):
+            if self._disk_bytes - freed <= target:
+                break
+            evicted.append((key,))
+            freed += size
+
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+        self._disk_bytes -= freed
+        logger.info("Evicted %d embeddings (%d bytes) from disk cache", len(evicted), freed)
+
+    def clear(self) -> None:
+        """Drop every cached embedding from both tiers"""
+        with self._lock:
+            self._memory.clear()
+        with self._disk_lock:
+            if self._connect() is not None:
+                self._touched.clear()
+                self._conn.execute("DELETE FROM embeddings")
+                self._conn.commit()
+            self._disk_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and tier sizes"""
+        return {
+            "memory_items": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
+
+    def close(self) -> None:
+        """Write pending access times and close the SQLite connection"""
+        with self._disk_lock:
+            if self._conn is not None:
+                self._flush_touched()
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
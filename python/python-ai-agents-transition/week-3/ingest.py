@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Ingestion Module for Week 3
+Parallel read -> chunk -> embed -> write pipeline for bulk loading documents into a collection
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import fnmatch
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import llm_utils
+from backends import LLMBackend
+from chunking import split_recursive
+from vector_store import Collection, CollectionNotFoundError, VectorStore
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = "ingested.jsonl"
+DEFAULT_PATTERNS = ("*.txt", "*.md")
+
+
+class Document(NamedTuple):
+    id: str
+    path: Optional[str] = None
+    text: Optional[str] = None
+
+
+class _Chunked(NamedTuple):
+    document: Document
+    digest: str
+    chunks: List[str]
+
+
+def discover_documents(root: str, patterns: Iterable[str] = DEFAULT_PATTERNS) -> List[Document]:
+    """
+    Find files under root matching any pattern
+
+    Returns:
+        Documents in path order, with ids relative to root
+    """
+    patterns = list(patterns)
+    documents = []
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                path = os.path.join(directory, name)
+                documents.append(Document(id=os.path.relpath(path, root), path=path))
+    return sorted(documents)
+
+
+def create_chunk_pool(processes: Optional[int] = None) -> Optional[concurrent.futures.ProcessPoolExecutor]:
+    """
+    Process pool for chunking, or None to chunk in threads
+
+    Workers are spawned rather than forked, so the pool can be created from
+    a process that already runs threads (such as the API server).
+
+    Args:
+        processes: Worker processes (None for one per CPU, 0 for no pool)
+    """
+    workers = processes if processes is not None else (os.cpu_count() or 1)
+    if not workers:
+        return None
+    return concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+# Recorded in the checkpoint with the chunk size, so changing the splitter re-chunks everything
+CHUNK_STRATEGY = "recursive"
+
+
+def _chunk_document(text: str, max_tokens: int, overlap: int, model: str) -> List[str]:
+    # Runs in a worker process: tokenization is CPU-bound and holds the GIL
+    return [chunk for chunk, _ in split_recursive(text, max_tokens, overlap, model) if chunk.strip()]
+
+
+class IngestProgress:
+    """Counters updated by the pipeline as documents move through it"""
+
+    def __init__(self):
+        self.documents_total = 0
+        self.documents_done = 0
+        self.documents_skipped = 0
+        self.documents_failed = 0
+        self.chunks_written = 0
+        self.started = time.perf_counter()
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "documents_total": self.documents_total,
+            "documents_done": self.documents_done,
+            "documents_skipped": self.documents_skipped,
+            "documents_failed": self.documents_failed,
+            "chunks_written": self.chunks_written,
+            "elapsed_seconds": round(elapsed, 2),
+            "chunks_per_second": round(self.chunks_written / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+class Checkpoint:
+    """
+    Append-only log of finished documents, used to resume an interrupted run
+
+    A document is recorded only after all its chunks are written, with the
+    hash of its text and the chunking settings used, so a rerun skips it
+    unless its content or the settings changed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Dict[str, Tuple[str, int, Optional[Dict[str, Any]]]] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A crash can leave a partial last line
+                        continue
+                    # Records from before settings were logged never match, so those documents are redone
+                    self.done[record["id"]] = (record["sha256"], record["chunks"], record.get("chunking"))
+
+    def is_done(self, document_id: str, digest: str, chunking: Dict[str, Any]) -> bool:
+        entry = self.done.get(document_id)
+        return entry is not None and entry[0] == digest and entry[2] == chunking
+
+    def previous_chunks(self, document_id: str) -> int:
+        entry = self.done.get(document_id)
+        return entry[1] if entry else 0
+
+    def record(self, items: List[Tuple[str, str, int]], chunking: Dict[str, Any]) -> None:
+        """Record (document id, sha256, chunk count) triples chunked with the given settings"""
+        with open(self.path, "a") as f:
+            for document_id, digest, chunks in items:
+                f.write(json.dumps(
+                    {"id": document_id, "sha256": digest, "chunks": chunks, "chunking": chunking}
+                ) + "\n")
+                self.done[document_id] = (digest, chunks, chunking)
+
+
+def chunk_ids(document_id: str, count: int, start: int = 0) -> List[str]:
+    return [f"{document_id}#{i}" for i in range(start, count)]
+
+
+async def ingest(
+    documents: Iterable[Document],
+    collection: Collection,
+    max_tokens: int = 500,
+    overlap: int = 0,
+    chunk_model: str = "gpt-4o-mini",
+    processes: Optional[int] = None,
+    embed_workers: int = llm_utils.LLM_MAX_CONCURRENCY,
+    batch_size: int = 256,
+    queue_size: int = 64,
+    checkpoint_path: Optional[str] = None,
+    llm_backend: Optional[LLMBackend] = None,
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    pool: Optional[concurrent.futures.Executor] = None
+) -> IngestProgress:
+    """
+    Chunk, embed and store documents
+
+    Four stages run concurrently, connected by queues of at most queue_size
+    items: a reader, chunkers in a process pool, embedders that send
+    batches of about batch_size chunks through llm_utils (so the shared
+    rate limiter paces them), and a single writer. A full queue pauses the
+    stages before it, so memory stays bounded however large the corpus.
+
+    Finished documents are recorded in a checkpoint (by default in the
+    collection directory). Rerunning after a crash skips recorded documents
+    whose text and chunking settings are unchanged; chunk ids are deterministic, so documents
+    that were partly written are simply overwritten. If any stage fails,
+    the others are cancelled and the error is raised.
+
+    Args:
+        documents: Documents to ingest; ones without text are read from path
+        collection: Collection to write to (its model is used for embeddings)
+        max_tokens: Maximum tokens per chunk
+        overlap: Maximum tokens repeated between neighbouring chunks
+        chunk_model: Model to use for tokenization when chunking
+        processes: Chunking processes (None for one per CPU, 0 to chunk in threads);
+            with a pool, the number of documents chunked at once
+        embed_workers: Embedding batches in flight at once
+        batch_size: Chunks per embedding batch
+        queue_size: Capacity of each inter-stage queue
+        checkpoint_path: Where to record finished documents
+        llm_backend: Backend to call (defaults to get_llm_backend())
+        on_progress: Called with a progress snapshot after each written batch
+        pool: Shared chunking pool (see create_chunk_pool); without one, a pool
+            is started for this call and shut down at the end
+
+    Returns:
+        Final progress counters
+    """
+    documents = list(documents)
+    progress = IngestProgress()
+    progress.documents_total = len(documents)
+    checkpoint = Checkpoint(checkpoint_path or os.path.join(collection.path, CHECKPOINT_FILE))
+    chunking = {"strategy": CHUNK_STRATEGY, "max_tokens": max_tokens, "overlap": overlap, "model": chunk_model}
+    chunk_workers = processes if processes is not None else (os.cpu_count() or 1)
+    owns_pool = pool is None and chunk_workers > 0
+    if owns_pool:
+        pool = create_chunk_pool(chunk_workers)
+    elif not chunk_workers:
+        pool = None
+    loop = asyncio.get_running_loop()
+
+    documents_q: "asyncio.Queue[Optional[Tuple[Document, str, str]]]" = asyncio.Queue(queue_size)
+    chunked_q: "asyncio.Queue[Optional[_Chunked]]" = asyncio.Queue(queue_size)
+    embedded_q: "asyncio.Queue[Optional[Tuple[List[_Chunked], List[List[float]]]]]" = asyncio.Queue(queue_size)
+
+    def fail(document: Document, error: Exception) -> None:
+        logger.error("Failed to ingest %s: %s", document.id, error)
+        progress.documents_failed += 1
+
+    async def read() -> None:
+        for document in documents:
+            try:
+                text = document.text
+                if text is None:
+                    text = await asyncio.to_thread(_read_text, document.path)
+            except OSError as e:
+                fail(document, e)
+                continue
+            digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            if checkpoint.is_done(document.id, digest, chunking):
+                progress.documents_skipped += 1
+                continue
+            await documents_q.put((document, digest, text))
+
+    async def chunk() -> None:
+        while (item := await documents_q.get()) is not None:
+            document, digest, text = item
+            try:
+                if pool is None:
+                    chunks = await asyncio.to_thread(_chunk_document, text, max_tokens, overlap, chunk_model)
+                else:
+                    chunks = await loop.run_in_executor(pool, _chunk_document, text, max_tokens, overlap, chunk_model)
+            except Exception as e:
+                fail(document, e)
+                continue
+            await chunked_q.put(_Chunked(document, digest, chunks))
+
+    async def embed() -> None:
+        done = False
+        while not done:
+            item = await chunked_q.get()
+            if item is None:
+                break
+            # Fill the batch with whatever is already waiting, without splitting documents
+            batch = [item]
+            size = len(item.chunks)
+            while size < batch_size and not chunked_q.empty():
+                item = chunked_q.get_nowait()
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+                size += len(item.chunks)
+
+            texts = [text for chunked in batch for text in chunked.chunks]
+            try:
+                vectors = await llm_utils.get_embeddings(texts, collection.model, llm_backend=llm_backend)
+            except Exception as e:
+                for chunked in batch:
+                    fail(chunked.document, e)
+                continue
+            await embedded_q.put((batch, vectors))
+
+    async def write() -> None:
+        while (item := await embedded_q.get()) is not None:
+            batch, vectors = item
+            ids, texts, stale = [], [], []
+            for chunked in batch:
+                ids.extend(chunk_ids(chunked.document.id, len(chunked.chunks)))
+                texts.extend(chunked.chunks)
+                # A shorter new version leaves old trailing chunks behind
+                previous = checkpoint.previous_chunks(chunked.document.id)
+                stale.extend(chunk_ids(chunked.document.id, previous, start=len(chunked.chunks)))
+            try:
+                await asyncio.to_thread(_write_batch, collection, ids, texts, vectors, stale)
+            except Exception as e:
+                for chunked in batch:
+                    fail(chunked.document, e)
+                continue
+            checkpoint.record([(c.document.id, c.digest, len(c.chunks)) for c in batch], chunking)
+
+            progress.documents_done += len(batch)
+            progress.chunks_written += len(ids)
+            if on_progress:
+                on_progress(progress.snapshot())
+
+    chunkers = [asyncio.create_task(chunk()) for _ in range(max(chunk_workers, 1))]
+    embedders = [asyncio.create_task(embed()) for _ in range(max(embed_workers, 1))]
+    writer = asyncio.create_task(write())
+
+    async def drive() -> None:
+        # Shut the stages down in order: each gets one sentinel per worker once its producers finish
+        await read()
+        for _ in chunkers:
+            await documents_q.put(None)
+        await asyncio.gather(*chunkers)
+        for _ in embedders:
+            await chunked_q.put(None)
+        await asyncio.gather(*embedders)
+        await embedded_q.put(None)
+        await writer
+
+    tasks = [asyncio.create_task(drive())] + chunkers + embedders + [writer]
+    try:
+        # A stage that dies would leave its neighbours blocked on a full or empty queue, so stop at the first error
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if owns_pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    logger.info("Ingestion finished: %s", progress.snapshot())
+    return progress
+
+
+def _read_text(path: str) -> str:
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def _write_batch(
+    collection: Collection,
+    ids: List[str],
+    texts: List[str],
+    vectors: List[List[float]],
+    stale: List[str]
+) -> None:
+    collection.upsert(ids, texts, vectors)
+    if stale:
+        collection.delete(stale)
+
+
+def main():
+    from logging_config import configure_logging, shutdown_logging
+
+    parser = argparse.ArgumentParser(description="Ingest a directory of documents into a vector collection")
+    parser.add_argument("root", help="Directory to ingest")
+    parser.add_argument("--collection", required=True, help="Collection name (created if missing)")
+    parser.add_argument("--store", default=os.getenv("VECTOR_STORE_PATH", "vector_store"), help="Vector store directory")
+    parser.add_argument("--model", default="text-embedding-3-small", help="Embedding model for a new collection")
+    parser.add_argument("--pattern", nargs="+", default=list(DEFAULT_PATTERNS), help="File name patterns")
+    parser.add_argument("--max-tokens", type=int, default=500, help="Maximum tokens per chunk")
+    parser.add_argument("--overlap", type=int, default=0, help="Tokens repeated between chunks")
+    parser.add_argument("--processes", type=int, default=None, help="Chunking processes (default: one per CPU)")
+    parser.add_argument("--embed-workers", type=int, default=llm_utils.LLM_MAX_CONCURRENCY,
+                        help="Embedding batches in flight")
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks per embedding batch")
+    args = parser.parse_args()
+
+    configure_logging()
+    store = VectorStore(args.store)
+    try:
+        collection = store.get_collection(args.collection)
+    except CollectionNotFoundError:
+        collection = store.create_collection(args.collection, args.model)
+
+    def report(snapshot: Dict[str, Any]) -> None:
+        print(
+            f"\r{snapshot['documents_done'] + snapshot['documents_skipped']}/{snapshot['documents_total']} documents, "
+            f"{snapshot['chunks_written']} chunks, {snapshot['chunks_per_second']} chunks/s, "
+            f"{snapshot['documents_failed']} failed",
+            end="", flush=True
+        )
+
+    async def run() -> IngestProgress:
+        try:
+            return await ingest(
+                discover_documents(args.root, args.pattern),
+                collection,
+                max_tokens=args.max_tokens,
+                overlap=args.overlap,
+                processes=args.processes,
+                embed_workers=args.embed_workers,
+                batch_size=args.batch_size,
+                on_progress=report,
+            )
+        finally:
+            await llm_utils.close()
+
+    try:
+        progress = asyncio.run(run())
+    finally:
+        shutdown_logging()
+    print()
+    print(json.dumps(progress.snapshot(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Jobs Module for Week 3
+In-process registry of long-running background jobs started from API requests
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class JobNotFoundError(Exception):
+    """Raised when a job id is unknown"""
+    pass
+
+
+class JobConflictError(Exception):
+    """Raised when starting a job whose id is already running"""
+    pass
+
+
+class Job:
+    """
+    One background job
+
+    The job's coroutine reports progress by updating `progress`, which
+    status requests read without waiting for the job.
+    """
+
+    def __init__(self, kind: str, job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.status = "running"
+        self.progress: Dict[str, Any] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional["asyncio.Task[Any]"] = None
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobRegistry:
+    """
+    Runs jobs as asyncio tasks and remembers the most recent max_jobs of them
+
+    Jobs live in this process only; a restart loses their status (not their
+    work, for jobs that checkpoint, such as ingestion).
+    """
+
+    def __init__(self, max_jobs: int = 1000):
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+
+    def start(self, kind: str, fn: Callable[[Job], Awaitable[Any]], job_id: Optional[str] = None) -> Job:
+        """
+        Start fn(job) in the background
+
+        Args:
+            kind: Job type shown in status responses, e.g. "ingest"
+            fn: Coroutine function doing the work; its return value becomes job.result
+            job_id: Id to run under, e.g. to rerun a stored batch (defaults to a new id)
+
+        Returns:
+            The running job
+
+        Raises:
+            JobConflictError: If a job with job_id is still running
+        """
+        previous = self._jobs.pop(job_id, None) if job_id else None
+        if previous is not None and previous.finished_at is None:
+            self._jobs[job_id] = previous
+            raise JobConflictError(f"Job '{job_id}' is already running")
+        job = Job(kind, job_id)
+
+        async def run() -> None:
+            try:
+                job.result = await fn(job)
+                job.status = "succeeded"
+            except asyncio.CancelledError:
+                job.status = "cancelled"
+                raise
+            except Exception as e:
+                logger.exception("%s job %s failed", kind, job.id)
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+
+        job.task = asyncio.create_task(run())
+        self._jobs[job.id] = job
+        # Forget the oldest finished jobs once over the limit
+        excess = max(len(self._jobs) - self.max_jobs, 0)
+        finished = [j.id for j in self._jobs.values() if j.finished_at is not None]
+        for job_id in finished[:excess]:
+            del self._jobs[job_id]
+        return job
+
+    def get(self, job_id: str) -> Job:
+        """
+        Raises:
+            JobNotFoundError: If the job is unknown
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise JobNotFoundError(f"Job '{job_id}' not found")
+        return job
+
+    def cancel(self, job_id: str) -> Job:
+        """
+        Cancel a running job
+
+        Raises:
+            JobNotFoundError: If the job is unknown
+        """
+        job = self.get(job_id)
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+        return job
+
+    async def shutdown(self) -> None:
+        """Cancel every running job and wait for them to stop"""
+        tasks = [job.task for job in self._jobs.values() if job.task is not None and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
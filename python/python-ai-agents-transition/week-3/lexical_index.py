@@ -0,0 +1,178 @@
+"""
+Lexical Index Module for Week 3
+In-process BM25 inverted index and reciprocal-rank fusion with vector results
+"""
+
+import math
+import re
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from similarity import top_k_indices
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Constant from the original reciprocal-rank fusion paper; damps the weight of top ranks
+RRF_K = 60
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class LexicalIndex:
+    """
+    BM25 index over documents identified by arbitrary keys
+
+    Each term's postings are two typed arrays (document numbers and term
+    frequencies) rather than Python objects, so the index costs a few bytes
+    per posting and a query scores all postings of a term in one numpy
+    operation. Document numbers only grow, so postings stay sorted and
+    adding a document only appends. Replaced and removed documents are
+    masked out until more than half the documents are dead, then the
+    postings are rewritten without them.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._keys: List[Optional[Hashable]] = []
+        self._docs: Dict[Hashable, int] = {}
+        self._lengths = array("I")
+        self._alive = bytearray()
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, key: Hashable, text: str) -> None:
+        """Index a document, replacing any document with the same key"""
+        terms = Counter(tokenize(text))
+        with self._lock:
+            self._remove(key)
+            doc = len(self._keys)
+            for term, frequency in terms.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = (array("I"), array("I"))
+                postings[0].append(doc)
+                postings[1].append(frequency)
+            length = sum(terms.values())
+            self._keys.append(key)
+            self._docs[key] = doc
+            self._lengths.append(length)
+            self._alive.append(1)
+            self._total_length += length
+            self._maybe_vacuum()
+
+    def add_many(self, keys: Sequence[Hashable], texts: Sequence[str]) -> None:
+        for key, text in zip(keys, texts):
+            self.add(key, text)
+
+    def remove(self, key: Hashable) -> None:
+        """Remove a document; unknown keys are ignored"""
+        with self._lock:
+            self._remove(key)
+            self._maybe_vacuum()
+
+    def _remove(self, key: Hashable) -> None:
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        self._keys[doc] = None
+        self._alive[doc] = 0
+        self._total_length -= self._lengths[doc]
+
+    def _maybe_vacuum(self) -> None:
+        if len(self._keys) > 2 * len(self._docs) + 64:
+            self._vacuum()
+
+    def _vacuum(self) -> None:
+        """Rewrite the postings without dead documents"""
+        alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+        renumber = np.cumsum(alive) - 1
+        postings = {}
+        for term, (docs, frequencies) in self._postings.items():
+            docs_np = np.frombuffer(docs, dtype=np.uint32)
+            keep = alive[docs_np]
+            if keep.any():
+                postings[term] = (
+                    array("I", renumber[docs_np[keep]].astype(np.uint32).tobytes()),
+                    array("I", np.frombuffer(frequencies, dtype=np.uint32)[keep].tobytes()),
+                )
+        self._postings = postings
+        self._keys = [key for key in self._keys if key is not None]
+        self._docs = {key: doc for doc, key in enumerate(self._keys)}
+        self._lengths = array("I", np.frombuffer(self._lengths, dtype=np.uint32)[alive].tobytes())
+        self._alive = bytearray(b"\x01" * len(self._keys))
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[Hashable, float]]:
+        """
+        Rank documents against a query with BM25
+
+        Args:
+            query: Query text
+            top_k: Number of results to return
+
+        Returns:
+            (key, score) pairs, best first; documents sharing no term with the query are left out
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            count = len(self._docs)
+            if count == 0 or not terms:
+                return []
+            alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float32)
+            # Length normalization per document, shared by every term
+            norm = self.k1 * (1 - self.b + self.b * lengths / (self._total_length / count))
+            scores = np.zeros(len(self._keys), dtype=np.float32)
+
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                docs = np.frombuffer(postings[0], dtype=np.uint32)
+                keep = alive[docs]
+                docs = docs[keep]
+                if docs.size == 0:
+                    continue
+                frequencies = np.frombuffer(postings[1], dtype=np.uint32)[keep].astype(np.float32)
+                idf = math.log(1 + (count - docs.size + 0.5) / (docs.size + 0.5))
+                scores[docs] += idf * frequencies * (self.k1 + 1) / (frequencies + norm[docs])
+
+            best = top_k_indices(scores, min(top_k, int(np.count_nonzero(scores))))
+            return [(self._keys[doc], float(scores[doc])) for doc in best]
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Hashable]],
+    top_k: int = 3,
+    k: int = RRF_K
+) -> List[Tuple[Hashable, float]]:
+    """
+    Merge rankings by summing 1 / (k + rank) for each item
+
+    Only ranks are used, so BM25 scores and cosine similarities, which are
+    on unrelated scales, can be combined without calibration.
+
+    Args:
+        rankings: Item keys per ranking, best first
+        top_k: Number of results to return
+        k: Rank offset; larger values flatten the weight of top positions
+
+    Returns:
+        (key, fused score) pairs, best first
+    """
+    fused: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
@@ -1,32 +1,113 @@
 """
 LLM Utilities Module for Week 3
-OpenAI SDK integration with async support, error handling, and token-aware chunking
+OpenAI SDK integration (behind a pluggable backend) with async support, error handling, and token-aware chunking
 """
 
 import os
 import asyncio
 import logging
-from typing import List, Dict, Any, Optional
-from openai import AsyncOpenAI
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Any, AsyncIterator, Awaitable, Callable, Iterator, Optional, Tuple, Union
 import tiktoken
 from dotenv import load_dotenv
 
+import metrics
+from backends import ChatResult, LLMBackend, create_backend
+from concurrency import ConcurrencyLimiter, MicroBatcher, RateLimiter, SingleFlight
+from embedding_cache import EmbeddingCache
+from response_cache import ResponseCache
+from retry import CircuitBreaker, CircuitOpenError, RetryError, RetryPolicy
+from similarity import SimilarityEngine
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from vector_store import Collection
+from logging_config import SAMPLED
+
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Logging is configured by the entry point (see logging_config.configure_logging)
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Model provider: LLM_BACKEND=openai (default) or fake for offline runs
+llm_backend: LLMBackend = create_backend()
+
+# tiktoken encoders are loaded lazily, once per model, by get_encoder()
+DEFAULT_ENCODING = "o200k_base"
+_encoders: Dict[str, Optional[tiktoken.Encoding]] = {}
+_encoders_lock = threading.Lock()
+
+# LRU cache of token counts for short, frequently repeated strings
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+TOKEN_CACHE_MAX_CHARS = 8192
+TOKEN_COUNT_THREADS = int(os.getenv("TOKEN_COUNT_THREADS", "8"))
+_token_counts: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+_token_counts_lock = threading.Lock()
+
+# Per-request limits of the OpenAI embeddings endpoint
+EMBEDDING_MAX_BATCH_ITEMS = int(os.getenv("EMBEDDING_MAX_BATCH_ITEMS", "2048"))
+EMBEDDING_MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "300000"))
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+
+# Shared limiter for every upstream call (0 disables the RPM/TPM limits)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+
+limiter = ConcurrencyLimiter(
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    rate_limiter=RateLimiter(
+        requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute=LLM_TOKENS_PER_MINUTE
+    )
+)
+
+# Retries: jittered backoff within an overall deadline per call, plus a circuit
+# breaker that fails fast after repeated transient upstream failures
+retry_policy = RetryPolicy(
+    base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5")),
+    max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", "20")),
+    deadline=float(os.getenv("LLM_RETRY_DEADLINE", "60")) or None,
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+        recovery_time=float(os.getenv("CIRCUIT_RECOVERY_SECONDS", "30"))
+    )
+)
+
+# Identical chat/embedding requests in flight at the same time share one upstream call
+inflight = SingleFlight()
+
+# /embed micro-batching: requests arriving within the window share one API call
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "10"))
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "64"))
 
-# Initialize tiktoken encoder
-try:
-    enc = tiktoken.encoding_for_model("gpt-4o-mini")
-except Exception as e:
-    logger.warning(f"Could not initialize tiktoken encoder: {e}")
-    enc = None
+# Embedding cache (an empty EMBEDDING_CACHE_PATH keeps it in memory only)
+embedding_cache = EmbeddingCache(
+    path=os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3") or None,
+    max_memory_items=int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "10000")),
+    max_disk_bytes=int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+)
+
+# Chat response cache (set RESPONSE_CACHE_SEMANTIC_THRESHOLD, e.g. 0.95, to
+# also reuse answers to near-identical questions)
+response_cache = ResponseCache(
+    max_items=int(os.getenv("RESPONSE_CACHE_SIZE", "1024")),
+    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+    semantic_threshold=float(os.getenv("RESPONSE_CACHE_SEMANTIC_THRESHOLD", "0") or 0) or None
+)
+RESPONSE_CACHE_EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Vector index for collection searches: "exact" (brute force) or "ivf" (approximate, saved per collection)
+SIMILARITY_BACKEND = os.getenv("SIMILARITY_BACKEND", "exact")
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0")) or None
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+
+# Search modes of find_similar_chunks and search_collection
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+# Results taken from each ranking before fusing, so items ranked just below top_k by one side can still win
+HYBRID_CANDIDATES = 20
 
 
 class LLMError(Exception):
@@ -34,11 +115,119 @@ class LLMError(Exception):
     pass
 
 
+def get_llm_backend() -> LLMBackend:
+    """Return the process-wide backend used when no backend is passed in"""
+    return llm_backend
+
+
+async def warm_up() -> None:
+    """
+    Move one-off setup costs off the request path
+    
+    Loads the tokenizers for the default models, opens the embedding
+    cache's database and lets the backend open its connection pool.
+    Failures are logged and otherwise ignored; the first real request will
+    simply pay the cost instead.
+    """
+    for model in ("gpt-4o-mini", "text-embedding-3-small"):
+        await asyncio.to_thread(get_encoder, model)
+    try:
+        await asyncio.to_thread(embedding_cache.open)
+    except Exception as e:
+        logger.warning("Embedding cache failed to open: %s", e)
+    await llm_backend.warmup()
+
+
+async def close() -> None:
+    """Close the backend's connections and the embedding cache"""
+    await llm_backend.close()
+    embedding_cache.close()
+
+
+@contextmanager
+def _observe(operation: str, model: str) -> Iterator[None]:
+    """Record the latency and outcome of one upstream call"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        metrics.REQUEST_DURATION.observe(
+            time.perf_counter() - started, operation=operation, model=model, outcome=outcome
+        )
+        metrics.REQUESTS.inc(operation=operation, model=model, outcome=outcome)
+
+
+def _record_usage(operation: str, model: str, usage: Dict[str, int]) -> None:
+    metrics.TOKENS.inc(usage.get("prompt_tokens", 0), operation=operation, model=model, type="prompt")
+    metrics.TOKENS.inc(usage.get("completion_tokens", 0), operation=operation, model=model, type="completion")
+
+
+def _cache_metrics() -> List[Tuple[str, str, str, List[metrics.Sample]]]:
+    """Cache and limiter statistics, read at scrape time"""
+    responses = response_cache.stats()
+    embeddings = embedding_cache.stats()
+    response_lookups = responses["hits"] + responses["misses"]
+    embedding_hits = embeddings["memory_hits"] + embeddings["disk_hits"]
+    embedding_lookups = embedding_hits + embeddings["misses"]
+    return [
+        ("llm_cache_requests", "counter", "Cache lookups by cache and result", [
+            ("llm_cache_requests_total", {"cache": "response", "result": "hit"}, responses["hits"]),
+            ("llm_cache_requests_total", {"cache": "response", "result": "semantic_hit"}, responses["semantic_hits"]),
+            ("llm_cache_requests_total", {"cache": "response", "result": "miss"},
+             responses["misses"] - responses["semantic_hits"]),
+            ("llm_cache_requests_total", {"cache": "embedding", "result": "memory_hit"}, embeddings["memory_hits"]),
+            ("llm_cache_requests_total", {"cache": "embedding", "result": "disk_hit"}, embeddings["disk_hits"]),
+            ("llm_cache_requests_total", {"cache": "embedding", "result": "miss"}, embeddings["misses"]),
+        ]),
+        ("llm_cache_hit_ratio", "gauge", "Fraction of cache lookups served from the cache", [
+            ("llm_cache_hit_ratio", {"cache": "response"},
+             (responses["hits"] + responses["semantic_hits"]) / response_lookups if response_lookups else 0.0),
+            ("llm_cache_hit_ratio", {"cache": "embedding"},
+             embedding_hits / embedding_lookups if embedding_lookups else 0.0),
+        ]),
+        ("llm_in_flight_requests", "gauge", "Upstream LLM requests currently holding a concurrency slot", [
+            ("llm_in_flight_requests", {}, limiter.in_flight),
+        ]),
+    ]
+
+
+metrics.registry.register_collector(_cache_metrics)
+
+
+async def _with_retries(
+    fn: Callable[[], Awaitable[Any]],
+    max_retries: int,
+    description: str,
+    operation: str
+) -> Any:
+    """Run one upstream attempt function under retry_policy, converting failures to LLMError"""
+    attempts = 0
+    
+    async def counted() -> Any:
+        nonlocal attempts
+        attempts += 1
+        return await fn()
+    
+    try:
+        return await retry_policy.call(counted, max_retries, description)
+    except CircuitOpenError as e:
+        raise LLMError(f"{description} failed: {e}")
+    except RetryError as e:
+        raise LLMError(f"{description} failed after {e.attempts} attempts: {e.last_error}")
+    finally:
+        if attempts > 1:
+            metrics.RETRIES.inc(attempts - 1, operation=operation)
+
+
 async def get_chat_response(
     messages: List[Dict[str, str]], 
     model: str = "gpt-4o-mini",
     max_retries: int = 3,
-    temperature: float = 0.7
+    temperature: float = 0.7,
+    use_cache: bool = True,
+    llm_backend: Optional[LLMBackend] = None
 ) -> str:
     """
     Get chat completion response with retry logic and error handling
@@ -48,6 +237,9 @@ async def get_chat_response(
         model: OpenAI model to use
         max_retries: Maximum number of retry attempts
         temperature: Model temperature (0.0 to 2.0)
+        use_cache: Serve and store the response through the response cache, and
+            share one upstream call between identical concurrent requests
+        llm_backend: Backend to call (defaults to get_llm_backend())
     
     Returns:
         Response content as string
@@ -55,39 +247,263 @@ async def get_chat_response(
     Raises:
         LLMError: If all retries fail
     """
-    for attempt in range(max_retries):
+    result = await get_chat_completion(messages, model, max_retries, temperature, use_cache, llm_backend)
+    return result.content
+
+
+def cache_model(model: str, llm_backend: LLMBackend) -> str:
+    """
+    Model name qualified with the backend, used in cache and single-flight keys
+    
+    Without it, outputs of one backend (e.g. the fake one in tests and
+    benchmarks) would be served as another's from the shared caches.
+    """
+    return f"{llm_backend.name}:{model}"
+
+
+async def get_chat_completion(
+    messages: List[Dict[str, str]],
+    model: str = "gpt-4o-mini",
+    max_retries: int = 3,
+    temperature: float = 0.7,
+    use_cache: bool = True,
+    llm_backend: Optional[LLMBackend] = None,
+    **options: Any
+) -> ChatResult:
+    """
+    Like get_chat_response, but also return token usage
+    
+    Options such as tools and tool_choice are passed to the backend. Requests
+    with options bypass the response cache, which only stores text answers.
+    
+    Returns:
+        ChatResult with the content, the usage reported by the provider, and
+        cached=True (with no usage) when the answer came from the response cache
+    
+    Raises:
+        LLMError: If all retries fail
+    """
+    if not use_cache or options:
+        return await _request_chat(messages, model, max_retries, temperature, llm_backend, **options)
+    
+    llm_backend = llm_backend or get_llm_backend()
+    key = response_cache.make_key(cache_model(model, llm_backend), messages, temperature)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return ChatResult(content=cached, cached=True)
+    
+    return await inflight.do(
+        f"chat:{key}",
+        lambda: _cached_chat(key, messages, model, max_retries, temperature, llm_backend)
+    )
+
+
+async def _cached_chat(
+    key: str,
+    messages: List[Dict[str, str]],
+    model: str,
+    max_retries: int,
+    temperature: float,
+    llm_backend: Optional[LLMBackend]
+) -> ChatResult:
+    """Answer an exact-cache miss from the semantic tier or the API, and cache the result"""
+    scope = embedding = None
+    if response_cache.semantic_enabled and messages and messages[-1].get("role") == "user":
+        scope = response_cache.make_scope(cache_model(model, llm_backend), messages, temperature)
         try:
-            logger.info(f"Chat request attempt {attempt + 1}/{max_retries}")
-            
-            response = await client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature
+            embedding = await get_embedding(
+                messages[-1].get("content") or "", RESPONSE_CACHE_EMBEDDING_MODEL, llm_backend=llm_backend
             )
-            
-            # Log usage
-            if response.usage:
-                logger.info(f"Usage - Tokens: {response.usage.total_tokens}, "
-                          f"Prompt: {response.usage.prompt_tokens}, "
-                          f"Completion: {response.usage.completion_tokens}")
-            
-            return response.choices[0].message.content
-            
-        except Exception as e:
-            logger.error(f"Chat request failed (attempt {attempt + 1}): {e}")
-            if attempt < max_retries - 1:
-                # Exponential backoff
-                wait_time = 2 ** attempt
-                logger.info(f"Retrying in {wait_time} seconds...")
-                await asyncio.sleep(wait_time)
+        except LLMError as e:
+            # The semantic tier is an optimization; never fail the chat over it
+            logger.warning("Skipping semantic cache lookup: %s", e)
+        if embedding is not None:
+            cached = response_cache.get_similar(scope, embedding)
+            if cached is not None:
+                return ChatResult(content=cached, cached=True)
+    
+    result = await _request_chat(messages, model, max_retries, temperature, llm_backend)
+    if result.content is not None:
+        response_cache.put(key, result.content, scope, embedding)
+    return result
+
+
+async def _request_chat(
+    messages: List[Dict[str, str]],
+    model: str,
+    max_retries: int,
+    temperature: float,
+    llm_backend: Optional[LLMBackend] = None,
+    **options: Any
+) -> ChatResult:
+    """Send one chat completion request with retry logic, bypassing the response cache"""
+    llm_backend = llm_backend or get_llm_backend()
+    # Only the prompt is known up front; the limiter is corrected with real usage
+    estimated_tokens = sum(count_tokens_many([m.get("content") or "" for m in messages], model))
+    
+    async def attempt() -> ChatResult:
+        async with limiter.limit(tokens=estimated_tokens):
+            with _observe("chat", model):
+                result = await llm_backend.chat(messages, model, temperature, **options)
+        
+        # Log usage
+        if result.usage:
+            limiter.report_usage(estimated_tokens, result.usage["total_tokens"])
+            _record_usage("chat", model, result.usage)
+            logger.info(
+                "Usage - Tokens: %d, Prompt: %d, Completion: %d",
+                result.usage["total_tokens"], result.usage["prompt_tokens"], result.usage["completion_tokens"],
+                extra={**SAMPLED, "model": model, "usage": result.usage}
+            )
+        
+        return result
+    
+    return await _with_retries(attempt, max_retries, "Chat request", "chat")
+
+
+class ChatStream:
+    """
+    Streaming chat completion that yields content deltas as the model produces them
+    
+    Iterate with ``async for delta in stream``. Once iteration finishes,
+    ``usage`` holds the token usage reported by the API and
+    ``time_to_first_token`` the seconds until the first delta arrived.
+    Failures are only retried before the first delta; after that the
+    partial output has already reached the caller.
+    """
+    
+    def __init__(
+        self,
+        messages: List[Dict[str, str]],
+        model: str = "gpt-4o-mini",
+        max_retries: int = 3,
+        temperature: float = 0.7,
+        llm_backend: Optional[LLMBackend] = None
+    ):
+        self.messages = messages
+        self.model = model
+        self.max_retries = max_retries
+        self.temperature = temperature
+        self.llm_backend = llm_backend
+        self.usage: Optional[Dict[str, int]] = None
+        self.time_to_first_token: Optional[float] = None
+        self.duration: Optional[float] = None
+    
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._stream()
+    
+    async def _stream(self) -> AsyncIterator[str]:
+        estimated_tokens = sum(count_tokens_many([m.get("content") or "" for m in self.messages], self.model))
+        started = time.perf_counter()
+        deadline = started + retry_policy.deadline if retry_policy.deadline else None
+        
+        for attempt in range(self.max_retries):
+            first_token_seen = False
+            try:
+                probe = retry_policy.check_circuit()
+            except CircuitOpenError as e:
+                raise LLMError(f"Chat request failed: {e}")
+            try:
+                logger.info("Streaming chat request attempt %d/%d", attempt + 1, self.max_retries, extra=SAMPLED)
+                
+                async with limiter.limit(tokens=estimated_tokens):
+                    with _observe("chat_stream", self.model):
+                        backend = self.llm_backend or get_llm_backend()
+                        async for chunk in backend.stream_chat(self.messages, self.model, self.temperature):
+                            if chunk.usage:
+                                self.usage = chunk.usage
+                            
+                            delta = chunk.delta
+                            if delta:
+                                if not first_token_seen:
+                                    first_token_seen = True
+                                    self.time_to_first_token = time.perf_counter() - started
+                                    metrics.TIME_TO_FIRST_TOKEN.observe(self.time_to_first_token, model=self.model)
+                                yield delta
+            except Exception as e:
+                retry_policy.record(e, probe)
+                error = e
             else:
-                raise LLMError(f"Chat request failed after {max_retries} attempts: {e}")
+                retry_policy.record(None)
+                self.duration = time.perf_counter() - started
+                if self.usage:
+                    limiter.report_usage(estimated_tokens, self.usage["total_tokens"])
+                    _record_usage("chat_stream", self.model, self.usage)
+                    logger.info(
+                        "Stream usage - Tokens: %d, Prompt: %d, Completion: %d, TTFT: %.3fs",
+                        self.usage["total_tokens"], self.usage["prompt_tokens"],
+                        self.usage["completion_tokens"], self.time_to_first_token or 0,
+                        extra={**SAMPLED, "model": self.model, "usage": self.usage}
+                    )
+                return
+            finally:
+                # Also runs when the client disconnects and the generator is closed mid-stream
+                retry_policy.release(probe)
+            
+            logger.error("Streaming chat request failed (attempt %d): %s", attempt + 1, error)
+            if first_token_seen:
+                raise LLMError(f"Chat stream interrupted: {error}")
+            remaining = deadline - time.perf_counter() if deadline else None
+            wait_time = retry_policy.delay_for(error, attempt, self.max_retries, remaining)
+            if wait_time is None:
+                raise LLMError(f"Chat request failed after {attempt + 1} attempts: {error}")
+            logger.info("Retrying in %.2f seconds...", wait_time)
+            metrics.RETRIES.inc(operation="chat_stream")
+            await asyncio.sleep(wait_time)
+
+
+async def _request_embeddings(
+    inputs: List[str],
+    model: str,
+    max_retries: int,
+    tokens: Optional[int] = None,
+    llm_backend: Optional[LLMBackend] = None
+) -> List[List[float]]:
+    """
+    Send one embeddings request with retry logic and return vectors in input order
+
+    Args:
+        inputs: Texts to embed in a single API call
+        model: OpenAI embedding model to use
+        max_retries: Maximum number of retry attempts
+        tokens: Token count of inputs, if already known
+        llm_backend: Backend to call (defaults to get_llm_backend())
+
+    Returns:
+        Embedding vectors, one per input, in the same order as inputs
+
+    Raises:
+        LLMError: If all retries fail
+    """
+    if tokens is None:
+        tokens = sum(count_tokens_many(inputs, model))
+    llm_backend = llm_backend or get_llm_backend()
+    
+    async def attempt() -> List[List[float]]:
+        async with limiter.limit(tokens=tokens):
+            with _observe("embedding", model):
+                result = await llm_backend.embed(inputs, model)
+        
+        # Log usage
+        if result.usage:
+            limiter.report_usage(tokens, result.usage["total_tokens"])
+            _record_usage("embedding", model, result.usage)
+            logger.info(
+                "Embedding usage - Tokens: %d", result.usage["total_tokens"],
+                extra={**SAMPLED, "model": model, "usage": result.usage}
+            )
+        
+        return result.embeddings
+    
+    return await _with_retries(attempt, max_retries, f"Embedding request ({len(inputs)} inputs)", "embedding")
 
 
 async def get_embedding(
     text: str, 
     model: str = "text-embedding-3-small",
-    max_retries: int = 3
+    max_retries: int = 3,
+    use_cache: bool = True,
+    llm_backend: Optional[LLMBackend] = None
 ) -> List[float]:
     """
     Get embedding for text with retry logic and error handling
@@ -96,6 +512,8 @@ async def get_embedding(
         text: Text to embed
         model: OpenAI embedding model to use
         max_retries: Maximum number of retry attempts
+        use_cache: Serve and store the vector through the embedding cache
+        llm_backend: Backend to call (defaults to get_llm_backend())
     
     Returns:
         Embedding vector as list of floats
@@ -103,89 +521,408 @@ async def get_embedding(
     Raises:
         LLMError: If all retries fail
     """
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"Embedding request attempt {attempt + 1}/{max_retries}")
-            
-            response = await client.embeddings.create(
-                model=model,
-                input=text
+    llm_backend = llm_backend or get_llm_backend()
+    scoped = cache_model(model, llm_backend)
+    if use_cache:
+        cached = (await embedding_cache.get_many_async(scoped, [text]))[0]
+        if cached is not None:
+            return cached
+    
+    async def request() -> List[float]:
+        embeddings = await _request_embeddings([text], model, max_retries, llm_backend=llm_backend)
+        if use_cache:
+            await embedding_cache.put_many_async(scoped, [text], embeddings)
+        return embeddings[0]
+    
+    return await inflight.do(f"embedding:{embedding_cache.make_key(scoped, text)}", request)
+
+
+def pack_embedding_batches(
+    texts: List[str],
+    max_items: int = EMBEDDING_MAX_BATCH_ITEMS,
+    max_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+    model: str = "text-embedding-3-small"
+) -> List[List[int]]:
+    """
+    Group texts into embedding requests that respect per-request limits
+    
+    Texts are packed greedily in input order, so every batch holds a
+    contiguous run of indices.
+    
+    Args:
+        texts: Texts to embed
+        max_items: Maximum number of inputs per request
+        max_tokens: Maximum total tokens per request
+        model: Model to use for tokenization
+    
+    Returns:
+        List of batches, each a list of indices into texts
+    
+    Raises:
+        LLMError: If a single text exceeds the per-input token limit
+    """
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    
+    for i, tokens in enumerate(count_tokens_many(texts, model)):
+        if tokens > EMBEDDING_MAX_INPUT_TOKENS:
+            raise LLMError(
+                f"Text at index {i} has {tokens} tokens, exceeding the "
+                f"{EMBEDDING_MAX_INPUT_TOKENS}-token embedding input limit"
             )
-            
-            # Log usage
-            if response.usage:
-                logger.info(f"Embedding usage - Tokens: {response.usage.total_tokens}")
-            
-            return response.data[0].embedding
-            
-        except Exception as e:
-            logger.error(f"Embedding request failed (attempt {attempt + 1}): {e}")
-            if attempt < max_retries - 1:
-                # Exponential backoff
-                wait_time = 2 ** attempt
-                logger.info(f"Retrying in {wait_time} seconds...")
-                await asyncio.sleep(wait_time)
+        
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        
+        current.append(i)
+        current_tokens += tokens
+    
+    if current:
+        batches.append(current)
+    
+    return batches
+
+
+async def get_embeddings(
+    texts: List[str],
+    model: str = "text-embedding-3-small",
+    max_retries: int = 3,
+    max_items: int = EMBEDDING_MAX_BATCH_ITEMS,
+    max_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+    use_cache: bool = True,
+    llm_backend: Optional[LLMBackend] = None
+) -> List[List[float]]:
+    """
+    Get embeddings for many texts, packing them into as few requests as possible
+    
+    Args:
+        texts: Texts to embed
+        model: OpenAI embedding model to use
+        max_retries: Maximum number of retry attempts per request
+        max_items: Maximum number of inputs per request
+        max_tokens: Maximum total tokens per request
+        use_cache: Serve and store vectors through the embedding cache
+        llm_backend: Backend to call (defaults to get_llm_backend())
+    
+    Returns:
+        Embedding vectors in the same order as texts
+    
+    Raises:
+        LLMError: If a text is too long or a request fails after all retries
+    """
+    if not texts:
+        return []
+    
+    llm_backend = llm_backend or get_llm_backend()
+    scoped = cache_model(model, llm_backend)
+    if use_cache:
+        embeddings = await embedding_cache.get_many_async(scoped, texts)
+    else:
+        embeddings = [None] * len(texts)
+    
+    # Only unique texts that missed the cache go upstream
+    pending: Dict[str, List[int]] = {}
+    for i, embedding in enumerate(embeddings):
+        if embedding is None:
+            pending.setdefault(texts[i], []).append(i)
+    
+    if not pending:
+        return embeddings
+    
+    missing = list(pending)
+    batches = pack_embedding_batches(missing, max_items, max_tokens, model)
+    logger.info("Embedding %d uncached texts in %d requests", len(missing), len(batches), extra=SAMPLED)
+    
+    # Fan out all batches; the shared limiter bounds how many run at once
+    results = await asyncio.gather(*(
+        _request_embeddings([missing[i] for i in batch], model, max_retries, llm_backend=llm_backend)
+        for batch in batches
+    ))
+    
+    fetched: List[Optional[List[float]]] = [None] * len(missing)
+    for batch, vectors in zip(batches, results):
+        for i, vector in zip(batch, vectors):
+            fetched[i] = vector
+    
+    if use_cache:
+        await embedding_cache.put_many_async(scoped, missing, fetched)
+    
+    for text, vector in zip(missing, fetched):
+        for i in pending[text]:
+            embeddings[i] = vector
+    
+    return embeddings
+
+
+async def _embed_batch(
+    items: List[Tuple[str, str, Optional[LLMBackend]]]
+) -> List[Union[List[float], Exception]]:
+    """Embed the (text, model, backend) items collected by embed_batcher, one get_embeddings call per model"""
+    results: List[Union[List[float], Exception, None]] = [None] * len(items)
+    by_model: Dict[Tuple[str, Optional[LLMBackend]], List[int]] = {}
+    for i, (text, model, backend) in enumerate(items):
+        by_model.setdefault((model, backend), []).append(i)
+    
+    # Inputs the API would reject fail on their own instead of failing the whole batch
+    groups: List[Tuple[str, Optional[LLMBackend], List[int]]] = []
+    for (model, backend), indices in by_model.items():
+        counts = count_tokens_many([items[i][0] for i in indices], model)
+        valid = []
+        for i, tokens in zip(indices, counts):
+            if not items[i][0]:
+                results[i] = LLMError("Cannot embed empty text")
+            elif tokens > EMBEDDING_MAX_INPUT_TOKENS:
+                results[i] = LLMError(
+                    f"Text has {tokens} tokens, more than the {EMBEDDING_MAX_INPUT_TOKENS} allowed per input"
+                )
             else:
-                raise LLMError(f"Embedding request failed after {max_retries} attempts: {e}")
+                valid.append(i)
+        if valid:
+            groups.append((model, backend, valid))
+    
+    outcomes = await asyncio.gather(
+        *(
+            get_embeddings([items[i][0] for i in indices], model, llm_backend=backend)
+            for model, backend, indices in groups
+        ),
+        return_exceptions=True
+    )
+    for (_, _, indices), outcome in zip(groups, outcomes):
+        for position, i in enumerate(indices):
+            results[i] = outcome if isinstance(outcome, Exception) else outcome[position]
+    return results
 
 
-def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+embed_batcher = MicroBatcher(_embed_batch, EMBED_BATCH_MAX_SIZE, EMBED_BATCH_WINDOW_MS)
+
+
+async def get_embedding_batched(
+    text: str,
+    model: str = "text-embedding-3-small",
+    llm_backend: Optional[LLMBackend] = None
+) -> List[float]:
     """
-    Count tokens in text using tiktoken
+    Get an embedding, sharing the API call with other requests made around the same time
+    
+    Cache hits return immediately; misses wait up to EMBED_BATCH_WINDOW_MS
+    for other texts to embed alongside.
     
     Args:
-        text: Text to count tokens for
+        text: Text to embed
+        model: OpenAI embedding model to use
+        llm_backend: Backend to call (defaults to get_llm_backend())
+    
+    Returns:
+        Embedding vector as list of floats
+    
+    Raises:
+        LLMError: If the text can't be embedded or the batched request fails
+    """
+    llm_backend = llm_backend or get_llm_backend()
+    cached = (await embedding_cache.get_many_async(cache_model(model, llm_backend), [text]))[0]
+    if cached is not None:
+        return cached
+    return await embed_batcher.submit((text, model, llm_backend))
+
+
+def get_encoder(model: str = "gpt-4o-mini") -> Optional[tiktoken.Encoding]:
+    """
+    Get the tiktoken encoder for a model, loading it on first use
+    
+    Models tiktoken doesn't know fall back to DEFAULT_ENCODING. If the
+    encoding can't be loaded (e.g. offline), None is cached and callers
+    fall back to estimating.
+    
+    Args:
+        model: Model to get the encoder for
+    
+    Returns:
+        The encoder, or None if it could not be loaded
+    """
+    if model in _encoders:
+        return _encoders[model]
+    
+    with _encoders_lock:
+        if model not in _encoders:
+            try:
+                try:
+                    encoder = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoder = tiktoken.get_encoding(DEFAULT_ENCODING)
+            except Exception as e:
+                logger.warning("Could not initialize tiktoken encoder for %s: %s", model, e)
+                encoder = None
+            _encoders[model] = encoder
+    return _encoders[model]
+
+
+def clear_token_cache() -> None:
+    """Drop every cached token count"""
+    with _token_counts_lock:
+        _token_counts.clear()
+
+
+def count_tokens_many(
+    texts: List[str],
+    model: str = "gpt-4o-mini",
+    num_threads: int = TOKEN_COUNT_THREADS
+) -> List[int]:
+    """
+    Count tokens for many texts at once
+    
+    Cached counts are reused; the remaining unique texts are encoded with
+    tiktoken's batch API, which spreads the work across threads.
+    
+    Args:
+        texts: Texts to count tokens for
         model: Model to use for tokenization
+        num_threads: Threads for batch encoding
     
     Returns:
-        Number of tokens
+        Number of tokens for each text, in order
     """
+    counts: List[Optional[int]] = [None] * len(texts)
+    misses: Dict[str, List[int]] = {}
+    
+    with _token_counts_lock:
+        for i, text in enumerate(texts):
+            cached = _token_counts.get((model, text)) if len(text) <= TOKEN_CACHE_MAX_CHARS else None
+            if cached is not None:
+                _token_counts.move_to_end((model, text))
+                counts[i] = cached
+            else:
+                misses.setdefault(text, []).append(i)
+    
+    if not misses:
+        return counts
+    
+    unique = list(misses)
     try:
-        if enc is None:
+        encoder = get_encoder(model)
+        if encoder is None:
             # Fallback: rough estimation (1 token ≈ 4 characters)
-            return len(text) // 4
-        
-        tokens = enc.encode(text)
-        return len(tokens)
+            fresh = [len(text) // 4 for text in unique]
+        elif len(unique) < 16:
+            # A thread pool isn't worth starting for a handful of strings
+            fresh = [len(encoder.encode_ordinary(text)) for text in unique]
+        else:
+            fresh = [len(tokens) for tokens in encoder.encode_ordinary_batch(unique, num_threads=num_threads)]
     except Exception as e:
-        logger.error(f"Token counting failed: {e}")
+        logger.error("Token counting failed: %s", e)
         # Fallback: rough estimation
-        return len(text) // 4
+        fresh = [len(text) // 4 for text in unique]
+    
+    with _token_counts_lock:
+        for text, count in zip(unique, fresh):
+            if len(text) <= TOKEN_CACHE_MAX_CHARS:
+                _token_counts[(model, text)] = count
+            for i in misses[text]:
+                counts[i] = count
+        while len(_token_counts) > TOKEN_CACHE_SIZE:
+            _token_counts.popitem(last=False)
+    
+    return counts
 
 
-def chunk_text(text: str, max_tokens: int = 1000, model: str = "gpt-4o-mini") -> List[str]:
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
     """
-    Split text into chunks that fit within token limits
+    Count tokens in text using tiktoken
+    
+    Args:
+        text: Text to count tokens for
+        model: Model to use for tokenization
+    
+    Returns:
+        Number of tokens
+    """
+    return count_tokens_many([text], model)[0]
+
+
+def _window_starts(length: int, size: int, overlap: int) -> range:
+    """Start offsets of size-long windows that overlap by overlap and cover length"""
+    if length == 0:
+        return range(0)
+    # Stop once the rest of the sequence is only the previous window's overlap
+    return range(0, max(length - overlap, 1), size - overlap)
+
+
+def chunk_text_with_counts(
+    text: str,
+    max_tokens: int = 1000,
+    model: str = "gpt-4o-mini",
+    overlap: int = 0
+) -> Tuple[List[str], List[int], int]:
+    """
+    Split text into chunks and report the token counts found while splitting
     
     Args:
         text: Text to chunk
         max_tokens: Maximum tokens per chunk
         model: Model to use for tokenization
+        overlap: Tokens repeated at the start of each following chunk
     
     Returns:
-        List of text chunks
+        Tuple of (chunks, tokens per chunk, total tokens in text)
+    
+    Raises:
+        ValueError: If overlap is negative or not smaller than max_tokens
     """
+    if not 0 <= overlap < max_tokens:
+        raise ValueError("overlap must be at least 0 and smaller than max_tokens")
+    
+    def fallback() -> Tuple[List[str], List[int], int]:
+        # Fallback: simple character-based chunking
+        chunk_size = max_tokens * 4  # Rough estimation
+        chunks = [text[i:i + chunk_size]
+                  for i in _window_starts(len(text), chunk_size, overlap * 4)]
+        return chunks, [len(chunk) // 4 for chunk in chunks], len(text) // 4
+    
     try:
-        if enc is None:
-            # Fallback: simple character-based chunking
-            chunk_size = max_tokens * 4  # Rough estimation
-            return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        encoder = get_encoder(model)
+        if encoder is None:
+            return fallback()
         
-        tokens = enc.encode(text)
+        tokens = encoder.encode_ordinary(text)
         chunks = []
+        chunk_tokens = []
         
-        for i in range(0, len(tokens), max_tokens):
-            chunk_tokens = tokens[i:i + max_tokens]
-            chunk_text = enc.decode(chunk_tokens)
-            chunks.append(chunk_text)
+        for i in _window_starts(len(tokens), max_tokens, overlap):
+            window = tokens[i:i + max_tokens]
+            chunks.append(encoder.decode(window))
+            chunk_tokens.append(len(window))
         
-        return chunks
+        return chunks, chunk_tokens, len(tokens)
         
     except Exception as e:
-        logger.error(f"Text chunking failed: {e}")
-        # Fallback: simple character-based chunking
-        chunk_size = max_tokens * 4
-        return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        logger.error("Text chunking failed: %s", e)
+        return fallback()
+
+
+def chunk_text(
+    text: str,
+    max_tokens: int = 1000,
+    model: str = "gpt-4o-mini",
+    overlap: int = 0
+) -> List[str]:
+    """
+    Split text into chunks that fit within token limits
+    
+    Args:
+        text: Text to chunk
+        max_tokens: Maximum tokens per chunk
+        model: Model to use for tokenization
+        overlap: Tokens repeated at the start of each following chunk
+    
+    Returns:
+        List of text chunks
+    
+    Raises:
+        ValueError: If overlap is negative or not smaller than max_tokens
+    """
+    return chunk_text_with_counts(text, max_tokens, model, overlap)[0]
 
 
 async def test_chat() -> str:
@@ -203,57 +940,47 @@ async def test_embedding() -> int:
 
 async def test_prompt_engineering() -> str:
     """Test prompt engineering with system and user roles"""
-    messages = [
-        {"role": "system", "content": "You are a helpful travel guide."},
-        {"role": "user", "content": "Plan a 3-day trip to Japan."}
-    ]
-    return await get_chat_response(messages)
+    from prompts import prompts
+    
+    prompt = prompts.render("travel_guide", {"days": 3, "destination": "Japan"})
+    return await get_chat_response(prompt.messages)
 
 
 async def test_function_calling() -> Dict[str, Any]:
-    """Test function calling (structured outputs)"""
-    messages = [
-        {"role": "user", "content": "What's the weather like in Tokyo?"}
-    ]
+    """Test function calling with the tools API and a stub weather tool"""
+    from tools import ToolRegistry, run_tool_loop
     
-    functions = [
-        {
-            "name": "get_weather",
-            "description": "Get the current weather",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "location": {"type": "string"},
-                    "temperature": {"type": "number"},
-                    "condition": {"type": "string"}
-                },
-                "required": ["location"]
-            }
-        }
+    registry = ToolRegistry()
+    
+    @registry.register(
+        "Get the current weather",
+        parameters={
+            "type": "object",
+            "properties": {"location": {"type": "string"}},
+            "required": ["location"]
+        },
+        deterministic=True
+    )
+    async def get_weather(location: str) -> Dict[str, Any]:
+        return {"location": location, "temperature": 22, "condition": "sunny"}
+    
+    messages = [
+        {"role": "user", "content": "What's the weather like in Tokyo? Use get_weather."}
     ]
     
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            functions=functions
-        )
-        
-        # Check if function was called
-        if response.choices[0].message.function_call:
-            return {
-                "function_called": True,
-                "function_name": response.choices[0].message.function_call.name,
-                "arguments": response.choices[0].message.function_call.arguments
-            }
-        else:
-            return {
-                "function_called": False,
-                "response": response.choices[0].message.content
-            }
-            
+        result = await run_tool_loop(messages, registry, max_turns=3)
+        return {
+            "function_called": bool(result.tool_calls),
+            "tool_calls": [
+                {"name": call.name, "arguments": call.arguments, "result": call.result}
+                for call in result.tool_calls
+            ],
+            "response": result.content,
+            "turns": result.turns
+        }
     except Exception as e:
-        logger.error(f"Function calling test failed: {e}")
+        logger.error("Function calling test failed: %s", e)
         return {"error": str(e)}
 
 
@@ -273,28 +1000,22 @@ async def test_chunking_and_embedding() -> Dict[str, Any]:
     potential to transform industries and improve human lives.
     """ * 5  # Repeat to make it longer
     
-    # Count tokens
-    total_tokens = count_tokens(long_text)
-    
-    # Chunk the text
-    chunks = chunk_text(long_text, max_tokens=100)
+    # Chunk the text, keeping the token counts found along the way
+    chunks, chunk_tokens, total_tokens = chunk_text_with_counts(long_text, max_tokens=100)
     
-    # Get embeddings for each chunk
-    embeddings = []
-    for chunk in chunks:
-        embedding = await get_embedding(chunk)
-        embeddings.append(embedding)
+    # Get embeddings for all chunks in batched requests
+    embeddings = await get_embeddings(chunks)
     
     return {
         "total_tokens": total_tokens,
         "num_chunks": len(chunks),
-        "chunk_tokens": [count_tokens(chunk) for chunk in chunks],
+        "chunk_tokens": chunk_tokens,
         "embedding_dimensions": len(embeddings[0]) if embeddings else 0,
         "sample_chunk": chunks[0][:100] + "..." if chunks else ""
     }
 
 
-# Vector similarity functions (for future vector DB integration)
+# Vector similarity functions (see similarity.py for the vectorized engine)
 def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
     """Calculate cosine similarity between two vectors"""
     import math
@@ -315,38 +1036,126 @@ def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
 async def find_similar_chunks(
     query: str, 
     chunks: List[str], 
-    top_k: int = 3
+    top_k: int = 3,
+    llm_backend: Optional[LLMBackend] = None,
+    mode: str = "vector"
 ) -> List[Dict[str, Any]]:
     """
-    Find most similar chunks to a query using embeddings
+    Find most similar chunks to a query using embeddings, BM25 or both
+    
+    The chunks are embedded for this call only, so they are searched
+    exactly; an approximate index would cost more to train than it saves.
     
     Args:
         query: Query text
         chunks: List of text chunks
         top_k: Number of top similar chunks to return
+        llm_backend: Backend used to embed (defaults to get_llm_backend())
+        mode: "vector", "lexical" (no embedding calls) or "hybrid" (both, fused by rank)
     
     Returns:
-        List of dictionaries with chunk text and similarity score
-    """
-    # Get query embedding
-    query_embedding = await get_embedding(query)
-    
-    # Get embeddings for all chunks
-    chunk_embeddings = []
-    for chunk in chunks:
-        embedding = await get_embedding(chunk)
-        chunk_embeddings.append(embedding)
-    
-    # Calculate similarities
-    similarities = []
-    for i, chunk_embedding in enumerate(chunk_embeddings):
-        similarity = cosine_similarity(query_embedding, chunk_embedding)
-        similarities.append({
-            "chunk": chunks[i],
-            "similarity": similarity,
-            "index": i
-        })
-    
-    # Sort by similarity and return top_k
-    similarities.sort(key=lambda x: x["similarity"], reverse=True)
-    return similarities[:top_k]
+        List of dictionaries with chunk text and similarity, bm25 and/or fused score
+    
+    Raises:
+        ValueError: If the mode is unknown
+    """
+    _check_search_mode(mode)
+    depth = _candidate_depth(mode, top_k)
+    
+    lexical = []
+    if mode != "vector":
+        index = LexicalIndex()
+        index.add_many(range(len(chunks)), chunks)
+        lexical = [
+            {"chunk": chunks[i], "bm25": score, "index": i}
+            for i, score in index.search(query, depth)
+        ]
+        if mode == "lexical":
+            return lexical
+    
+    # Embed the query together with the chunks so they share requests
+    embeddings = await get_embeddings([query] + chunks, llm_backend=llm_backend)
+    query_embedding = embeddings[0]
+    chunk_embeddings = embeddings[1:]
+    
+    # Score every chunk with one matrix-vector product
+    index = SimilarityEngine.from_vectors(chunk_embeddings)
+    if len(index) == 0:
+        return []
+    vector = [
+        {"chunk": chunks[i], "similarity": score, "index": i}
+        for i, score in index.search(query_embedding, depth)
+    ]
+    return vector if mode == "vector" else fuse_results(lexical, vector, top_k)
+
+
+def _check_search_mode(mode: str) -> None:
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode: {mode}")
+
+
+def _candidate_depth(mode: str, top_k: int) -> int:
+    return max(top_k, HYBRID_CANDIDATES) if mode == "hybrid" else top_k
+
+
+def fuse_results(
+    lexical: List[Dict[str, Any]],
+    vector: List[Dict[str, Any]],
+    top_k: int = 3
+) -> List[Dict[str, Any]]:
+    """
+    Merge lexical and vector results with reciprocal-rank fusion
+    
+    Results are matched on their "index". Each fused result keeps the bm25
+    and similarity scores of the rankings it appeared in and adds "score".
+    """
+    merged: Dict[int, Dict[str, Any]] = {}
+    for result in lexical + vector:
+        merged.setdefault(result["index"], {}).update(result)
+    fused = reciprocal_rank_fusion(
+        [[r["index"] for r in lexical], [r["index"] for r in vector]], top_k
+    )
+    return [{**merged[i], "score": score} for i, score in fused]
+
+
+async def search_collection(
+    query: str,
+    collection: Collection,
+    top_k: int = 3,
+    llm_backend: Optional[LLMBackend] = None,
+    mode: str = "vector",
+    backend: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Find the chunks in a stored collection most similar to a query
+    
+    Only the query is embedded; chunk vectors are read from the collection.
+    Lexical searches use the collection's BM25 index and make no upstream call.
+    Collection reads run in a worker thread, since an ingestion writer may
+    hold the collection's lock through a flush or compaction.
+    
+    Args:
+        query: Query text
+        collection: Collection to search
+        top_k: Number of top similar chunks to return
+        llm_backend: Backend to call (defaults to get_llm_backend())
+        mode: "vector", "lexical" or "hybrid" (both, fused by rank)
+        backend: Vector index, "exact" or "ivf" (defaults to SIMILARITY_BACKEND)
+    
+    Returns:
+        List of dictionaries with chunk id, text and similarity, bm25 and/or fused score
+    
+    Raises:
+        ValueError: If the mode or backend is unknown
+    """
+    _check_search_mode(mode)
+    depth = _candidate_depth(mode, top_k)
+    lexical = await asyncio.to_thread(collection.lexical_query, query, depth) if mode != "vector" else []
+    if mode == "lexical":
+        return lexical
+    
+    query_embedding = await get_embedding(query, model=collection.model, llm_backend=llm_backend)
+    vector = await asyncio.to_thread(
+        collection.query, query_embedding, depth, backend or SIMILARITY_BACKEND, IVF_NLIST, IVF_NPROBE
+    )
+    return vector if mode == "vector" else fuse_results(lexical, vector, top_k)
@@ -1,36 +1,162 @@
 # type: ignore
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Literal, Optional
+from contextlib import asynccontextmanager
 import asyncio
+import hashlib
+import json
 import os
 from dotenv import load_dotenv
 
 # Import our LLM utilities
 from llm_utils import (
-    get_chat_response, get_embedding, count_tokens, chunk_text,
+    get_chat_response, get_chat_completion, get_embedding, count_tokens, chunk_text, chunk_text_with_counts,
     test_chat, test_embedding, test_prompt_engineering, test_function_calling,
-    test_chunking_and_embedding, find_similar_chunks, LLMError
+    test_chunking_and_embedding, find_similar_chunks, get_embeddings,
+    search_collection, get_embedding_batched, ChatStream, LLMError,
+    embedding_cache, response_cache
 )
+import llm_utils
+from backends import LLMBackend
+from metrics import registry
+from logging_config import configure_logging, shutdown_logging
+from deps import get_llm_backend
+from chunking import split_segments, merge_segments
+from context_window import ConversationContext, count_messages, fit_messages, summarize_turns
+from sessions import SessionNotFoundError, create_session_store, new_session_id
+from ingest import Document, create_chunk_pool, ingest
+from jobs import JobConflictError, JobNotFoundError, JobRegistry
+from batch_jobs import OUTPUT_FILE, BatchJobError, BatchStore
+from tools import ToolRegistry, run_tool_loop
+from prompts import PromptBudgetError, PromptError, prompts
+from vector_store import VectorStore, VectorStoreError, CollectionNotFoundError
 
 # Load environment variables
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_logging()
+    # Load tokenizers and open the upstream connection pool before traffic arrives
+    await llm_utils.warm_up()
+    yield
+    # Stop jobs first so none of them reopens the cache or the client after they are closed
+    await jobs.shutdown()
+    if ingest_pool is not None:
+        ingest_pool.shutdown(wait=False, cancel_futures=True)
+    await asyncio.to_thread(vector_store.close)
+    await llm_utils.close()
+    await session_store.close()
+    shutdown_logging()
+
 app = FastAPI(
     title="Week 3 - OpenAI SDK Integration", 
     version="1.0.0",
-    description="FastAPI backend with OpenAI SDK integration for chat, embeddings, and prompt engineering"
+    description="FastAPI backend with OpenAI SDK integration for chat, embeddings, and prompt engineering",
+    lifespan=lifespan
+)
+
+# Persistent chunk collections queried by /similar and /collections
+vector_store = VectorStore(os.getenv("VECTOR_STORE_PATH", "vector_store"))
+
+# Server-side chat history for /sessions (Redis when SESSION_STORE_URL is set)
+session_store = create_session_store()
+
+# Background jobs started by /ingest and /batch-jobs
+jobs = JobRegistry()
+# Inputs, results and options of offline batch jobs
+batch_store = BatchStore(os.getenv("BATCH_JOBS_PATH", "batch_jobs"))
+# Chunking processes per ingestion job (empty for one per CPU, 0 to chunk in threads)
+INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES")) if os.getenv("INGEST_PROCESSES") else None
+# Chunking pool shared by all ingestion jobs, started on first use and shut down with the app
+ingest_pool = None
+
+def get_ingest_pool():
+    global ingest_pool
+    if ingest_pool is None:
+        ingest_pool = create_chunk_pool(INGEST_PROCESSES)
+    return ingest_pool
+
+# Default prompt budget for chat history (0 sends messages as-is)
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "0"))
+
+# Tools the model may call from /chat/tools
+tool_registry = ToolRegistry()
+
+@tool_registry.register(
+    "Search a vector collection for the chunks most relevant to a query",
+    parameters={
+        "type": "object",
+        "properties": {
+            "collection": {"type": "string", "description": "Collection name"},
+            "query": {"type": "string"},
+            "top_k": {"type": "integer", "default": 3},
+            "mode": {"type": "string", "enum": ["lexical", "vector", "hybrid"], "default": "hybrid"}
+        },
+        "required": ["collection", "query"]
+    }
+)
+async def search_knowledge_base(collection: str, query: str, top_k: int = 3, mode: str = "hybrid"):
+    return await search_collection(query, vector_store.get_collection(collection), top_k, mode=mode)
+
+@tool_registry.register(
+    "Count the tokens in a text",
+    parameters={"type": "object", "properties": {"text": {"type": "string"}}, "required": ["text"]},
+    deterministic=True
 )
+async def count_text_tokens(text: str):
+    return {"tokens": count_tokens(text)}
 
 # Pydantic models for request/response
 class ChatRequest(BaseModel):
     messages: List[Dict[str, str]]
     model: str = "gpt-4o-mini"
     temperature: float = 0.7
+    use_cache: bool = True
+    # Trim (or summarize) older turns to fit this many prompt tokens
+    max_context_tokens: Optional[int] = None
+    context_strategy: Literal["trim", "summarize"] = "trim"
 
 class ChatResponse(BaseModel):
     response: str
     usage: Optional[Dict[str, int]] = None
+    cached: bool = False
+
+class TemplateChatRequest(BaseModel):
+    template: str
+    variables: Dict[str, Any] = {}
+    model: str = "gpt-4o-mini"
+    temperature: float = 0.7
+    use_cache: bool = True
+    # Overrides the template's own prompt budget
+    max_prompt_tokens: Optional[int] = None
+
+class TemplateChatResponse(ChatResponse):
+    prompt_tokens: int
+
+class ToolChatRequest(BaseModel):
+    messages: List[Dict[str, Any]]
+    model: str = "gpt-4o-mini"
+    temperature: float = 0.7
+    max_turns: int = 5
+    max_tokens: Optional[int] = None
+
+class ToolCallInfo(BaseModel):
+    id: str
+    name: str
+    arguments: str
+    result: str
+    error: Optional[str] = None
+    cached: bool = False
+
+class ToolChatResponse(BaseModel):
+    response: Optional[str]
+    tool_calls: List[ToolCallInfo]
+    turns: int
+    stop_reason: str
+    usage: Dict[str, int]
 
 class EmbeddingRequest(BaseModel):
     text: str
@@ -45,6 +171,8 @@ class ChunkingRequest(BaseModel):
     text: str
     max_tokens: int = 1000
     model: str = "gpt-4o-mini"
+    strategy: Literal["fixed", "recursive"] = "fixed"
+    overlap: int = 0
 
 class ChunkingResponse(BaseModel):
     chunks: List[str]
@@ -53,12 +181,82 @@ class ChunkingResponse(BaseModel):
 
 class SimilarityRequest(BaseModel):
     query: str
-    chunks: List[str]
+    chunks: Optional[List[str]] = None
+    collection: Optional[str] = None
     top_k: int = 3
+    # Vector index for collection searches (defaults to SIMILARITY_BACKEND); inline chunks are searched exactly
+    backend: Optional[Literal["exact", "ivf"]] = None
+    # lexical (BM25, no embedding calls), vector, or hybrid (both, fused by rank)
+    mode: Literal["lexical", "vector", "hybrid"] = "vector"
 
 class SimilarityResponse(BaseModel):
     similar_chunks: List[Dict[str, Any]]
 
+class CollectionCreateRequest(BaseModel):
+    name: str
+    model: str = "text-embedding-3-small"
+    dimensions: Optional[int] = None
+
+class CollectionInfo(BaseModel):
+    name: str
+    model: str
+    dimensions: Optional[int] = None
+    count: int
+
+class ChunkRecord(BaseModel):
+    id: Optional[str] = None
+    text: str
+    embedding: Optional[List[float]] = None
+
+class UpsertRequest(BaseModel):
+    chunks: List[ChunkRecord]
+
+class UpsertResponse(BaseModel):
+    upserted: int
+    ids: List[str]
+    count: int
+
+class CollectionQueryRequest(BaseModel):
+    query: Optional[str] = None
+    vector: Optional[List[float]] = None
+    top_k: int = 3
+
+class DeleteChunksRequest(BaseModel):
+    ids: List[str]
+
+class IngestDocument(BaseModel):
+    id: str
+    text: str
+
+class IngestRequest(BaseModel):
+    collection: str
+    documents: List[IngestDocument]
+    max_tokens: int = 500
+    overlap: int = 0
+
+class BatchJobRequest(BaseModel):
+    # Lines of {"custom_id", "kind": "chat" | "embedding", "body"}
+    requests: List[Dict[str, Any]]
+    concurrency: int = 4
+    requests_per_minute: int = 0
+    embed_batch_size: int = 256
+
+class SessionCreateRequest(BaseModel):
+    system: Optional[str] = None
+    model: str = "gpt-4o-mini"
+
+class SessionInfo(BaseModel):
+    session_id: str
+    messages: List[Dict[str, str]]
+    total_tokens: int
+
+class SessionChatRequest(BaseModel):
+    message: Dict[str, str]
+    model: str = "gpt-4o-mini"
+    temperature: float = 0.7
+    use_cache: bool = True
+    max_context_tokens: Optional[int] = None
+
 @app.get("/")
 async def root():
     return {
@@ -66,11 +264,19 @@ async def root():
         "status": "running",
         "features": [
             "OpenAI Chat Completions",
+            "Streaming Chat (SSE)",
             "OpenAI Embeddings", 
             "Prompt Engineering",
             "Function Calling",
             "Token-aware Chunking",
-            "Vector Similarity Search"
+            "Vector Similarity Search",
+            "Persistent Vector Collections",
+            "Prometheus Metrics",
+            "Server-side Chat Sessions",
+            "Bulk Document Ingestion",
+            "Offline Batch Jobs",
+            "Prompt Templates",
+            "Hybrid Lexical + Vector Search"
         ]
     }
 
@@ -79,29 +285,152 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "week": 3}
 
+async def fit_chat_context(request: ChatRequest, llm_backend: LLMBackend) -> List[Dict[str, str]]:
+    """Fit the request's history into its token budget, keeping the system prompt"""
+    budget = request.max_context_tokens or CHAT_CONTEXT_TOKENS
+    if not budget:
+        return request.messages
+    
+    async def summarizer(turns):
+        return await summarize_turns(turns, request.model, llm_backend)
+    
+    return await fit_messages(
+        request.messages, budget, request.model,
+        summarizer if request.context_strategy == "summarize" else None
+    )
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, llm_backend: LLMBackend = Depends(get_llm_backend)):
     """Chat completion endpoint"""
     try:
-        response = await get_chat_response(
-            messages=request.messages,
+        result = await get_chat_completion(
+            messages=await fit_chat_context(request, llm_backend),
+            model=request.model,
+            temperature=request.temperature,
+            use_cache=request.use_cache,
+            llm_backend=llm_backend
+        )
+        return ChatResponse(response=result.content, usage=result.usage, cached=result.cached)
+    except LLMError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+@app.post("/chat/tools", response_model=ToolChatResponse)
+async def chat_tools_endpoint(request: ToolChatRequest, llm_backend: LLMBackend = Depends(get_llm_backend)):
+    """Chat with server-side tools; tool calls from one model turn run concurrently"""
+    if request.max_turns < 1:
+        raise HTTPException(status_code=400, detail="max_turns must be at least 1")
+    try:
+        result = await run_tool_loop(
+            request.messages,
+            tool_registry,
+            model=request.model,
+            temperature=request.temperature,
+            max_turns=request.max_turns,
+            max_tokens=request.max_tokens,
+            llm_backend=llm_backend
+        )
+        return ToolChatResponse(
+            response=result.content,
+            tool_calls=[ToolCallInfo(**call._asdict()) for call in result.tool_calls],
+            turns=result.turns,
+            stop_reason=result.stop_reason,
+            usage=result.usage
+        )
+    except LLMError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+@app.get("/prompts")
+async def list_prompts(model: str = "gpt-4o-mini"):
+    """Registered prompt templates with their slots and static token counts"""
+    return {"prompts": prompts.describe(model)}
+
+@app.post("/chat/template", response_model=TemplateChatResponse)
+async def chat_template_endpoint(request: TemplateChatRequest, llm_backend: LLMBackend = Depends(get_llm_backend)):
+    """Chat from a registered prompt template; prompts over budget are rejected before any model call"""
+    try:
+        prompt = prompts.render(
+            request.template,
+            request.variables,
+            model=request.model,
+            max_tokens=request.max_prompt_tokens
+        )
+    except PromptBudgetError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except PromptError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        result = await get_chat_completion(
+            messages=prompt.messages,
             model=request.model,
-            temperature=request.temperature
+            temperature=request.temperature,
+            use_cache=request.use_cache,
+            llm_backend=llm_backend
+        )
+        return TemplateChatResponse(
+            response=result.content,
+            usage=result.usage,
+            cached=result.cached,
+            prompt_tokens=prompt.tokens
         )
-        return ChatResponse(response=response)
     except LLMError as e:
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, llm_backend: LLMBackend = Depends(get_llm_backend)):
+    """Streaming chat completion endpoint (Server-Sent Events)"""
+    try:
+        messages = await fit_chat_context(request, llm_backend)
+    except LLMError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    stream = ChatStream(
+        messages=messages,
+        model=request.model,
+        temperature=request.temperature,
+        llm_backend=llm_backend
+    )
+    
+    async def events():
+        # Each delta is a "data" event; a final "done" event reports usage and latency
+        try:
+            async for delta in stream:
+                yield f"data: {json.dumps({'delta': delta})}\n\n"
+            summary = {
+                "usage": stream.usage,
+                "time_to_first_token_ms": round(stream.time_to_first_token * 1000, 1)
+                if stream.time_to_first_token is not None else None,
+                "duration_ms": round(stream.duration * 1000, 1),
+            }
+            yield f"event: done\ndata: {json.dumps(summary)}\n\n"
+        except LLMError as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/embed", response_model=EmbeddingResponse)
-async def embed_endpoint(request: EmbeddingRequest):
+async def embed_endpoint(request: EmbeddingRequest, llm_backend: LLMBackend = Depends(get_llm_backend)):
     """Text embedding endpoint"""
     try:
-        embedding = await get_embedding(text=request.text, model=request.model)
+        embedding = await get_embedding_batched(
+            text=request.text, model=request.model, llm_backend=llm_backend
+        )
+        # Requests share upstream batches, so report this input's own token count
+        tokens = count_tokens(request.text, request.model)
         return EmbeddingResponse(
             embedding=embedding,
-            dimensions=len(embedding)
+            dimensions=len(embedding),
+            usage={"prompt_tokens": tokens, "total_tokens": tokens}
         )
     except LLMError as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -110,11 +439,21 @@ async def embed_endpoint(request: EmbeddingRequest):
 
 @app.post("/chunk", response_model=ChunkingResponse)
 async def chunk_endpoint(request: ChunkingRequest):
-    """Text chunking endpoint"""
+    """Text chunking endpoint (fixed token windows or recursive boundary-aware splitting)"""
+    if not 0 <= request.overlap < request.max_tokens:
+        raise HTTPException(status_code=400, detail="overlap must be at least 0 and smaller than max_tokens")
     try:
-        total_tokens = count_tokens(request.text, request.model)
-        chunks = chunk_text(request.text, request.max_tokens, request.model)
-        chunk_tokens = [count_tokens(chunk, request.model) for chunk in chunks]
+        # Both strategies report the counts they computed, so nothing is encoded twice
+        if request.strategy == "recursive":
+            segments = split_segments(request.text, request.max_tokens, request.model)
+            total_tokens = sum(tokens for _, tokens in segments)
+            pairs = merge_segments(segments, request.max_tokens, request.overlap)
+            chunks = [chunk for chunk, _ in pairs]
+            chunk_tokens = [tokens for _, tokens in pairs]
+        else:
+            chunks, chunk_tokens, total_tokens = chunk_text_with_counts(
+                request.text, request.max_tokens, request.model, request.overlap
+            )
         
         return ChunkingResponse(
             chunks=chunks,
@@ -125,18 +464,316 @@ async def chunk_endpoint(request: ChunkingRequest):
         raise HTTPException(status_code=500, detail=f"Chunking error: {str(e)}")
 
 @app.post("/similar", response_model=SimilarityResponse)
-async def similarity_endpoint(request: SimilarityRequest):
-    """Find similar chunks endpoint"""
+async def similarity_endpoint(request: SimilarityRequest, llm_backend: LLMBackend = Depends(get_llm_backend)):
+    """Find similar chunks in a stored collection or in chunks sent with the request"""
+    if request.collection is None and request.chunks is None:
+        raise HTTPException(status_code=400, detail="Provide either 'collection' or 'chunks'")
     try:
-        similar_chunks = await find_similar_chunks(
-            query=request.query,
-            chunks=request.chunks,
-            top_k=request.top_k
-        )
+        if request.collection is not None:
+            similar_chunks = await search_collection(
+                query=request.query,
+                collection=vector_store.get_collection(request.collection),
+                top_k=request.top_k,
+                llm_backend=llm_backend,
+                mode=request.mode,
+                backend=request.backend
+            )
+        else:
+            similar_chunks = await find_similar_chunks(
+                query=request.query,
+                chunks=request.chunks,
+                top_k=request.top_k,
+                llm_backend=llm_backend,
+                mode=request.mode
+            )
         return SimilarityResponse(similar_chunks=similar_chunks)
+    except CollectionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except (ValueError, VectorStoreError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Similarity search error: {str(e)}")
 
+# Vector collection endpoints
+@app.post("/collections", response_model=CollectionInfo)
+async def create_collection_endpoint(request: CollectionCreateRequest):
+    """Create a named chunk collection"""
+    try:
+        collection = vector_store.create_collection(
+            request.name, model=request.model, dimensions=request.dimensions
+        )
+        return CollectionInfo(**collection.info())
+    except VectorStoreError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/collections", response_model=List[CollectionInfo])
+async def list_collections_endpoint():
+    """List all chunk collections"""
+    return [CollectionInfo(**info) for info in vector_store.list_collections()]
+
+@app.get("/collections/{name}", response_model=CollectionInfo)
+async def get_collection_endpoint(name: str):
+    """Get a collection's summary"""
+    try:
+        return CollectionInfo(**vector_store.get_collection(name).info())
+    except CollectionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except VectorStoreError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/collections/{name}/upsert", response_model=UpsertResponse)
+async def upsert_chunks_endpoint(
+    name: str,
+    request: UpsertRequest,
+    llm_backend: LLMBackend = Depends(get_llm_backend)
+):
+    """Insert or replace chunks; chunks without an embedding are embedded here"""
+    try:
+        collection = vector_store.get_collection(name)
+        # Default ids are content hashes, so re-sending a chunk replaces it
+        ids = [
+            chunk.id or hashlib.sha256(chunk.text.encode("utf-8")).hexdigest()[:16]
+            for chunk in request.chunks
+        ]
+        embeddings = [chunk.embedding for chunk in request.chunks]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            vectors = await get_embeddings(
+                [request.chunks[i].text for i in missing], model=collection.model, llm_backend=llm_backend
+            )
+            for i, vector in zip(missing, vectors):
+                embeddings[i] = vector
+
+        upserted = await asyncio.to_thread(
+            collection.upsert, ids, [chunk.text for chunk in request.chunks], embeddings
+        )
+        return UpsertResponse(upserted=upserted, ids=ids, count=len(collection))
+    except CollectionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except VectorStoreError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LLMError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/collections/{name}/query", response_model=SimilarityResponse)
+async def query_collection_endpoint(
+    name: str,
+    request: CollectionQueryRequest,
+    llm_backend: LLMBackend = Depends(get_llm_backend)
+):
+    """Query a collection by text or by vector"""
+    if (request.query is None) == (request.vector is None):
+        raise HTTPException(status_code=400, detail="Provide exactly one of 'query' or 'vector'")
+    try:
+        collection = vector_store.get_collection(name)
+        if request.vector is not None:
+            # Collection calls wait on the writer's lock, so keep them off the event loop
+            similar_chunks = await asyncio.to_thread(collection.query, request.vector, request.top_k)
+        else:
+            similar_chunks = await search_collection(
+                request.query, collection, request.top_k, llm_backend=llm_backend
+            )
+        return SimilarityResponse(similar_chunks=similar_chunks)
+    except CollectionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except VectorStoreError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LLMError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/collections/{name}/delete")
+async def delete_chunks_endpoint(name: str, request: DeleteChunksRequest):
+    """Delete chunks from a collection by id"""
+    try:
+        collection = vector_store.get_collection(name)
+        deleted = await asyncio.to_thread(collection.delete, request.ids)
+        return {"deleted": deleted, "count": len(collection)}
+    except CollectionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except VectorStoreError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/collections/{name}")
+async def delete_collection_endpoint(name: str):
+    """Delete a collection and its files"""
+    try:
+        vector_store.delete_collection(name)
+        return {"deleted": name}
+    except CollectionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except VectorStoreError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/ingest")
+async def ingest_endpoint(request: IngestRequest, llm_backend: LLMBackend = Depends(get_llm_backend)):
+    """Chunk, embed and store many documents in a collection as a background job"""
+    if not 0 <= request.overlap < request.max_tokens:
+        raise HTTPException(status_code=400, detail="overlap must be at least 0 and smaller than max_tokens")
+    try:
+        collection = vector_store.get_collection(request.collection)
+    except CollectionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except VectorStoreError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    documents = [Document(id=doc.id, text=doc.text) for doc in request.documents]
+    
+    async def run(job):
+        def report(snapshot):
+            job.progress = snapshot
+        progress = await ingest(
+            documents, collection,
+            max_tokens=request.max_tokens,
+            overlap=request.overlap,
+            processes=INGEST_PROCESSES,
+            llm_backend=llm_backend,
+            on_progress=report,
+            pool=get_ingest_pool()
+        )
+        job.progress = progress.snapshot()
+        return {"collection": collection.info()}
+    
+    return jobs.start("ingest", run).info()
+
+@app.get("/jobs/{job_id}")
+async def job_status_endpoint(job_id: str):
+    """Status and progress of a background job"""
+    try:
+        return jobs.get(job_id).info()
+    except JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+def start_batch_job(batch_id: str, llm_backend: LLMBackend) -> Dict[str, Any]:
+    """Run (or resume) a stored batch as a background job named after it"""
+    async def run(job):
+        def report(snapshot):
+            job.progress = snapshot
+        return await batch_store.run(batch_id, llm_backend=llm_backend, on_progress=report)
+    
+    try:
+        return jobs.start("batch", run, job_id=batch_id).info()
+    except JobConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/batch-jobs")
+async def create_batch_job_endpoint(request: BatchJobRequest, llm_backend: LLMBackend = Depends(get_llm_backend)):
+    """Submit an offline batch of chat or embedding requests"""
+    if request.concurrency < 1 or request.embed_batch_size < 1:
+        raise HTTPException(status_code=400, detail="concurrency and embed_batch_size must be positive")
+    if request.requests_per_minute < 0:
+        raise HTTPException(status_code=400, detail="requests_per_minute must be 0 (unpaced) or positive")
+    try:
+        batch_id = batch_store.create(request.requests, {
+            "concurrency": request.concurrency,
+            "requests_per_minute": request.requests_per_minute,
+            "embed_batch_size": request.embed_batch_size,
+        })
+    except BatchJobError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return start_batch_job(batch_id, llm_backend)
+
+@app.get("/batch-jobs/{batch_id}")
+async def batch_job_status_endpoint(batch_id: str):
+    """Status of a batch: the running job's progress, or line counts once it has stopped"""
+    try:
+        # Counting reads the whole output file, which can be large
+        summary = await asyncio.to_thread(batch_store.summary, batch_id)
+    except BatchJobError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    try:
+        info = jobs.get(batch_id).info()
+    except JobNotFoundError:
+        # Started before a restart: only the files remain
+        info = {"id": batch_id, "kind": "batch", "status": "stopped"}
+    return {**info, "lines": summary}
+
+@app.get("/batch-jobs/{batch_id}/results")
+async def batch_job_results_endpoint(batch_id: str):
+    """Results written so far, as JSONL"""
+    try:
+        path = batch_store.path(batch_id, OUTPUT_FILE)
+    except BatchJobError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if not os.path.exists(path):
+        return PlainTextResponse("", media_type="application/x-ndjson")
+    return FileResponse(path, media_type="application/x-ndjson")
+
+@app.post("/batch-jobs/{batch_id}/retry")
+async def retry_batch_job_endpoint(batch_id: str, llm_backend: LLMBackend = Depends(get_llm_backend)):
+    """Rerun a batch, retrying only lines without a successful result"""
+    try:
+        batch_store.path(batch_id)
+    except BatchJobError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return start_batch_job(batch_id, llm_backend)
+
+@app.post("/sessions", response_model=SessionInfo)
+async def create_session_endpoint(request: SessionCreateRequest):
+    """Start a server-side chat session, optionally with a system prompt"""
+    messages = [{"role": "system", "content": request.system}] if request.system else []
+    entries = count_messages(messages, request.model)
+    session_id = new_session_id()
+    await session_store.create(session_id, entries)
+    return SessionInfo(
+        session_id=session_id, messages=messages, total_tokens=sum(tokens for _, tokens in entries)
+    )
+
+@app.get("/sessions/{session_id}", response_model=SessionInfo)
+async def get_session_endpoint(session_id: str):
+    """Full stored history of a session"""
+    try:
+        entries = await session_store.load(session_id)
+    except SessionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return SessionInfo(
+        session_id=session_id,
+        messages=[message for message, _ in entries],
+        total_tokens=sum(tokens for _, tokens in entries)
+    )
+
+@app.post("/sessions/{session_id}/chat", response_model=ChatResponse)
+async def session_chat_endpoint(
+    session_id: str,
+    request: SessionChatRequest,
+    llm_backend: LLMBackend = Depends(get_llm_backend)
+):
+    """Chat within a session: send only the new message, the server supplies the history"""
+    try:
+        # Stored turns keep their token counts, so only the new message is counted
+        entries = await session_store.load(session_id)
+        new_entries = count_messages([request.message], request.model)
+        budget = request.max_context_tokens or CHAT_CONTEXT_TOKENS
+        if budget:
+            context = ConversationContext(budget, request.model)
+            context.extend_counted(entries + new_entries)
+            messages = context.messages
+        else:
+            messages = [message for message, _ in entries + new_entries]
+        
+        result = await get_chat_completion(
+            messages=messages,
+            model=request.model,
+            temperature=request.temperature,
+            use_cache=request.use_cache,
+            llm_backend=llm_backend
+        )
+        reply = {"role": "assistant", "content": result.content or ""}
+        await session_store.append(session_id, new_entries + count_messages([reply], request.model))
+        return ChatResponse(response=result.content, usage=result.usage, cached=result.cached)
+    except SessionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except LLMError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+@app.delete("/sessions/{session_id}")
+async def delete_session_endpoint(session_id: str):
+    """Delete a session and its history"""
+    if not await session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
+    return {"deleted": session_id}
+
 # Test endpoints
 @app.get("/test/chat")
 async def test_chat_endpoint():
@@ -192,6 +829,19 @@ async def count_tokens_endpoint(text: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/cache/stats")
+async def cache_stats_endpoint():
+    """Hit/miss counters for the chat response and embedding caches"""
+    return {
+        "responses": response_cache.stats(),
+        "embeddings": embedding_cache.stats()
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Latency, token, retry and cache metrics in the Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Environment check endpoint
 @app.get("/env-check")
 async def environment_check():
@@ -0,0 +1,223 @@
+"""
+Prompts Module for Week 3
+Compiled prompt templates with precomputed token counts and budget checks before sending
+"""
+
+import string
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import llm_utils
+from context_window import MESSAGE_OVERHEAD, REPLY_OVERHEAD
+
+_FORMATTER = string.Formatter()
+
+
+class PromptError(Exception):
+    """Raised for unknown templates, bad template syntax or missing variables"""
+    pass
+
+
+class PromptBudgetError(PromptError):
+    """Raised when a rendered prompt would exceed its token budget"""
+
+    def __init__(self, name: str, tokens: int, budget: int):
+        super().__init__(f"Prompt '{name}' needs about {tokens} tokens, over its budget of {budget}")
+        self.tokens = tokens
+        self.budget = budget
+
+
+class RenderedPrompt(NamedTuple):
+    messages: List[Dict[str, str]]
+    tokens: int
+    # False when tokens is the precomputed estimate rather than a count of the rendered text
+    exact: bool
+
+
+class _CompiledMessage(NamedTuple):
+    role: str
+    literals: List[str]
+    fields: List[str]
+
+
+class PromptTemplate:
+    """
+    Chat messages with {name} slots, parsed once when the template is created
+
+    Token counts of the static text are computed once per model and reused.
+    Rendering counts only the slot values, so the prompt's size is known
+    before anything is sent. Tokens can merge across a slot's edges, so the
+    sum can be off by a token or so per edge. When a prompt lands that close
+    to the budget, the rendered messages are counted exactly instead.
+    """
+
+    def __init__(self, name: str, messages: List[Dict[str, str]], max_tokens: Optional[int] = None):
+        self.name = name
+        self.max_tokens = max_tokens
+        self._messages = [self._compile(m["role"], m["content"]) for m in messages]
+        self._static_tokens: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _compile(self, role: str, content: str) -> _CompiledMessage:
+        literals, fields = [], []
+        try:
+            for literal, field, spec, conversion in _FORMATTER.parse(content):
+                literals.append(literal)
+                if field is None:
+                    continue
+                if not field.isidentifier() or spec or conversion:
+                    raise PromptError(f"Template '{self.name}': slots must be plain names, got '{{{field}}}'")
+                fields.append(field)
+        except ValueError as e:
+            raise PromptError(f"Template '{self.name}': {e}")
+        return _CompiledMessage(role, literals, fields)
+
+    @property
+    def variables(self) -> List[str]:
+        """Slot names in order of first use"""
+        return list(dict.fromkeys(field for m in self._messages for field in m.fields))
+
+    def static_tokens(self, model: str = "gpt-4o-mini") -> int:
+        """Tokens of the template without its slots, including chat-format overhead (cached per model)"""
+        with self._lock:
+            cached = self._static_tokens.get(model)
+        if cached is None:
+            literals = [literal for m in self._messages for literal in m.literals if literal]
+            cached = sum(llm_utils.count_tokens_many(literals, model))
+            cached += MESSAGE_OVERHEAD * len(self._messages) + REPLY_OVERHEAD
+            with self._lock:
+                self._static_tokens[model] = cached
+        return cached
+
+    def render(
+        self,
+        values: Dict[str, Any],
+        model: str = "gpt-4o-mini",
+        max_tokens: Optional[int] = None
+    ) -> RenderedPrompt:
+        """
+        Fill the slots and check the result against the token budget
+
+        Args:
+            values: Slot values by name
+            model: Model to use for tokenization
+            max_tokens: Budget for this render (defaults to the template's max_tokens)
+
+        Returns:
+            The messages and their token count
+
+        Raises:
+            PromptError: If a slot has no value
+            PromptBudgetError: If the prompt is over budget
+        """
+        variables = self.variables
+        missing = [name for name in variables if name not in values]
+        if missing:
+            raise PromptError(f"Template '{self.name}' is missing values for: {', '.join(missing)}")
+
+        texts = {name: str(values[name]) for name in variables}
+        slot_counts = dict(zip(texts, llm_utils.count_tokens_many(list(texts.values()), model)))
+        uses = [field for m in self._messages for field in m.fields]
+        tokens = self.static_tokens(model) + sum(slot_counts[field] for field in uses)
+
+        messages = [
+            {
+                "role": m.role,
+                "content": "".join(
+                    literal + (texts[m.fields[i]] if i < len(m.fields) else "")
+                    for i, literal in enumerate(m.literals)
+                ),
+            }
+            for m in self._messages
+        ]
+
+        budget = max_tokens if max_tokens is not None else self.max_tokens
+        if budget is None:
+            return RenderedPrompt(messages, tokens, exact=False)
+
+        # Each slot edge can shift the count by about a token
+        slack = 2 * len(uses)
+        if tokens - slack > budget:
+            raise PromptBudgetError(self.name, tokens, budget)
+        if tokens + slack <= budget:
+            return RenderedPrompt(messages, tokens, exact=False)
+
+        tokens = sum(llm_utils.count_tokens_many([m["content"] for m in messages], model))
+        tokens += MESSAGE_OVERHEAD * len(messages) + REPLY_OVERHEAD
+        if tokens > budget:
+            raise PromptBudgetError(self.name, tokens, budget)
+        return RenderedPrompt(messages, tokens, exact=True)
+
+
+class PromptRegistry:
+    """Named prompt templates, compiled when registered"""
+
+    def __init__(self):
+        self._templates: Dict[str, PromptTemplate] = {}
+
+    def register(
+        self,
+        name: str,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int] = None
+    ) -> PromptTemplate:
+        """
+        Compile and store a template, replacing any with the same name
+
+        Raises:
+            PromptError: If the template syntax is invalid
+        """
+        template = PromptTemplate(name, messages, max_tokens)
+        self._templates[name] = template
+        return template
+
+    def get(self, name: str) -> PromptTemplate:
+        """
+        Raises:
+            PromptError: If no template has that name
+        """
+        template = self._templates.get(name)
+        if template is None:
+            raise PromptError(f"Unknown prompt template '{name}'")
+        return template
+
+    def render(
+        self,
+        name: str,
+        values: Dict[str, Any],
+        model: str = "gpt-4o-mini",
+        max_tokens: Optional[int] = None
+    ) -> RenderedPrompt:
+        """Render a registered template (see PromptTemplate.render)"""
+        return self.get(name).render(values, model, max_tokens)
+
+    def describe(self, model: str = "gpt-4o-mini") -> List[Dict[str, Any]]:
+        """Name, slots, budget and static token count of every template"""
+        return [
+            {
+                "name": t.name,
+                "variables": t.variables,
+                "max_tokens": t.max_tokens,
+                "static_tokens": t.static_tokens(model),
+            }
+            for t in self._templates.values()
+        ]
+
+
+prompts = PromptRegistry()
+
+prompts.register("travel_guide", [
+    {"role": "system", "content": "You are a helpful travel guide."},
+    {"role": "user", "content": "Plan a {days}-day trip to {destination}."},
+], max_tokens=2000)
+
+prompts.register("summarize", [
+    {"role": "system", "content": "Summarize the user's text in {length} sentences. Keep names, numbers and decisions."},
+    {"role": "user", "content": "{text}"},
+], max_tokens=16000)
+
+prompts.register("answer_from_context", [
+    {"role": "system", "content": "Answer using only the context below. If the answer is not in it, say so.\n\n"
+                                  "Context:\n{context}"},
+    {"role": "user", "content": "{question}"},
+], max_tokens=16000)
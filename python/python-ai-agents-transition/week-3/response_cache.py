@@ -0,0 +1,184 @@
+"""
+Response Cache Module for Week 3
+Exact (TTL + LRU) and optional semantic caching of chat completions
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from similarity import normalize
+
+
+class CacheEntry(NamedTuple):
+    response: str
+    expires_at: float
+    scope: Optional[str]
+    vector: Optional[np.ndarray]
+
+
+def _digest(payload: Any) -> str:
+    # Sorted keys and fixed separators make equal requests hash equally
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache chat completions by a canonical hash of (model, messages, temperature)
+
+    Entries expire after ttl_seconds and the least recently used entry is
+    evicted once max_items is reached.
+
+    When semantic_threshold is set, entries can also carry the embedding of
+    their final user message. A request whose final message embeds within that
+    cosine similarity of a cached one reuses its answer, provided everything
+    before the final message (its scope) is identical.
+    """
+
+    def __init__(
+        self,
+        max_items: int = 1024,
+        ttl_seconds: float = 3600,
+        semantic_threshold: Optional[float] = None
+    ):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.semantic_threshold = semantic_threshold
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._scopes: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.semantic_threshold is not None
+
+    @staticmethod
+    def make_key(model: str, messages: Sequence[Dict[str, Any]], temperature: float) -> str:
+        """Build the exact-match key for a chat request"""
+        return _digest({"model": model, "messages": list(messages), "temperature": temperature})
+
+    @staticmethod
+    def make_scope(model: str, messages: Sequence[Dict[str, Any]], temperature: float) -> str:
+        """Build the semantic scope: the request without its final message"""
+        return _digest({"model": model, "context": list(messages[:-1]), "temperature": temperature})
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        if entry.scope is not None:
+            keys = self._scopes[entry.scope]
+            keys.remove(key)
+            if not keys:
+                del self._scopes[entry.scope]
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a response by exact key
+
+        Args:
+            key: Key from make_key
+
+        Returns:
+            The cached response, or None if it is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.response
+
+    def get_similar(self, scope: str, embedding: Sequence[float]) -> Optional[str]:
+        """
+        Look up the response whose query embedding is closest to embedding
+
+        Args:
+            scope: Scope from make_scope
+            embedding: Embedding of the request's final message
+
+        Returns:
+            The best cached response at or above semantic_threshold, or None
+        """
+        if not self.semantic_enabled:
+            return None
+
+        with self._lock:
+            now = time.monotonic()
+            for key in [k for k in self._scopes.get(scope, []) if self._entries[k].expires_at <= now]:
+                self._drop(key)
+
+            keys = self._scopes.get(scope)
+            if keys:
+                scores = np.stack([self._entries[k].vector for k in keys]) @ normalize(embedding)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.semantic_threshold:
+                    key = keys[best]
+                    self._entries.move_to_end(key)
+                    self.semantic_hits += 1
+                    return self._entries[key].response
+            return None
+
+    def put(
+        self,
+        key: str,
+        response: str,
+        scope: Optional[str] = None,
+        embedding: Optional[Sequence[float]] = None
+    ) -> None:
+        """
+        Store a response
+
+        Args:
+            key: Key from make_key
+            response: Completion text to cache
+            scope: Scope from make_scope, for the semantic tier
+            embedding: Embedding of the request's final message, for the semantic tier
+        """
+        semantic = self.semantic_enabled and scope is not None and embedding is not None
+        entry = CacheEntry(
+            response=response,
+            expires_at=time.monotonic() + self.ttl_seconds,
+            scope=scope if semantic else None,
+            vector=normalize(embedding) if semantic else None,
+        )
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            if entry.scope is not None:
+                self._scopes.setdefault(entry.scope, []).append(key)
+            while len(self._entries) > self.max_items:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every cached response"""
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and the number of cached responses"""
+        return {
+            "items": len(self._entries),
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "semantic_threshold": self.semantic_threshold,
+        }
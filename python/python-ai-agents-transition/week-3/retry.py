@@ -0,0 +1,319 @@
+"""
+Retry Module for Week 3
+Jittered retries with Retry-After support, error classification, deadlines and a circuit breaker
+"""
+
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import openai
+
+from logging_config import SAMPLED
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Status codes worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+RETRYABLE_EXCEPTIONS = (
+    openai.APIConnectionError,  # includes APITimeoutError
+    asyncio.TimeoutError,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+class RetryError(Exception):
+    """Raised when a call fails for good: a fatal error, no attempts left or no time left"""
+
+    def __init__(self, last_error: Exception, attempts: int):
+        super().__init__(str(last_error))
+        self.last_error = last_error
+        self.attempts = attempts
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while the circuit breaker is open"""
+    pass
+
+
+def status_code_of(error: Exception) -> Optional[int]:
+    """HTTP status code carried by an error, if any"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Classify an error as transient (worth retrying) or fatal
+
+    Rate limits, timeouts, conflicts, 5xx responses and connection failures
+    are transient. Other 4xx responses (bad request, auth, not found) and
+    programming errors will fail the same way again.
+    """
+    status = status_code_of(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES or status >= 500
+    return isinstance(error, RETRYABLE_EXCEPTIONS)
+
+
+def retry_after_of(error: Exception) -> Optional[float]:
+    """
+    Seconds the server asked us to wait, from retry-after-ms or Retry-After headers
+
+    Returns:
+        The delay in seconds, or None if the error carries no usable hint
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    # Retry-After may also be an HTTP date
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        # Malformed hint: fall back to backoff
+        return None
+    return max(parsed.timestamp() - time.time(), 0.0)
+
+
+class CircuitBreaker:
+    """
+    Fails fast while the upstream keeps failing
+
+    After failure_threshold consecutive transient failures the circuit opens
+    and calls are rejected for recovery_time seconds. Then one probe call is
+    let through (half-open): success closes the circuit, failure reopens it.
+    The caller holding the probe must release it however the call ends, or
+    the circuit would stay half-open with no probe allowed.
+    """
+
+    def __init__(self, failure_threshold: int = 5, recovery_time: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.recovery_time:
+            return "half_open"
+        return "open"
+
+    def acquire(self) -> Optional[str]:
+        """
+        Ask to send a call upstream now
+
+        Returns:
+            "closed" for a normal call, "probe" if this call is the half-open
+            probe (release it with release_probe), or None if the call is rejected
+        """
+        state = self.state
+        if state == "closed":
+            return "closed"
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return "probe"
+        return None
+
+    def allow(self) -> bool:
+        """Return whether a call may go upstream now"""
+        return self.acquire() is not None
+
+    def release_probe(self) -> None:
+        """Free the probe slot without an outcome, e.g. when the probe was cancelled"""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self, probe: bool = False) -> None:
+        """
+        Count a transient failure
+
+        Args:
+            probe: Whether the failed call was the half-open probe; failures of
+                calls already in flight when the circuit opened keep the probe slot taken
+        """
+        self.failures += 1
+        if probe or self.failures >= self.failure_threshold:
+            if self.opened_at is None or probe:
+                logger.warning("Circuit breaker opened after %d consecutive failures", self.failures)
+            self.opened_at = time.monotonic()
+        if probe:
+            self._probing = False
+
+
+class RetryPolicy:
+    """
+    When and how long to wait between attempts of an upstream call
+
+    Delays use full jitter (a uniform draw between 0 and the exponential
+    backoff), so clients that failed together don't retry together. A
+    Retry-After hint from the server takes precedence. No attempt starts
+    or runs past the overall deadline.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+        deadline: Optional[float] = 60.0,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.breaker = breaker
+
+    def backoff(self, attempt: int) -> float:
+        """Jittered delay before retrying after the given (0-based) attempt"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def delay_for(
+        self,
+        error: Exception,
+        attempt: int,
+        max_attempts: Optional[int] = None,
+        remaining: Optional[float] = None
+    ) -> Optional[float]:
+        """
+        Decide whether to retry after a failed attempt
+
+        Args:
+            error: The error the attempt raised
+            attempt: 0-based index of the attempt that failed
+            max_attempts: Attempt budget (defaults to self.max_attempts)
+            remaining: Seconds left before the deadline, if there is one
+
+        Returns:
+            Seconds to wait before the next attempt, or None to give up
+        """
+        if not is_retryable(error) or attempt + 1 >= (max_attempts or self.max_attempts):
+            return None
+
+        delay = retry_after_of(error)
+        delay = self.backoff(attempt) if delay is None else min(delay, self.max_delay)
+        if remaining is not None and delay >= remaining:
+            return None
+        return delay
+
+    def record(self, error: Optional[Exception], probe: bool = False) -> None:
+        """
+        Feed an attempt's outcome to the circuit breaker
+
+        Args:
+            error: The attempt's error, or None for success
+            probe: Whether the attempt was the half-open probe
+        """
+        if self.breaker is None:
+            return
+        if error is None:
+            self.breaker.record_success()
+        elif is_retryable(error):
+            self.breaker.record_failure(probe)
+        elif probe and status_code_of(error) is not None:
+            # Fatal errors are about the request, but a response to the probe shows the upstream is back
+            self.breaker.record_success()
+
+    def check_circuit(self) -> bool:
+        """
+        Returns:
+            Whether this call is the half-open probe, to pass to record and release
+
+        Raises:
+            CircuitOpenError: If the circuit breaker is rejecting calls
+        """
+        if self.breaker is None:
+            return False
+        admitted = self.breaker.acquire()
+        if admitted is None:
+            raise CircuitOpenError("Upstream is failing; circuit breaker is open")
+        return admitted == "probe"
+
+    def release(self, probe: bool) -> None:
+        """Free the probe slot taken by check_circuit, whatever the attempt's outcome"""
+        if probe and self.breaker is not None:
+            self.breaker.release_probe()
+
+    async def call(
+        self,
+        fn: Callable[[], Awaitable[T]],
+        max_attempts: Optional[int] = None,
+        description: str = "Request"
+    ) -> T:
+        """
+        Run fn() until it succeeds, retrying transient failures
+
+        Args:
+            fn: Zero-argument coroutine function making one attempt
+            max_attempts: Attempt budget (defaults to self.max_attempts)
+            description: Label used in log messages
+
+        Returns:
+            The result of the first successful attempt
+
+        Raises:
+            CircuitOpenError: If the circuit breaker is open
+            RetryError: If the call failed for good
+        """
+        max_attempts = max_attempts or self.max_attempts
+        deadline = time.monotonic() + self.deadline if self.deadline else None
+
+        attempt = 0
+        while True:
+            probe = self.check_circuit()
+            remaining = deadline - time.monotonic() if deadline else None
+            try:
+                logger.info("%s attempt %d/%d", description, attempt + 1, max_attempts, extra=SAMPLED)
+                if remaining is None:
+                    result = await fn()
+                else:
+                    result = await asyncio.wait_for(fn(), timeout=remaining)
+            except Exception as e:
+                self.record(e, probe)
+                error = e
+            else:
+                self.record(None)
+                return result
+            finally:
+                # Also runs on cancellation, which the except above does not see
+                self.release(probe)
+
+            logger.error("%s failed (attempt %d): %r", description, attempt + 1, error)
+            remaining = deadline - time.monotonic() if deadline else None
+            delay = self.delay_for(error, attempt, max_attempts, remaining)
+            if delay is None:
+                raise RetryError(error, attempt + 1) from error
+            logger.info("Retrying in %.2f seconds...", delay)
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -0,0 +1,192 @@
+"""
+Sessions Module for Week 3
+Server-side chat history, stored with token counts, in memory or in Redis
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# A stored turn: the message and its token count (see context_window.count_messages)
+Entry = Tuple[Dict[str, Any], int]
+
+
+class SessionNotFoundError(Exception):
+    """Raised when a session does not exist or has expired"""
+    pass
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+class SessionStore(ABC):
+    """
+    Interface for storing chat history per session
+
+    History is append-only: each chat turn appends the new user message and
+    the reply, so a turn writes only what is new and never rewrites the
+    whole conversation. Sessions expire ttl_seconds after their last write.
+    """
+
+    @abstractmethod
+    async def create(self, session_id: str, entries: List[Entry]) -> None:
+        """Start a session, optionally seeded with entries (e.g. a system prompt)"""
+
+    @abstractmethod
+    async def load(self, session_id: str) -> List[Entry]:
+        """
+        Return a session's history in order
+
+        Raises:
+            SessionNotFoundError: If the session does not exist
+        """
+
+    @abstractmethod
+    async def append(self, session_id: str, entries: List[Entry]) -> None:
+        """
+        Add entries to the end of a session's history
+
+        Raises:
+            SessionNotFoundError: If the session does not exist
+        """
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> bool:
+        """Delete a session; return whether it existed"""
+
+    async def close(self) -> None:
+        """Release any connections held by the store"""
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Process-local session store for development and tests
+
+    Sessions live in an LRU of at most max_sessions entries and are lost on
+    restart; run several workers against Redis instead.
+    """
+
+    def __init__(self, max_sessions: int = 10_000, ttl_seconds: float = 24 * 3600):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, Tuple[List[Entry], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, session_id: str) -> List[Entry]:
+        item = self._sessions.get(session_id)
+        if item is None or item[1] <= time.monotonic():
+            self._sessions.pop(session_id, None)
+            raise SessionNotFoundError(f"Session '{session_id}' not found")
+        self._sessions.move_to_end(session_id)
+        return item[0]
+
+    async def create(self, session_id: str, entries: List[Entry]) -> None:
+        with self._lock:
+            self._sessions[session_id] = (list(entries), time.monotonic() + self.ttl_seconds)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    async def load(self, session_id: str) -> List[Entry]:
+        with self._lock:
+            return list(self._get(session_id))
+
+    async def append(self, session_id: str, entries: List[Entry]) -> None:
+        with self._lock:
+            history = self._get(session_id)
+            history.extend(entries)
+            self._sessions[session_id] = (history, time.monotonic() + self.ttl_seconds)
+
+    async def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Session store backed by Redis, shared by every worker
+
+    Each session is a Redis list of JSON entries, so appending a turn is one
+    RPUSH and loading is one LRANGE. Needs the redis package.
+    """
+
+    def __init__(self, url: str, ttl_seconds: float = 24 * 3600, prefix: str = "chat:session:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise ImportError("RedisSessionStore needs the redis package: pip install redis") from e
+
+        self.ttl_seconds = int(ttl_seconds)
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}"
+
+    @staticmethod
+    def _encode(entries: List[Entry]) -> List[str]:
+        return [json.dumps({"message": message, "tokens": tokens}) for message, tokens in entries]
+
+    async def create(self, session_id: str, entries: List[Entry]) -> None:
+        # An empty Redis list doesn't exist, so a marker keeps new sessions visible
+        key = self._key(session_id)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.rpush(key, json.dumps(None), *self._encode(entries))
+            pipe.expire(key, self.ttl_seconds)
+            await pipe.execute()
+
+    async def load(self, session_id: str) -> List[Entry]:
+        items = await self._redis.lrange(self._key(session_id), 0, -1)
+        if not items:
+            raise SessionNotFoundError(f"Session '{session_id}' not found")
+        decoded = [json.loads(item) for item in items[1:]]
+        return [(item["message"], item["tokens"]) for item in decoded]
+
+    async def append(self, session_id: str, entries: List[Entry]) -> None:
+        # RPUSHX only appends to an existing list, so expired sessions aren't recreated
+        key = self._key(session_id)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.rpushx(key, *self._encode(entries))
+            pipe.expire(key, self.ttl_seconds)
+            length, _ = await pipe.execute()
+        if not length:
+            raise SessionNotFoundError(f"Session '{session_id}' not found")
+
+    async def delete(self, session_id: str) -> bool:
+        return bool(await self._redis.delete(self._key(session_id)))
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_session_store(url: Optional[str] = None) -> SessionStore:
+    """
+    Build the session store named by url or the SESSION_STORE_URL environment variable
+
+    Args:
+        url: A redis:// or rediss:// URL, or empty for the in-memory store
+
+    Returns:
+        The configured store
+    """
+    url = url if url is not None else os.getenv("SESSION_STORE_URL", "")
+    ttl_seconds = float(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600)))
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        logger.info("Storing chat sessions in Redis")
+        return RedisSessionStore(url, ttl_seconds)
+    if url:
+        raise ValueError(f"Unsupported session store URL '{url}' (expected redis:// or empty)")
+    return InMemorySessionStore(
+        max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "10000")),
+        ttl_seconds=ttl_seconds,
+    )
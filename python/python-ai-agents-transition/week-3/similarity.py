@@ -0,0 +1,194 @@
+"""
+Similarity Engine Module for Week 3
+NumPy-vectorized cosine similarity search over a contiguous float32 matrix
+"""
+
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize vectors row-wise as float32
+
+    Zero vectors stay zero, so they score 0 against everything, matching
+    cosine_similarity in llm_utils.
+
+    Args:
+        vectors: Array of shape (n, d) or (d,)
+
+    Returns:
+        Normalized float32 array with the same shape
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    Select the indices of the top_k highest scores, best first
+
+    argpartition finds the top_k in O(n); only those k are then sorted.
+
+    Args:
+        scores: 1-D array of scores
+        top_k: Number of indices to return
+
+    Returns:
+        Indices into scores ordered by descending score
+    """
+    top_k = min(top_k, scores.shape[0])
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    if top_k < scores.shape[0]:
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class SimilarityEngine:
+    """
+    Exact cosine similarity search over pre-normalized vectors
+
+    Vectors are stored normalized in one contiguous float32 matrix, so a query
+    is scored with a single matrix-vector product and a batch of queries with
+    a single matrix-matrix product. The matrix grows by doubling its capacity.
+    """
+
+    def __init__(self, dimensions: Optional[int] = None, capacity: int = 1024):
+        self.dimensions = dimensions
+        self._size = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._capacity = capacity
+        if dimensions is not None:
+            self._matrix = np.empty((capacity, dimensions), dtype=np.float32)
+
+    @classmethod
+    def from_vectors(cls, vectors: Sequence[Sequence[float]]) -> "SimilarityEngine":
+        """Build an engine holding the given vectors, in order"""
+        engine = cls(capacity=max(len(vectors), 1))
+        if len(vectors):
+            engine.add(vectors)
+        return engine
+
+    @classmethod
+    def from_normalized(cls, matrix: np.ndarray) -> "SimilarityEngine":
+        """
+        Wrap an already-normalized float32 matrix without copying it
+
+        Useful for memory-mapped arrays that should not be loaded into RAM.
+        """
+        engine = cls()
+        engine._matrix = matrix
+        engine._size = matrix.shape[0]
+        engine._capacity = matrix.shape[0]
+        engine.dimensions = matrix.shape[1]
+        return engine
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """The normalized vectors currently stored, shape (n, d)"""
+        if self._matrix is None:
+            return np.empty((0, self.dimensions or 0), dtype=np.float32)
+        return self._matrix[:self._size]
+
+    def add(self, vectors: Sequence[Sequence[float]]) -> List[int]:
+        """
+        Append vectors to the engine
+
+        Args:
+            vectors: Vectors of shape (n, d)
+
+        Returns:
+            Row indices assigned to the new vectors
+
+        Raises:
+            ValueError: If the vector dimensions don't match the engine
+        """
+        rows = normalize(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+        if self.dimensions is None:
+            self.dimensions = rows.shape[1]
+        if rows.shape[1] != self.dimensions:
+            raise ValueError(
+                f"Expected vectors with {self.dimensions} dimensions, got {rows.shape[1]}"
+            )
+
+        needed = self._size + rows.shape[0]
+        if self._matrix is None or needed > self._matrix.shape[0]:
+            capacity = max(self._capacity, 1)
+            while capacity < needed:
+                capacity *= 2
+            grown = np.empty((capacity, self.dimensions), dtype=np.float32)
+            if self._matrix is not None:
+                grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+            self._capacity = capacity
+
+        start = self._size
+        self._matrix[start:needed] = rows
+        self._size = needed
+        return list(range(start, needed))
+
+    def scores(self, query: Sequence[float]) -> np.ndarray:
+        """Return the cosine similarity of query against every stored vector"""
+        query = normalize(query)
+        if query.shape[-1] != self.dimensions:
+            raise ValueError(
+                f"Expected a query with {self.dimensions} dimensions, got {query.shape[-1]}"
+            )
+        return self.matrix @ query
+
+    def search(self, query: Sequence[float], top_k: int = 3) -> List[Tuple[int, float]]:
+        """
+        Find the stored vectors most similar to a query
+
+        Args:
+            query: Query vector of shape (d,)
+            top_k: Number of results to return
+
+        Returns:
+            (row index, cosine similarity) pairs, best first
+        """
+        if self._size == 0:
+            return []
+
+        scores = self.scores(query)
+        return [(int(i), float(scores[i])) for i in top_k_indices(scores, top_k)]
+
+    def search_batch(
+        self,
+        queries: Sequence[Sequence[float]],
+        top_k: int = 3
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Find the most similar stored vectors for several queries at once
+
+        Args:
+            queries: Query vectors of shape (q, d)
+            top_k: Number of results per query
+
+        Returns:
+            One list of (row index, cosine similarity) pairs per query, best first
+        """
+        queries = normalize(np.atleast_2d(queries))
+        if self._size == 0:
+            return [[] for _ in range(queries.shape[0])]
+        if queries.shape[1] != self.dimensions:
+            raise ValueError(
+                f"Expected queries with {self.dimensions} dimensions, got {queries.shape[1]}"
+            )
+
+        # (q, d) @ (d, n) -> (q, n) in one BLAS call
+        scores = queries @ self.matrix.T
+        return [
+            [(int(i), float(row[i])) for i in top_k_indices(row, top_k)]
+            for row in scores
+        ]
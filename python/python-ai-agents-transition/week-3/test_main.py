@@ -4,12 +4,41 @@ Comprehensive tests for Week 3 LLM functionality
 
 import pytest
 import asyncio
-from httpx import AsyncClient
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from httpx import AsyncClient, ASGITransport
+import main
 from main import app
+from deps import get_llm_backend
+import llm_utils
+import metrics
+from concurrency import ConcurrencyLimiter, MicroBatcher, RateLimiter, SingleFlight
+from backends import BackendError, FakeBackend, OpenAIBackend, create_backend
+from embedding_cache import EmbeddingCache
+from context_window import SUMMARY_PREFIX, ConversationContext, fit_messages
+from logging_config import SAMPLED, SamplingFilter, configure_logging, shutdown_logging
+from metrics import Registry
+from response_cache import ResponseCache
+from retry import CircuitBreaker, CircuitOpenError, RetryError, RetryPolicy, is_retryable, retry_after_of
+from batch_jobs import BatchStore, run_batch
+from ingest import Document, discover_documents, ingest
+from sessions import InMemorySessionStore
+from tools import ToolRegistry, run_tool_loop
+from prompts import PromptBudgetError, PromptError, PromptRegistry
+from similarity import SimilarityEngine, top_k_indices
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from vector_store import VectorStore, VectorStoreError, CollectionNotFoundError
+from ann_index import IVFIndex, recall_at_k
+from chunking import iter_chunks, iter_file_chunks, split_recursive
 from llm_utils import (
-    get_chat_response, get_embedding, count_tokens, chunk_text,
+    get_chat_response, get_embedding, get_embeddings, count_tokens, chunk_text,
     test_chat, test_embedding, test_prompt_engineering, test_function_calling,
-    test_chunking_and_embedding, find_similar_chunks, cosine_similarity
+    test_chunking_and_embedding, find_similar_chunks, cosine_similarity,
+    pack_embedding_batches, search_collection, LLMError
 )
 
 
@@ -92,6 +121,25 @@ async def test_chunk_endpoint():
         assert len(data["chunks"]) > 0
 
 
+@pytest.mark.asyncio
+async def test_chunk_endpoint_recursive_strategy():
+    """Test the chunk endpoint's recursive strategy and overlap validation"""
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        text = "\n\n".join(["This is a paragraph about testing. It has two sentences."] * 20)
+        response = await ac.post("/chunk", json={
+            "text": text, "max_tokens": 40, "strategy": "recursive", "overlap": 5
+        })
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["chunks"]) == len(data["chunk_tokens"]) > 1
+        assert all(tokens <= 40 for tokens in data["chunk_tokens"])
+
+        response = await ac.post("/chunk", json={"text": text, "max_tokens": 40, "overlap": 40})
+        assert response.status_code == 400
+        response = await ac.post("/chunk", json={"text": text, "strategy": "semantic"})
+        assert response.status_code == 422
+
+
 @pytest.mark.asyncio
 async def test_tokens_endpoint():
     """Test the tokens endpoint"""
@@ -162,6 +210,1551 @@ def test_cosine_similarity():
         cosine_similarity([1, 2], [1, 2, 3])
 
 
+class WordEncoder:
+    """Stand-in tokenizer with one token per word-plus-leading-space, like BPE pre-tokenization"""
+
+    def encode_ordinary(self, text):
+        import re
+        return re.findall(r"\s*\S+|\s+", text)
+
+    def encode_ordinary_batch(self, texts, num_threads=8):
+        return [self.encode_ordinary(text) for text in texts]
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+@pytest.fixture(autouse=True)
+def fresh_circuit_breaker(monkeypatch):
+    """Keep one test's upstream failures from opening the circuit for the next"""
+    monkeypatch.setattr(llm_utils.retry_policy, "breaker", CircuitBreaker())
+
+
+def use_client(monkeypatch, client):
+    """Route llm_utils through an OpenAIBackend wrapping a stub SDK client"""
+    monkeypatch.setattr(llm_utils, "llm_backend", OpenAIBackend(client=client))
+
+
+@pytest.fixture
+def word_encoder(monkeypatch):
+    """Tokenize with WordEncoder instead of tiktoken, with a clean token-count cache"""
+    encoder = WordEncoder()
+    monkeypatch.setattr(llm_utils, "get_encoder", lambda model="gpt-4o-mini": encoder)
+    llm_utils.clear_token_cache()
+    yield encoder
+    llm_utils.clear_token_cache()
+
+
+def test_count_tokens_many_batches_and_caches(word_encoder, monkeypatch):
+    """Test batch counting, de-duplication and the LRU cache of token counts"""
+    batches = []
+    original = word_encoder.encode_ordinary_batch
+
+    def tracking_batch(texts, num_threads=8):
+        batches.append(list(texts))
+        return original(texts, num_threads)
+
+    monkeypatch.setattr(word_encoder, "encode_ordinary_batch", tracking_batch)
+    texts = [f"token{' x' * i}" for i in range(20)]
+
+    counts = llm_utils.count_tokens_many(texts + texts[:5])
+    assert counts == [1 + i for i in range(20)] + [1, 2, 3, 4, 5]
+    assert len(batches) == 1 and len(batches[0]) == 20
+
+    # Every string is now cached, so nothing is encoded again
+    assert llm_utils.count_tokens_many(texts) == counts[:20]
+    assert count_tokens(texts[3]) == 4
+    assert len(batches) == 1
+
+
+def test_get_encoder_loads_lazily_per_model(monkeypatch):
+    """Test that encoders load once per model and failures fall back to estimation"""
+    loads = []
+
+    def encoding_for_model(model):
+        loads.append(model)
+        if model == "offline-model":
+            raise ConnectionError("no network")
+        return WordEncoder()
+
+    monkeypatch.setattr(llm_utils.tiktoken, "encoding_for_model", encoding_for_model)
+    monkeypatch.setattr(llm_utils, "_encoders", {})
+    llm_utils.clear_token_cache()
+
+    assert isinstance(llm_utils.get_encoder("model-a"), WordEncoder)
+    llm_utils.get_encoder("model-a")
+    assert llm_utils.get_encoder("offline-model") is None
+    llm_utils.get_encoder("offline-model")
+    assert loads == ["model-a", "offline-model"]
+
+    assert count_tokens("one two three four", model="model-a") == 4
+    assert count_tokens("one two three four", model="offline-model") == len("one two three four") // 4
+    llm_utils.clear_token_cache()
+
+
+def test_iter_chunks_streams_across_windows(word_encoder):
+    """Test that streamed chunks match whole-text chunking regardless of window size"""
+    text = " ".join(f"word{i}" for i in range(100))
+
+    whole = list(iter_chunks([text], max_tokens=10))
+    assert len(whole) == 10
+    assert "".join(whole) == text
+
+    # Tiny windows split words mid-way; the carry must stitch them back together
+    windows = [text[i:i + 7] for i in range(0, len(text), 7)]
+    assert list(iter_chunks(iter(windows), max_tokens=10)) == whole
+
+    overlapped = list(iter_chunks(iter(windows), max_tokens=10, overlap=3))
+    assert overlapped[0] == whole[0]
+    assert overlapped[1].split()[:3] == whole[0].split()[-3:]
+    assert overlapped[-1].split()[-1] == "word99"
+    assert all(len(chunk.split()) <= 10 for chunk in overlapped)
+
+    with pytest.raises(ValueError):
+        list(iter_chunks([text], max_tokens=10, overlap=10))
+
+
+def test_iter_file_chunks(tmp_path, word_encoder):
+    """Test chunking a file lazily in small windows"""
+    path = tmp_path / "doc.txt"
+    text = "\n".join(f"line {i} of the document" for i in range(200))
+    path.write_text(text)
+
+    chunks = iter_file_chunks(str(path), max_tokens=50, window_chars=64)
+    assert not isinstance(chunks, list)
+    assert "".join(chunks) == text
+
+
+def test_chunk_text_overlap(word_encoder):
+    """Test fixed-size chunking with token overlap"""
+    text = " ".join(str(i) for i in range(20))
+
+    chunks = chunk_text(text, max_tokens=10, overlap=3)
+    assert [chunk.split() for chunk in chunks] == [
+        [str(i) for i in range(0, 10)],
+        [str(i) for i in range(7, 17)],
+        [str(i) for i in range(14, 20)],
+    ]
+    assert chunk_text("", max_tokens=10, overlap=3) == []
+
+
+def test_split_recursive_prefers_natural_boundaries(word_encoder):
+    """Test that recursive splitting keeps paragraphs and sentences whole when they fit"""
+    paragraph = "One two three. Four five six. Seven eight nine."
+    text = "\n\n".join([paragraph] * 3)
+
+    pairs = split_recursive(text, max_tokens=9)
+    assert [chunk.strip() for chunk, _ in pairs] == [paragraph] * 3
+    assert "".join(chunk for chunk, _ in pairs) == text
+
+    # Paragraphs over the limit fall back to sentences, and counts are exact sums
+    pairs = split_recursive(text, max_tokens=5)
+    assert all(chunk.strip().endswith(".") for chunk, _ in pairs)
+    assert all(tokens == count_tokens(chunk) for chunk, tokens in pairs)
+    assert all(tokens <= 5 for _, tokens in pairs)
+
+    # Overlap repeats whole trailing segments of the previous chunk
+    pairs = split_recursive(paragraph, max_tokens=6, overlap=3)
+    assert [chunk.strip() for chunk, _ in pairs] == [
+        "One two three. Four five six.", "Four five six. Seven eight nine."
+    ]
+
+    with pytest.raises(ValueError):
+        split_recursive(text, max_tokens=5, overlap=5)
+
+
+def test_similarity_engine_matches_cosine_similarity():
+    """Test that vectorized scores match cosine_similarity and top-k is ordered"""
+    import random
+
+    rng = random.Random(0)
+    vectors = [[rng.uniform(-1, 1) for _ in range(16)] for _ in range(50)]
+    query = [rng.uniform(-1, 1) for _ in range(16)]
+
+    engine = SimilarityEngine(capacity=4)
+    engine.add(vectors[:10])
+    engine.add(vectors[10:])
+    assert len(engine) == 50
+
+    expected = sorted(
+        ((i, cosine_similarity(query, v)) for i, v in enumerate(vectors)),
+        key=lambda pair: pair[1], reverse=True
+    )[:5]
+    results = engine.search(query, top_k=5)
+    assert [i for i, _ in results] == [i for i, _ in expected]
+    for (_, score), (_, want) in zip(results, expected):
+        assert score == pytest.approx(want, abs=1e-5)
+
+    batch = engine.search_batch([query, vectors[7]], top_k=1)
+    assert batch[0][0][0] == results[0][0]
+    assert batch[0][0][1] == pytest.approx(results[0][1], abs=1e-5)
+    assert batch[1][0][0] == 7
+
+    with pytest.raises(ValueError):
+        engine.add([[1.0, 2.0]])
+
+
+def test_top_k_indices():
+    """Test top-k selection edge cases"""
+    import numpy as np
+
+    scores = np.array([0.1, 0.9, 0.5, 0.7], dtype=np.float32)
+    assert top_k_indices(scores, 2).tolist() == [1, 3]
+    assert top_k_indices(scores, 10).tolist() == [1, 3, 2, 0]
+    assert top_k_indices(scores, 0).tolist() == []
+
+
+def test_ivf_index_recall_inserts_and_persistence(tmp_path):
+    """Test IVF recall against exact search, incremental inserts and save/load"""
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((10, 32))
+    vectors = centres[rng.integers(0, 10, 2000)] + rng.standard_normal((2000, 32)) * 0.3
+    queries = vectors[:20] + rng.standard_normal((20, 32)) * 0.1
+
+    exact = SimilarityEngine.from_vectors(vectors)
+    index = IVFIndex(dimensions=32, nlist=16, nprobe=4)
+    index.add(vectors[:1000])
+    assert index.is_trained  # trained automatically at 16 * 39 vectors
+    index.add(vectors[1000:])
+    assert len(index) == 2000
+
+    exact_results = exact.search_batch(queries, top_k=5)
+    assert recall_at_k(index.search_batch(queries, top_k=5), exact_results, 5) >= 0.8
+    # Probing every list is an exhaustive search
+    full = index.search_batch(queries, top_k=5, nprobe=16)
+    assert recall_at_k(full, exact_results, 5) == 1.0
+
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+    loaded = IVFIndex.load(path)
+    assert len(loaded) == 2000
+    assert loaded.search(queries[0], top_k=5) == index.search(queries[0], top_k=5)
+    assert loaded.add([vectors[0]]) == [2000]
+
+
+def test_collection_ivf_index_is_trained_once_and_saved(tmp_path, monkeypatch):
+    """Test that a collection's IVF index is saved, reused after reopening, extended on append, saved on close and dropped on overwrite"""
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((300, 8)).astype(np.float32)
+    store = VectorStore(str(tmp_path))
+    collection = store.create_collection("docs")
+    collection.upsert([str(i) for i in range(300)], [f"t{i}" for i in range(300)], vectors.tolist())
+
+    exact = collection.query(vectors[7], top_k=1)
+    assert collection.query(vectors[7], top_k=1, backend="ivf")[0]["id"] == exact[0]["id"] == "7"
+    assert os.path.exists(tmp_path / "docs" / "ivf.npz")
+
+    trainings = []
+    monkeypatch.setattr(IVFIndex, "train", lambda self, *a, **k: trainings.append(1))
+    reopened = VectorStore(str(tmp_path)).get_collection("docs")
+    reopened.upsert(["new"], ["new text"], [[1.0] * 8])
+    assert reopened.query([1.0] * 8, top_k=1, backend="ivf", nprobe=1000)[0]["id"] == "new"
+    assert trainings == []
+    # Queries don't rewrite the index file; rows added after loading are saved on close
+    assert len(IVFIndex.load(str(tmp_path / "docs" / "ivf.npz"))) == 300
+    reopened.upsert(["newer"], ["newer text"], [[1.0, -1.0] * 4])
+    assert reopened.query([1.0, -1.0] * 4, top_k=1, backend="ivf", nprobe=1000)[0]["id"] == "newer"
+    reopened.close()
+    assert len(IVFIndex.load(str(tmp_path / "docs" / "ivf.npz"))) == 302
+
+    reopened.upsert(["new"], ["new text"], [[-1.0] * 8])
+    assert not os.path.exists(tmp_path / "docs" / "ivf.npz")
+    with pytest.raises(ValueError):
+        reopened.query([1.0] * 8, backend="annoy")
+
+
+def test_vector_store_lifecycle(tmp_path):
+    """Test creating, upserting, querying, deleting and reloading a collection"""
+    store = VectorStore(str(tmp_path))
+    collection = store.create_collection("docs")
+    collection.upsert(["a", "b", "c"], ["alpha", "beta", "gamma"],
+                      [[1.0, 0.0], [0.0, 1.0], [0.7, 0.7]])
+
+    results = collection.query([1.0, 0.1], top_k=2)
+    assert [r["id"] for r in results] == ["a", "c"]
+
+    # Upserting an existing id replaces it in place
+    collection.upsert(["b"], ["beta v2"], [[1.0, 0.05]])
+    assert len(collection) == 3
+    assert collection.query([1.0, 0.05], top_k=1)[0]["chunk"] == "beta v2"
+
+    assert collection.delete(["a", "missing"]) == 1
+    assert [r["id"] for r in collection.query([1.0, 0.0], top_k=5)] == ["b", "c"]
+
+    # A fresh store maps the same files
+    reloaded = VectorStore(str(tmp_path)).get_collection("docs")
+    assert reloaded.info() == {"name": "docs", "model": "text-embedding-3-small",
+                               "dimensions": 2, "count": 2}
+    assert reloaded.query([1.0, 0.05], top_k=1)[0]["id"] == "b"
+
+    with pytest.raises(VectorStoreError):
+        store.create_collection("docs")
+    with pytest.raises(VectorStoreError):
+        store.create_collection("../escape")
+    with pytest.raises(VectorStoreError):
+        collection.upsert(["d"], ["delta"], [[1.0, 0.0, 0.0]])
+
+    store.delete_collection("docs")
+    with pytest.raises(CollectionNotFoundError):
+        store.get_collection("docs")
+
+
+def test_collection_recovers_from_interrupted_writes(tmp_path):
+    """Test that reopening after a crash between the vector and log writes keeps rows aligned"""
+    import numpy as np
+
+    collection = VectorStore(str(tmp_path)).create_collection("docs")
+    collection.upsert(["a", "b"], ["alpha", "beta"], [[1.0, 0.0], [0.0, 1.0]])
+    vectors_path = tmp_path / "docs" / "vectors.f32"
+    log_path = tmp_path / "docs" / "chunks.jsonl"
+
+    # An upsert that died after writing one and a half vectors and part of a log line
+    with open(vectors_path, "ab") as f:
+        f.write(np.array([0.6, 0.8, 0.6], dtype=np.float32).tobytes())
+    with open(log_path, "a") as f:
+        f.write('{"row": 2, "id": "c"')
+
+    reopened = VectorStore(str(tmp_path)).get_collection("docs")
+    assert len(reopened) == 2
+    assert vectors_path.stat().st_size == 2 * 2 * 4
+    reopened.upsert(["d"], ["delta"], [[0.6, 0.8]])
+    assert reopened.query([0.6, 0.8], top_k=1)[0]["id"] == "d"
+
+    again = VectorStore(str(tmp_path)).get_collection("docs")
+    assert [r["id"] for r in again.query([0.0, 1.0], top_k=3)] == ["b", "d", "a"]
+    assert again.query([0.6, 0.8], top_k=1)[0]["chunk"] == "delta"
+
+    # Rows logged without their vectors are forgotten, and their row numbers reused
+    with open(vectors_path, "r+b") as f:
+        f.truncate(2 * 2 * 4)
+    shortened = VectorStore(str(tmp_path)).get_collection("docs")
+    assert len(shortened) == 2
+    shortened.upsert(["e"], ["epsilon"], [[1.0, 1.0]])
+    final = VectorStore(str(tmp_path)).get_collection("docs")
+    assert sorted(r["id"] for r in final.query([1.0, 1.0], top_k=5)) == ["a", "b", "e"]
+
+
+
+def test_collection_queries_during_concurrent_writes(tmp_path):
+    """Test that queries stay consistent while another thread upserts, deletes and compacts"""
+    collection = VectorStore(str(tmp_path)).create_collection("kb")
+    collection.upsert(["seed"], ["seed text"], [[1.0, 0.0]])
+    errors = []
+
+    def write():
+        try:
+            for i in range(200):
+                collection.upsert([f"c{i}"], [f"chunk {i}"], [[float(i % 3), 1.0]])
+                if i % 2:
+                    collection.delete([f"c{i - 1}", f"c{i}"])
+        except Exception as e:
+            errors.append(e)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    while writer.is_alive():
+        collection.query([1.0, 0.0], top_k=3)
+        collection.lexical_query("chunk", top_k=3)
+    writer.join()
+
+    assert errors == []
+    assert collection.query([1.0, 0.0], top_k=1)[0]["id"] == "seed"
+
+@pytest.mark.asyncio
+async def test_collection_reads_do_not_block_the_event_loop(tmp_path):
+    """Test that a search waiting on a writer's collection lock leaves the event loop running"""
+    collection = VectorStore(str(tmp_path)).create_collection("kb")
+    collection.upsert(["a"], ["cats purr"], [[1.0, 0.0]])
+    held = threading.Event()
+    release = threading.Event()
+
+    def writer():
+        with collection._lock:
+            held.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    held.wait()
+    search = asyncio.create_task(search_collection("cats", collection, mode="lexical"))
+    await asyncio.sleep(0.05)
+    assert not search.done()
+    release.set()
+    assert (await search)[0]["id"] == "a"
+    thread.join()
+
+
+@pytest.mark.asyncio
+async def test_collection_endpoints(tmp_path, monkeypatch):
+    """Test the collection lifecycle over HTTP using caller-supplied vectors"""
+    monkeypatch.setattr(main, "vector_store", VectorStore(str(tmp_path)))
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.post("/collections", json={"name": "kb"})
+        assert response.status_code == 200
+
+        response = await ac.post("/collections/kb/upsert", json={"chunks": [
+            {"id": "x", "text": "cats", "embedding": [1.0, 0.0]},
+            {"id": "y", "text": "dogs", "embedding": [0.0, 1.0]},
+        ]})
+        assert response.json()["count"] == 2
+
+        response = await ac.post("/collections/kb/query", json={"vector": [0.1, 1.0], "top_k": 1})
+        assert response.json()["similar_chunks"][0]["chunk"] == "dogs"
+
+        response = await ac.post("/collections/kb/delete", json={"ids": ["y"]})
+        assert response.json() == {"deleted": 1, "count": 1}
+
+        response = await ac.post("/similar", json={"query": "pets", "collection": "missing"})
+        assert response.status_code == 404
+        response = await ac.post("/similar", json={"query": "pets"})
+        assert response.status_code == 400
+        response = await ac.post("/similar", json={"query": "pets", "collection": "kb", "backend": "annoy"})
+        assert response.status_code == 422
+
+        response = await ac.delete("/collections/kb")
+        assert response.status_code == 200
+        assert (await ac.get("/collections")).json() == []
+
+
+
+def test_lexical_index_bm25_ranking_and_updates():
+    """Test BM25 ranking, replacing and removing documents, and rank fusion"""
+    index = LexicalIndex()
+    index.add_many(["a", "b", "c"], [
+        "The cat sat on the mat",
+        "Dogs chase the cat around the cat tree",
+        "Stock prices fell sharply",
+    ])
+    assert [key for key, _ in index.search("cat", 5)] == ["b", "a"]
+    assert index.search("unrelated words", 5) == []
+
+    index.add("b", "Dogs bark")
+    assert [key for key, _ in index.search("cat", 5)] == ["a"]
+    index.remove("a")
+    assert index.search("cat", 5) == [] and len(index) == 2
+
+    # Enough churn to rewrite the postings without dead documents
+    for i in range(200):
+        index.add("tmp", f"cat {i}")
+        assert len(index._keys) < 100
+    index.remove("tmp")
+    # Same idf for both terms, so the shorter document wins
+    assert [key for key, _ in index.search("stock dogs", 5)] == ["b", "c"]
+
+    fused = reciprocal_rank_fusion([["x", "y", "z"], ["y", "z"]], top_k=2)
+    assert [key for key, _ in fused] == ["y", "z"]
+
+
+@pytest.mark.asyncio
+async def test_similar_endpoint_search_modes(tmp_path, monkeypatch):
+    """Test that lexical /similar makes no upstream call and hybrid fuses both rankings"""
+    store = VectorStore(str(tmp_path))
+    collection = store.create_collection("kb")
+    collection.upsert(["x", "y"], ["refund policy for orders", "shipping times"], [[1.0, 0.0], [0.0, 1.0]])
+    monkeypatch.setattr(main, "vector_store", store)
+    monkeypatch.setattr(llm_utils, "embedding_cache", EmbeddingCache(path=None))
+
+    async def no_query_embedding(*args, **kwargs):
+        raise AssertionError("lexical search must not embed the query")
+
+    monkeypatch.setattr(llm_utils, "get_embedding", no_query_embedding)
+    app.dependency_overrides[get_llm_backend] = lambda: FakeBackend()
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            lexical = await ac.post("/similar", json={"query": "Refund?", "collection": "kb", "mode": "lexical"})
+            # Later upserts and deletes keep the index current
+            collection.upsert(["z"], ["refund status"], [[0.5, 0.5]])
+            collection.delete(["x"])
+            updated = await ac.post("/similar", json={"query": "refund", "collection": "kb", "mode": "lexical"})
+
+            hybrid = await ac.post("/similar", json={
+                "query": "shipping", "chunks": ["shipping times", "refund policy", "store hours"], "mode": "hybrid"
+            })
+    finally:
+        app.dependency_overrides.clear()
+
+    assert [r["id"] for r in lexical.json()["similar_chunks"]] == ["x"]
+    assert [r["id"] for r in updated.json()["similar_chunks"]] == ["z"]
+    results = hybrid.json()["similar_chunks"]
+    assert results[0]["chunk"] == "shipping times"
+    assert "bm25" in results[0] and "similarity" in results[0] and "score" in results[0]
+
+
+def test_pack_embedding_batches():
+    """Test that embedding inputs are packed within item and token limits"""
+    texts = ["word " * 10] * 7
+    per_text = count_tokens(texts[0], "text-embedding-3-small")
+
+    batches = pack_embedding_batches(texts, max_items=3, max_tokens=10_000)
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+
+    batches = pack_embedding_batches(texts, max_items=100, max_tokens=per_text * 2)
+    assert all(len(batch) <= 2 for batch in batches)
+    assert [i for batch in batches for i in batch] == list(range(7))
+
+    with pytest.raises(LLMError):
+        pack_embedding_batches(["word " * 20000])
+
+
+@pytest.mark.asyncio
+async def test_get_embeddings_batches_and_preserves_order(monkeypatch):
+    """Test that get_embeddings packs requests and returns vectors in input order"""
+    calls = []
+
+    async def create(model, input):
+        calls.append(list(input))
+        # Return items out of order to check that results are re-ordered by index
+        data = [
+            SimpleNamespace(index=i, embedding=[float(len(text))])
+            for i, text in reversed(list(enumerate(input)))
+        ]
+        return SimpleNamespace(data=data, usage=None)
+
+    fake_client = SimpleNamespace(embeddings=SimpleNamespace(create=create))
+    use_client(monkeypatch, fake_client)
+    monkeypatch.setattr(llm_utils, "embedding_cache", EmbeddingCache(path=None))
+
+    texts = ["a" * n for n in range(1, 6)]
+    embeddings = await get_embeddings(texts, max_items=2)
+
+    assert len(calls) == 3
+    assert embeddings == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert await get_embeddings([]) == []
+
+
+def test_embedding_cache_tiers_and_eviction(tmp_path):
+    """Test that the embedding cache serves from memory, falls back to disk and evicts by size"""
+    path = str(tmp_path / "cache.sqlite3")
+    cache = EmbeddingCache(path=path, max_memory_items=2)
+    cache.put_many("m", ["a", "b", "c"], [[0.5, 1.0], [1.5, 2.0], [2.5, 3.0]])
+
+    # "a" was pushed out of the 2-item memory tier but is still on disk
+    assert cache.get("m", "a") == [0.5, 1.0]
+    assert cache.disk_hits == 1
+    assert cache.get("m", "a") == [0.5, 1.0]
+    assert cache.memory_hits == 1
+    assert cache.get("other-model", "a") is None
+    cache.close()
+
+    # A new instance reads the persisted vectors once opened; 8 bytes per 2-dim vector
+    reopened = EmbeddingCache(path=path, max_disk_bytes=16)
+    reopened.open()
+    assert reopened.stats()["disk_bytes"] == 24
+    reopened.put("m", "d", [3.5, 4.0])
+    assert reopened.stats()["disk_bytes"] <= 16
+    assert reopened.get("m", "d") == [3.5, 4.0]
+    reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_embedding_cache_opens_lazily_and_returns_copies(tmp_path):
+    """Test that the database is created on first disk access and callers can't mutate cached vectors"""
+    path = tmp_path / "cache.sqlite3"
+    cache = EmbeddingCache(path=str(path))
+    assert not path.exists()
+
+    await cache.put_many_async("m", ["a"], [[0.5, 1.0]])
+    assert path.exists()
+    (await cache.get_many_async("m", ["a"]))[0].append(9.0)
+    assert cache.get("m", "a") == [0.5, 1.0]
+    cache.close()
+
+    # Disk hits are served from a thread and their access times written on close
+    reopened = EmbeddingCache(path=str(path))
+    vector = (await reopened.get_many_async("m", ["a"]))[0]
+    vector[0] = 9.0
+    assert reopened.get("m", "a") == [0.5, 1.0]
+    assert reopened.disk_hits == 1
+    reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_get_embeddings_uses_cache(monkeypatch):
+    """Test that repeated and duplicate texts cost no extra upstream calls"""
+    calls = []
+
+    async def create(model, input):
+        calls.append(list(input))
+        data = [SimpleNamespace(index=i, embedding=[float(len(t))]) for i, t in enumerate(input)]
+        return SimpleNamespace(data=data, usage=None)
+
+    use_client(monkeypatch, SimpleNamespace(embeddings=SimpleNamespace(create=create)))
+    monkeypatch.setattr(llm_utils, "embedding_cache", EmbeddingCache(path=None))
+
+    first = await get_embeddings(["x", "yy", "x"])
+    assert calls == [["x", "yy"]]
+    second = await get_embeddings(["yy", "x"])
+    assert await get_embedding("x") == [1.0]
+    assert len(calls) == 1
+    assert first == [[1.0], [2.0], [1.0]]
+    assert second == [[2.0], [1.0]]
+
+
+def fake_stream_client(deltas, usage=None, closed=None):
+    """Stub client whose streaming chat completion yields the given deltas and records closes in closed"""
+    class Stream:
+        async def __aiter__(self):
+            for delta in deltas:
+                choice = SimpleNamespace(delta=SimpleNamespace(content=delta))
+                yield SimpleNamespace(choices=[choice], usage=None)
+            yield SimpleNamespace(choices=[], usage=usage)
+
+        async def close(self):
+            if closed is not None:
+                closed.append(True)
+
+    async def create(**kwargs):
+        assert kwargs["stream"] is True
+        return Stream()
+
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_endpoint_sends_sse_events(monkeypatch):
+    """Test that /chat/stream relays deltas and finishes with usage and TTFT"""
+    usage = SimpleNamespace(prompt_tokens=5, completion_tokens=3, total_tokens=8)
+    use_client(monkeypatch, fake_stream_client(["Hel", "lo", None, "!"], usage))
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.post("/chat/stream", json={"messages": [{"role": "user", "content": "Hi"}]})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [block for block in response.text.split("\n\n") if block]
+    deltas = [json.loads(block[len("data: "):])["delta"] for block in events[:-1]]
+    assert deltas == ["Hel", "lo", "!"]
+
+    assert events[-1].startswith("event: done")
+    summary = json.loads(events[-1].split("data: ", 1)[1])
+    assert summary["usage"] == {"prompt_tokens": 5, "completion_tokens": 3, "total_tokens": 8}
+    assert summary["time_to_first_token_ms"] is not None
+
+
+def fake_chat_client(calls):
+    """Stub client whose chat completion echoes the last message and records each call"""
+    async def create(model, messages, temperature):
+        calls.append(messages)
+        message = SimpleNamespace(content=f"echo: {messages[-1]['content']}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def test_response_cache_ttl_and_lru(monkeypatch):
+    """Test that cached responses expire and the least recently used is evicted"""
+    now = [100.0]
+    monkeypatch.setattr("response_cache.time.monotonic", lambda: now[0])
+    cache = ResponseCache(max_items=2, ttl_seconds=10)
+    messages = [{"role": "user", "content": "Hi"}]
+
+    # Key order in the message dicts doesn't matter
+    key = cache.make_key("m", messages, 0.7)
+    assert key == cache.make_key("m", [{"content": "Hi", "role": "user"}], 0.7)
+    assert key != cache.make_key("m", messages, 0.0)
+
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("c") == "C"
+
+    now[0] += 11
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["evictions"] == 1
+
+
+
+@pytest.mark.asyncio
+async def test_caches_are_scoped_by_backend(monkeypatch):
+    """Test that cached fake-backend outputs are never served for the real backend"""
+    monkeypatch.setattr(llm_utils, "embedding_cache", EmbeddingCache(path=None))
+    monkeypatch.setattr(llm_utils, "response_cache", ResponseCache())
+    fake = FakeBackend()
+    await get_embedding("hello", llm_backend=fake)
+    await get_chat_response([{"role": "user", "content": "Hi"}], llm_backend=fake)
+
+    async def create_embedding(model, input):
+        return SimpleNamespace(data=[SimpleNamespace(index=0, embedding=[0.5, 0.5])], usage=None)
+
+    async def create_chat(**kwargs):
+        message = SimpleNamespace(content="real answer", function_call=None, tool_calls=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    use_client(monkeypatch, SimpleNamespace(
+        embeddings=SimpleNamespace(create=create_embedding),
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create_chat))
+    ))
+    assert await get_embedding("hello") == [0.5, 0.5]
+    assert await get_chat_response([{"role": "user", "content": "Hi"}]) == "real answer"
+
+def test_response_cache_semantic_tier():
+    """Test that near-identical questions in the same context share an answer"""
+    cache = ResponseCache(semantic_threshold=0.9)
+    question = [{"role": "user", "content": "What is RAG?"}]
+    scope = cache.make_scope("m", question, 0.0)
+    cache.put("k", "Retrieval-augmented generation", scope, [1.0, 0.0])
+
+    assert cache.get_similar(scope, [0.95, 0.1]) == "Retrieval-augmented generation"
+    assert cache.get_similar(scope, [0.0, 1.0]) is None
+    other_context = [{"role": "system", "content": "Be brief"}] + question
+    assert cache.get_similar(cache.make_scope("m", other_context, 0.0), [1.0, 0.0]) is None
+
+
+@pytest.mark.asyncio
+async def test_chat_response_cache_skips_repeat_requests(monkeypatch):
+    """Test that identical chat requests are answered from the cache"""
+    calls = []
+    use_client(monkeypatch, fake_chat_client(calls))
+    cache = ResponseCache()
+    monkeypatch.setattr(llm_utils, "response_cache", cache)
+    monkeypatch.setattr(main, "response_cache", cache)
+    messages = [{"role": "user", "content": "Hello"}]
+
+    assert await get_chat_response(messages) == "echo: Hello"
+    assert await get_chat_response(messages) == "echo: Hello"
+    await get_chat_response(messages, temperature=0.0)
+    await get_chat_response(messages, use_cache=False)
+    assert len(calls) == 3
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        await ac.post("/chat", json={"messages": messages})
+        response = await ac.get("/cache/stats")
+    assert len(calls) == 3
+    assert response.json()["responses"]["hits"] == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_in_flight_calls():
+    """Test that concurrent calls with one key run once and share the result or error"""
+    flight = SingleFlight()
+    runs = []
+
+    async def work(value):
+        runs.append(value)
+        await asyncio.sleep(0.01)
+        if value == "bad":
+            raise LLMError("boom")
+        return value
+
+    results = await asyncio.gather(*(flight.do("k", lambda: work("ok")) for _ in range(5)))
+    assert results == ["ok"] * 5
+    assert runs == ["ok"]
+    assert flight.shared == 4
+    assert len(flight) == 0
+
+    # A cancelled waiter doesn't cancel the call for the others
+    first = asyncio.ensure_future(flight.do("k", lambda: work("again")))
+    second = asyncio.ensure_future(flight.do("k", lambda: work("again")))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == "again"
+
+    outcomes = await asyncio.gather(
+        flight.do("e", lambda: work("bad")), flight.do("e", lambda: work("bad")), return_exceptions=True
+    )
+    assert all(isinstance(outcome, LLMError) for outcome in outcomes)
+
+
+@pytest.mark.asyncio
+async def test_identical_concurrent_requests_are_coalesced(monkeypatch):
+    """Test that a burst of identical chat and embedding requests makes one upstream call each"""
+    chat_calls, embedding_calls = [], []
+    chat_client = fake_chat_client(chat_calls)
+
+    async def create_chat(**kwargs):
+        await asyncio.sleep(0.01)
+        return await chat_client.chat.completions.create(**kwargs)
+
+    async def create_embedding(model, input):
+        embedding_calls.append(list(input))
+        await asyncio.sleep(0.01)
+        return SimpleNamespace(data=[SimpleNamespace(index=0, embedding=[1.0])], usage=None)
+
+    use_client(monkeypatch, SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create_chat)),
+        embeddings=SimpleNamespace(create=create_embedding)
+    ))
+    monkeypatch.setattr(llm_utils, "response_cache", ResponseCache())
+    monkeypatch.setattr(llm_utils, "embedding_cache", EmbeddingCache(path=None))
+    messages = [{"role": "user", "content": "Same question"}]
+
+    answers = await asyncio.gather(*(get_chat_response(messages) for _ in range(10)))
+    vectors = await asyncio.gather(*(get_embedding("same text") for _ in range(10)))
+    assert set(answers) == {"echo: Same question"}
+    assert vectors == [[1.0]] * 10
+    assert len(chat_calls) == 1
+    assert len(embedding_calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_groups_by_window_and_size():
+    """Test that items are flushed when the window closes or the batch is full"""
+    batches = []
+
+    async def double(items):
+        batches.append(list(items))
+        return [ValueError("odd") if item % 2 else item * 2 for item in items]
+
+    batcher = MicroBatcher(double, max_batch_size=3, max_wait_ms=20)
+    results = await asyncio.gather(*(batcher.submit(i) for i in [2, 4, 6, 8]))
+    assert results == [4, 8, 12, 16]
+    assert batches == [[2, 4, 6], [8]]
+
+    # A per-item error only fails that item's caller
+    outcomes = await asyncio.gather(batcher.submit(1), batcher.submit(10), return_exceptions=True)
+    assert isinstance(outcomes[0], ValueError)
+    assert outcomes[1] == 20
+
+
+@pytest.mark.asyncio
+async def test_embed_endpoint_batches_concurrent_requests(monkeypatch):
+    """Test that concurrent /embed requests are answered from one upstream call"""
+    calls = []
+
+    async def create(model, input):
+        calls.append(list(input))
+        data = [SimpleNamespace(index=i, embedding=[float(len(t))]) for i, t in enumerate(input)]
+        return SimpleNamespace(data=data, usage=None)
+
+    use_client(monkeypatch, SimpleNamespace(embeddings=SimpleNamespace(create=create)))
+    monkeypatch.setattr(llm_utils, "embedding_cache", EmbeddingCache(path=None))
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        responses = await asyncio.gather(*(
+            ac.post("/embed", json={"text": text}) for text in ["a", "bb", "ccc", ""]
+        ))
+
+    assert [r.json()["embedding"] for r in responses[:3]] == [[1.0], [2.0], [3.0]]
+    assert responses[3].status_code == 500
+    assert len(calls) == 1
+    assert sorted(calls[0]) == ["a", "bb", "ccc"]
+
+
+@pytest.mark.asyncio
+async def test_fake_backend_is_deterministic():
+    """Test that the fake backend gives repeatable embeddings, completions and errors"""
+    fake = FakeBackend(dimensions=64)
+    first = await fake.embed(["vector search", "cooking pasta"], "m")
+    second = await fake.embed(["vector search"], "m")
+    assert first.embeddings[0] == second.embeddings[0]
+    assert len(first.embeddings[0]) == 64
+    assert cosine_similarity(fake.embed_text("fast vector search"), first.embeddings[0]) > 0.5
+
+    result = await fake.chat([{"role": "user", "content": "Hello"}], "m", 0.0)
+    assert result.content == "[m] You said: Hello"
+    assert result.usage["total_tokens"] == result.usage["prompt_tokens"] + result.usage["completion_tokens"]
+    deltas = [chunk.delta async for chunk in fake.stream_chat([{"role": "user", "content": "Hi"}], "m", 0.0)]
+    assert "".join(d for d in deltas if d) == "[m] You said: Hi"
+
+    failing = FakeBackend(error_rate=1.0)
+    with pytest.raises(Exception):
+        await failing.embed(["x"], "m")
+    assert isinstance(create_backend("fake"), FakeBackend)
+    with pytest.raises(ValueError):
+        create_backend("nope")
+
+
+@pytest.mark.asyncio
+async def test_endpoints_run_offline_on_fake_backend(monkeypatch):
+    """Test that /chat, /embed and /similar work end to end without the network"""
+    monkeypatch.setattr(llm_utils, "llm_backend", FakeBackend(dimensions=32))
+    monkeypatch.setattr(llm_utils, "embedding_cache", EmbeddingCache(path=None))
+    monkeypatch.setattr(llm_utils, "response_cache", ResponseCache())
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        chat = await ac.post("/chat", json={"messages": [{"role": "user", "content": "Ping"}]})
+        embed = await ac.post("/embed", json={"text": "Ping"})
+        similar = await ac.post("/similar", json={
+            "query": "python web framework",
+            "chunks": ["FastAPI is a python web framework", "Bananas are yellow"],
+            "top_k": 1
+        })
+
+    assert chat.json()["response"] == "[gpt-4o-mini] You said: Ping"
+    assert embed.json()["dimensions"] == 32
+    assert similar.json()["similar_chunks"][0]["chunk"] == "FastAPI is a python web framework"
+
+
+def test_retry_error_classification():
+    """Test that transient errors are retried, fatal ones are not, and Retry-After is honoured"""
+    assert is_retryable(BackendError("rate limited", status_code=429))
+    assert is_retryable(BackendError("overloaded", status_code=503))
+    assert is_retryable(ConnectionError("reset"))
+    assert not is_retryable(BackendError("bad request", status_code=400))
+    assert not is_retryable(ValueError("bug"))
+
+    error = BackendError("rate limited", status_code=429)
+    error.response = SimpleNamespace(headers={"retry-after": "3"})
+    assert retry_after_of(error) == 3.0
+    error.response = SimpleNamespace(headers={"retry-after-ms": "250", "retry-after": "3"})
+    assert retry_after_of(error) == 0.25
+    assert retry_after_of(ConnectionError()) is None
+    malformed = BackendError("rate limited", status_code=429)
+    malformed.response = SimpleNamespace(headers={"retry-after": "soon"})
+    assert retry_after_of(malformed) is None
+    assert 0 <= RetryPolicy(base_delay=1.0).delay_for(malformed, 0) <= 1.0
+
+    policy = RetryPolicy(max_attempts=3, base_delay=1.0)
+    assert policy.delay_for(BackendError("bad", status_code=400), 0) is None
+    assert 0 <= policy.delay_for(ConnectionError(), 1) <= 2.0
+    assert policy.delay_for(ConnectionError(), 2) is None
+    assert policy.delay_for(error, 0, remaining=0.1) is None
+
+
+@pytest.mark.asyncio
+async def test_retry_policy_and_circuit_breaker():
+    """Test retries, fast failure on fatal errors and the breaker's open/half-open cycle"""
+    breaker = CircuitBreaker(failure_threshold=3, recovery_time=0.05)
+    policy = RetryPolicy(max_attempts=3, base_delay=0.001, breaker=breaker)
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise BackendError("overloaded", status_code=503)
+        return "ok"
+
+    assert await policy.call(flaky) == "ok"
+    assert breaker.state == "closed"
+
+    async def fatal():
+        attempts.append(1)
+        raise BackendError("bad request", status_code=400)
+
+    attempts.clear()
+    with pytest.raises(RetryError) as info:
+        await policy.call(fatal)
+    assert info.value.attempts == 1
+    assert breaker.state == "closed"
+
+    async def down():
+        raise BackendError("unavailable", status_code=503)
+
+    async def healthy():
+        return "ok"
+
+    with pytest.raises(RetryError):
+        await policy.call(down)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        await policy.call(healthy)
+
+    await asyncio.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert await policy.call(healthy) == "ok"
+    assert breaker.state == "closed"
+
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_probe_released_on_fatal_error_and_cancel():
+    """Test that a probe ending in a fatal response closes the breaker and a cancelled probe frees the slot"""
+    breaker = CircuitBreaker(failure_threshold=1, recovery_time=0.01)
+    policy = RetryPolicy(max_attempts=1, base_delay=0.001, breaker=breaker)
+
+    async def down():
+        raise BackendError("unavailable", status_code=503)
+
+    async def fatal():
+        raise BackendError("bad request", status_code=400)
+
+    async def healthy():
+        return "ok"
+
+    with pytest.raises(RetryError):
+        await policy.call(down)
+    await asyncio.sleep(0.02)
+    with pytest.raises(RetryError):
+        await policy.call(fatal)
+    assert breaker.state == "closed"
+    assert await policy.call(healthy) == "ok"
+
+    with pytest.raises(RetryError):
+        await policy.call(down)
+    await asyncio.sleep(0.02)
+    probe = asyncio.create_task(policy.call(lambda: asyncio.sleep(10)))
+    await asyncio.sleep(0.01)
+    with pytest.raises(CircuitOpenError):
+        await policy.call(healthy)
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+    assert breaker.state == "half_open"
+    assert await policy.call(healthy) == "ok"
+    assert breaker.state == "closed"
+
+    # A late failure from a call sent before the circuit opened leaves the probe slot taken
+    breaker.record_failure()
+    await asyncio.sleep(0.02)
+    assert breaker.acquire() == "probe"
+    breaker.record_failure()
+    await asyncio.sleep(0.02)
+    assert breaker.acquire() is None
+    breaker.record_failure(probe=True)
+    await asyncio.sleep(0.02)
+    assert breaker.acquire() == "probe"
+
+
+@pytest.mark.asyncio
+async def test_chat_request_respects_retry_deadline(monkeypatch):
+    """Test that a hanging upstream is cut off at the deadline and surfaces as LLMError"""
+    async def hang(**kwargs):
+        await asyncio.sleep(10)
+
+    use_client(monkeypatch, SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=hang))))
+    monkeypatch.setattr(llm_utils, "retry_policy", RetryPolicy(base_delay=0.001, deadline=0.05))
+
+    with pytest.raises(LLMError):
+        await get_chat_response([{"role": "user", "content": "Hi"}], use_cache=False)
+
+
+@pytest.mark.asyncio
+async def test_llm_backend_is_injectable(monkeypatch):
+    """Test that endpoints take their backend from the FastAPI dependency"""
+    monkeypatch.setattr(llm_utils, "response_cache", ResponseCache())
+    fake = FakeBackend()
+    app.dependency_overrides[get_llm_backend] = lambda: fake
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            response = await ac.post("/chat", json={"messages": [{"role": "user", "content": "Hi"}]})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.json()["response"] == "[gpt-4o-mini] You said: Hi"
+    assert fake.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_openai_backend_closes_abandoned_streams():
+    """Test that the SDK stream is closed when the consumer stops reading early"""
+    closed = []
+    backend = OpenAIBackend(client=fake_stream_client(["Hello", " there"], closed=closed))
+    chunks = backend.stream_chat([{"role": "user", "content": "Hi"}], "gpt-4o-mini", 0.7)
+    assert (await chunks.__anext__()).delta == "Hello"
+    await chunks.aclose()
+    assert closed == [True]
+
+
+@pytest.mark.asyncio
+async def test_openai_backend_client_lifecycle(monkeypatch):
+    """Test that the pooled SDK client is built lazily, without SDK retries, and closed cleanly"""
+    backend = OpenAIBackend(api_key="sk-test", max_connections=7, http2=True)
+    assert backend._client is None
+    client = backend.client
+    assert client is backend.client
+    assert client.max_retries == 0
+    await backend.close()
+    assert backend._client is None
+
+    # Startup warm-up and shutdown run through the app lifespan
+    fake = FakeBackend()
+    warmed = []
+    monkeypatch.setattr(fake, "warmup", lambda: asyncio.sleep(0, warmed.append(True)))
+    monkeypatch.setattr(llm_utils, "llm_backend", fake)
+    monkeypatch.setattr(llm_utils, "embedding_cache", EmbeddingCache(path=None))
+    stopped = []
+
+    async def stop_jobs():
+        stopped.append("jobs")
+
+    async def close_llm():
+        stopped.append("llm")
+
+    monkeypatch.setattr(main.jobs, "shutdown", stop_jobs)
+    monkeypatch.setattr(llm_utils, "close", close_llm)
+    async with main.lifespan(app):
+        assert warmed == [True]
+    # Jobs are stopped before the cache and client they use are closed
+    assert stopped == ["jobs", "llm"]
+
+
+@pytest.mark.asyncio
+async def test_conversation_context_trims_and_summarizes(word_encoder, monkeypatch):
+    """Test that history fits the budget, keeps the system prompt and counts each message once"""
+    counted = []
+    original = llm_utils.count_tokens_many
+    monkeypatch.setattr(llm_utils, "count_tokens_many",
+                        lambda texts, model="gpt-4o-mini": counted.extend(texts) or original(texts, model))
+
+    system = {"role": "system", "content": "be brief"}
+    turns = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"turn {i} words here"} for i in range(10)]
+    context = ConversationContext(max_tokens=40)
+    context.append(system)
+    for turn in turns:
+        context.append(turn)
+
+    # The system prompt and the newest turns survive; the oldest are dropped in order
+    kept = len(turns) - len(context.dropped)
+    assert context.messages == [system] + turns[-kept:]
+    assert context.dropped == turns[:-kept]
+    assert context.tokens <= 40
+    assert counted == [m["content"] for m in [system] + turns]
+
+    async def summarizer(messages):
+        return f"{len(messages)} earlier messages"
+
+    dropped = len(context.dropped)
+    await context.summarize(summarizer)
+    assert context.messages[1] == {"role": "system", "content": f"{SUMMARY_PREFIX}{dropped} earlier messages"}
+    assert context.messages[-1] == turns[-1]
+    assert context.tokens <= 40
+
+    assert await fit_messages([system] + turns, max_tokens=1000) == [system] + turns
+
+
+@pytest.mark.asyncio
+async def test_chat_trims_history_to_max_context_tokens():
+    """Test that /chat sends only what fits max_context_tokens"""
+    fake = FakeBackend()
+    sent = []
+    original = fake.chat
+    fake.chat = lambda messages, *args, **kwargs: sent.append(messages) or original(messages, *args, **kwargs)
+    history = [{"role": "system", "content": "You are terse."}]
+    history += [{"role": "user", "content": f"message number {i} " * 20} for i in range(20)]
+    history.append({"role": "user", "content": "latest"})
+
+    app.dependency_overrides[get_llm_backend] = lambda: fake
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            response = await ac.post("/chat", json={
+                "messages": history, "max_context_tokens": 200, "use_cache": False
+            })
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.json()["response"].endswith("You said: latest")
+    assert sent[0][0] == history[0] and sent[0][-1] == history[-1]
+    assert 1 < len(sent[0]) < len(history)
+
+
+@pytest.mark.asyncio
+async def test_session_chat_sends_only_new_messages(monkeypatch):
+    """Test that session chat rebuilds history server-side and stores counted turns"""
+    fake = FakeBackend()
+    sent = []
+    original = fake.chat
+    fake.chat = lambda messages, *args, **kwargs: sent.append(messages) or original(messages, *args, **kwargs)
+    monkeypatch.setattr(main, "session_store", InMemorySessionStore())
+
+    app.dependency_overrides[get_llm_backend] = lambda: fake
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            session = (await ac.post("/sessions", json={"system": "You are terse."})).json()
+            url = f"/sessions/{session['session_id']}"
+            for text in ["first", "second"]:
+                response = await ac.post(f"{url}/chat", json={
+                    "message": {"role": "user", "content": text}, "use_cache": False
+                })
+                assert response.json()["response"].endswith(f"You said: {text}")
+            stored = (await ac.get(url)).json()
+            assert (await ac.delete(url)).status_code == 200
+            missing = await ac.post(f"{url}/chat", json={"message": {"role": "user", "content": "x"}})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert [m["content"] for m in sent[1]] == [
+        "You are terse.", "first", "[gpt-4o-mini] You said: first", "second"
+    ]
+    assert len(stored["messages"]) == 5 and stored["total_tokens"] > 0
+    assert missing.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_ingest_pipeline_resumes_from_checkpoint(tmp_path, monkeypatch):
+    """Test that ingestion writes every chunk, skips finished documents and replaces changed ones"""
+    monkeypatch.setattr(llm_utils, "embedding_cache", EmbeddingCache(path=None))
+    fake = FakeBackend(dimensions=64)
+    root = tmp_path / "docs"
+    root.mkdir()
+    for i in range(6):
+        (root / f"doc{i}.txt").write_text("\n\n".join(f"Paragraph {j} of document {i}." for j in range(4)))
+    collection = VectorStore(str(tmp_path / "store")).create_collection("kb")
+    snapshots = []
+
+    first = await ingest(discover_documents(str(root)), collection, max_tokens=8, processes=2,
+                         embed_workers=2, batch_size=5, queue_size=2, llm_backend=fake,
+                         on_progress=snapshots.append)
+    assert first.documents_done == 6 and first.documents_failed == 0
+    assert len(collection) == first.chunks_written > 6
+    assert snapshots[-1]["documents_done"] == 6
+
+    # A rerun skips unchanged documents; a shortened one is rewritten without stale chunks
+    (root / "doc0.txt").write_text("Short now.")
+    second = await ingest(discover_documents(str(root)), collection, max_tokens=8, processes=0, llm_backend=fake)
+    assert second.documents_skipped == 5 and second.documents_done == 1
+    ids = set(collection._rows)
+    assert "doc0.txt#0" in ids and "doc0.txt#1" not in ids
+    assert len(collection) == first.chunks_written - first.chunks_written // 6 + 1
+
+    # Different chunking settings redo every document, even unchanged ones
+    third = await ingest(discover_documents(str(root)), collection, max_tokens=200, processes=0, llm_backend=fake)
+    assert third.documents_skipped == 0 and third.documents_done == 6
+    assert len(collection) == 6
+    fourth = await ingest(discover_documents(str(root)), collection, max_tokens=200, processes=0, llm_backend=fake)
+    assert fourth.documents_skipped == 6
+
+
+@pytest.mark.asyncio
+async def test_ingest_stops_all_stages_when_one_fails(tmp_path, monkeypatch):
+    """Test that a dead writer fails the ingestion instead of leaving embedders blocked, and a shared pool survives"""
+    monkeypatch.setattr(llm_utils, "embedding_cache", EmbeddingCache(path=None))
+    collection = VectorStore(str(tmp_path / "store")).create_collection("kb")
+    documents = [Document(id=f"d{i}", text=f"document number {i}") for i in range(40)]
+
+    def broken_record(self, items, chunking):
+        raise OSError("disk full")
+
+    # The writer dies on its first batch while the other stages still have work queued
+    monkeypatch.setattr("ingest.Checkpoint.record", broken_record)
+
+    with ThreadPoolExecutor(2) as pool:
+        with pytest.raises(OSError):
+            await asyncio.wait_for(ingest(
+                documents, collection, processes=2, embed_workers=2, batch_size=1, queue_size=1,
+                llm_backend=FakeBackend(dimensions=8), pool=pool
+            ), timeout=10)
+        # The caller's pool is left running
+        assert pool.submit(len, "abc").result() == 3
+
+
+@pytest.mark.asyncio
+async def test_ingest_endpoint_runs_as_job(tmp_path, monkeypatch):
+    """Test that /ingest starts a background job whose progress /jobs reports"""
+    monkeypatch.setattr(main, "vector_store", VectorStore(str(tmp_path)))
+    monkeypatch.setattr(main, "INGEST_PROCESSES", 0)
+    monkeypatch.setattr(llm_utils, "embedding_cache", EmbeddingCache(path=None))
+    main.vector_store.create_collection("kb")
+    app.dependency_overrides[get_llm_backend] = lambda: FakeBackend(dimensions=32)
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            job = (await ac.post("/ingest", json={"collection": "kb", "documents": [
+                {"id": "a", "text": "cats purr"}, {"id": "b", "text": "dogs bark"}
+            ]})).json()
+            await main.jobs.get(job["id"]).task
+            status = (await ac.get(f"/jobs/{job['id']}")).json()
+            missing = await ac.post("/ingest", json={"collection": "nope", "documents": []})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert status["status"] == "succeeded"
+    assert status["progress"]["documents_done"] == 2
+    assert status["result"]["collection"]["count"] == 2
+    assert missing.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_batch_job_checkpoints_and_retries_failed_lines(tmp_path, monkeypatch):
+    """Test that a batch writes a result per line and a rerun retries only the failures"""
+    monkeypatch.setattr(llm_utils, "embedding_cache", EmbeddingCache(path=None))
+    monkeypatch.setattr(llm_utils, "response_cache", ResponseCache())
+    input_path, output_path = tmp_path / "input.jsonl", tmp_path / "output.jsonl"
+    lines = [{"custom_id": f"e{i}", "kind": "embedding", "body": {"input": f"text {i}"}} for i in range(5)]
+    lines.append({"custom_id": "too-long", "kind": "embedding", "body": {"input": "word " * 9000}})
+    lines.append({"custom_id": "c0", "kind": "chat", "body": {"messages": [{"role": "user", "content": "Hi"}]}})
+    input_path.write_text("\n".join(json.dumps(line) for line in lines) + "\n")
+    fake = FakeBackend(dimensions=16)
+
+    # A body that isn't an object fails its own line, not the job
+    bad_path = tmp_path / "bad.jsonl"
+    bad_path.write_text(json.dumps({"custom_id": "b", "kind": "chat", "body": None}) + "\n")
+    bad = await run_batch(str(bad_path), str(tmp_path / "bad-out.jsonl"), llm_backend=fake)
+    assert bad["failed"] == 1 and "body" in json.loads((tmp_path / "bad-out.jsonl").read_text())["error"]
+
+    first = await run_batch(str(input_path), str(output_path), concurrency=2, embed_batch_size=4, llm_backend=fake)
+    assert first["succeeded"] == 6 and first["failed"] == 1
+    results = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert [r["custom_id"] for r in results] == [line["custom_id"] for line in lines]
+    assert results[-1]["response"]["content"] == "[gpt-4o-mini] You said: Hi"
+    assert results[5]["error"] and len(results[0]["response"]["embedding"]) == 16
+
+    # Fix the failed line; the rerun only sends that one
+    lines[5]["body"]["input"] = "fixed"
+    input_path.write_text("\n".join(json.dumps(line) for line in lines) + "\n")
+    # A line torn by a crash is ignored and dropped by the rewrite
+    with open(output_path, "a") as f:
+        f.write('{"custom_id": "e0", "resp')
+    calls = fake.calls
+    second = await run_batch(str(input_path), str(output_path), llm_backend=fake)
+    assert second["skipped"] == 6 and second["succeeded"] == 1
+    assert fake.calls == calls + 1
+    assert all(json.loads(line)["error"] is None for line in output_path.read_text().splitlines())
+    assert len(output_path.read_text().splitlines()) == len(lines)
+
+
+@pytest.mark.asyncio
+async def test_batch_job_endpoints(tmp_path, monkeypatch):
+    """Test submitting, polling and downloading a batch job over HTTP"""
+    monkeypatch.setattr(main, "batch_store", BatchStore(str(tmp_path)))
+    monkeypatch.setattr(llm_utils, "embedding_cache", EmbeddingCache(path=None))
+    app.dependency_overrides[get_llm_backend] = lambda: FakeBackend(dimensions=8)
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            requests = [{"custom_id": str(i), "kind": "embedding", "body": {"input": f"doc {i}"}} for i in range(3)]
+            job = (await ac.post("/batch-jobs", json={"requests": requests})).json()
+            await main.jobs.get(job["id"]).task
+            status = (await ac.get(f"/batch-jobs/{job['id']}")).json()
+            results = (await ac.get(f"/batch-jobs/{job['id']}/results")).text.splitlines()
+            invalid = await ac.post("/batch-jobs", json={"requests": [{"custom_id": "x", "kind": "image", "body": {}}]})
+            not_object = await ac.post("/batch-jobs", json={"requests": [{"custom_id": "x", "kind": "chat", "body": "Hi"}]})
+            missing = await ac.get("/batch-jobs/unknown")
+            negative_rate = await ac.post("/batch-jobs", json={"requests": requests, "requests_per_minute": -1})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert status["status"] == "succeeded"
+    assert status["lines"] == {"total": 3, "succeeded": 3, "failed": 0}
+    assert len(results) == 3
+    assert invalid.status_code == 400 and missing.status_code == 404
+    assert not_object.status_code == 400
+    assert negative_rate.status_code == 400 and "requests_per_minute" in negative_rate.json()["detail"]
+
+
+@pytest.mark.asyncio
+async def test_tool_loop_runs_calls_concurrently_and_caches():
+    """Test that one turn's tool calls overlap, deterministic results are cached and failures are reported"""
+    registry = ToolRegistry()
+    running, peak, runs = 0, 0, []
+
+    @registry.register("Slow lookup", deterministic=True)
+    async def lookup():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        runs.append("lookup")
+        await asyncio.sleep(0.05)
+        running -= 1
+        return {"value": 42}
+
+    @registry.register("Clock")
+    async def clock():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+        return "noon"
+
+    @registry.register("Broken tool")
+    async def broken():
+        raise RuntimeError("boom")
+
+    fake = FakeBackend()
+    messages = [{"role": "user", "content": "Use lookup, clock and broken"}]
+    result = await run_tool_loop(messages, registry, llm_backend=fake)
+
+    assert result.stop_reason == "completed" and result.turns == 2
+    assert [call.name for call in result.tool_calls] == ["lookup", "clock", "broken"]
+    assert peak == 2
+    assert result.tool_calls[2].error == "boom"
+    assert result.messages[1]["tool_calls"][0]["function"]["name"] == "lookup"
+    assert result.messages[2] == {"role": "tool", "tool_call_id": "call_0", "content": '{"value": 42}'}
+    assert result.content.startswith("Tool results: ")
+    assert result.usage["total_tokens"] > 0
+
+    again = await run_tool_loop(messages, registry, llm_backend=fake)
+    assert again.tool_calls[0].cached and runs == ["lookup"]
+
+    # With one turn the model must answer without tools
+    capped = await run_tool_loop(messages, registry, max_turns=1, llm_backend=fake)
+    assert capped.tool_calls == [] and capped.turns == 1
+
+
+@pytest.mark.asyncio
+async def test_chat_tools_endpoint():
+    """Test that /chat/tools runs server-side tools and reports them"""
+    app.dependency_overrides[get_llm_backend] = lambda: FakeBackend()
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            response = await ac.post("/chat/tools", json={
+                "messages": [{"role": "user", "content": "Please count_text_tokens"}]
+            })
+    finally:
+        app.dependency_overrides.clear()
+
+    body = response.json()
+    assert body["stop_reason"] == "completed"
+    assert body["tool_calls"][0]["name"] == "count_text_tokens"
+    # The fake backend sends no arguments, so the tool reports the missing one
+    assert "text" in body["tool_calls"][0]["error"]
+
+
+
+def test_prompt_template_counts_only_slots(monkeypatch):
+    """Test that static token counts are computed once and renders match an exact count"""
+    registry = PromptRegistry()
+    template = registry.register("greet", [
+        {"role": "system", "content": "You greet people by name."},
+        {"role": "user", "content": "Say hello to {name} from {place}."},
+    ])
+    assert template.variables == ["name", "place"]
+    static = template.static_tokens()
+
+    counted = []
+    real = llm_utils.count_tokens_many
+    monkeypatch.setattr(llm_utils, "count_tokens_many", lambda texts, model="gpt-4o-mini": counted.extend(texts) or real(texts, model))
+    prompt = registry.render("greet", {"name": "Ada", "place": "London"})
+    assert counted == ["Ada", "London"]
+    assert prompt.messages[1]["content"] == "Say hello to Ada from London."
+    assert prompt.tokens == static + sum(real(["Ada", "London"]))
+
+    with pytest.raises(PromptError):
+        registry.render("greet", {"name": "Ada"})
+    with pytest.raises(PromptError):
+        registry.render("missing", {})
+    with pytest.raises(PromptError):
+        registry.register("bad", [{"role": "user", "content": "{name!r}"}])
+    with pytest.raises(PromptBudgetError):
+        registry.render("greet", {"name": "word " * 100, "place": "x"}, max_tokens=static)
+
+
+@pytest.mark.asyncio
+async def test_chat_template_endpoint_rejects_over_budget():
+    """Test that /chat/template renders registered prompts and rejects oversized ones before calling the model"""
+    fake = FakeBackend()
+    app.dependency_overrides[get_llm_backend] = lambda: fake
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            listed = await ac.get("/prompts")
+            ok = await ac.post("/chat/template", json={
+                "template": "travel_guide", "variables": {"days": 3, "destination": "Japan"}, "use_cache": False
+            })
+            too_big = await ac.post("/chat/template", json={
+                "template": "travel_guide", "variables": {"days": 3, "destination": "Japan " * 50},
+                "max_prompt_tokens": 40
+            })
+            unknown = await ac.post("/chat/template", json={"template": "nope"})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert "travel_guide" in [p["name"] for p in listed.json()["prompts"]]
+    assert ok.status_code == 200 and ok.json()["prompt_tokens"] > 0
+    assert too_big.status_code == 413
+    assert unknown.status_code == 400
+    assert fake.calls == 1
+
+def test_metrics_render_prometheus_text():
+    """Test that counters and histograms render in the Prometheus exposition format"""
+    registry = Registry()
+    requests = registry.counter("demo_requests", "Requests", ("model",))
+    latency = registry.histogram("demo_seconds", "Latency", ("model",), buckets=(0.1, 1.0))
+    requests.inc(model="m")
+    requests.inc(2, model="m")
+    latency.observe(0.5, model="m")
+    registry.register_collector(lambda: [("demo_ratio", "gauge", "Ratio", [("demo_ratio", {}, 0.25)])])
+
+    text = registry.render()
+    assert "# TYPE demo_requests counter" in text
+    assert 'demo_requests_total{model="m"} 3' in text
+    assert 'demo_seconds_bucket{le="0.1",model="m"} 0' in text
+    assert 'demo_seconds_bucket{le="+Inf",model="m"} 1' in text
+    assert 'demo_seconds_count{model="m"} 1' in text
+    assert "demo_ratio 0.25" in text
+    with pytest.raises(ValueError):
+        requests.inc(other="x")
+
+
+@pytest.mark.asyncio
+async def test_chat_reports_usage_and_metrics(monkeypatch):
+    """Test that /chat returns usage and /metrics exposes tokens, latency and cache hits"""
+    fake = FakeBackend()
+    monkeypatch.setattr(llm_utils, "response_cache", ResponseCache())
+    monkeypatch.setattr(main, "response_cache", llm_utils.response_cache)
+    tokens_before = metrics.TOKENS.value(operation="chat", model="metrics-model", type="completion")
+    app.dependency_overrides[get_llm_backend] = lambda: fake
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            payload = {"messages": [{"role": "user", "content": "Hi there"}], "model": "metrics-model"}
+            first = (await ac.post("/chat", json=payload)).json()
+            second = (await ac.post("/chat", json=payload)).json()
+            scrape = await ac.get("/metrics")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert first["usage"]["completion_tokens"] > 0 and not first["cached"]
+    assert second["cached"] and second["usage"] is None
+    assert metrics.TOKENS.value(operation="chat", model="metrics-model", type="completion") \
+        == tokens_before + first["usage"]["completion_tokens"]
+    assert scrape.headers["content-type"].startswith("text/plain")
+    assert 'llm_requests_total{model="metrics-model",operation="chat",outcome="success"} 1' in scrape.text
+    assert 'llm_request_duration_seconds_count{model="metrics-model",operation="chat",outcome="success"} 1' \
+        in scrape.text
+    assert 'llm_cache_hit_ratio{cache="response"} 0.5' in scrape.text
+
+
+def test_logging_is_queued_sampled_and_json(monkeypatch):
+    """Test that per-request lines are sampled and records are formatted off the calling thread"""
+    keep_all, drop_all = SamplingFilter(1.0), SamplingFilter(0.0)
+    make = lambda level, extra: logging.makeLogRecord({"levelno": level, "msg": "x", **extra})
+    assert keep_all.filter(make(logging.INFO, SAMPLED))
+    assert not drop_all.filter(make(logging.INFO, SAMPLED))
+    assert drop_all.filter(make(logging.INFO, {}))
+    assert drop_all.filter(make(logging.WARNING, SAMPLED))
+
+    lines = []
+    monkeypatch.setattr(logging.StreamHandler, "emit", lambda self, record: lines.append(self.format(record)))
+    configure_logging(level="INFO", json_format=True, sample_rate=1.0)
+    try:
+        logging.getLogger("week3.test").info("Usage - Tokens: %d", 12, extra={**SAMPLED, "model": "m"})
+    finally:
+        shutdown_logging()
+
+    record = json.loads(lines[-1])
+    assert record["message"] == "Usage - Tokens: 12"
+    assert record["model"] == "m" and record["level"] == "INFO" and "sampled" not in record
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limiter_bounds_in_flight_requests():
+    """Test that fan-out through the limiter never exceeds max_concurrency"""
+    limiter = ConcurrencyLimiter(max_concurrency=3)
+    peak = 0
+
+    async def work():
+        nonlocal peak
+        async with limiter.limit():
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(work() for _ in range(10)))
+    assert peak == 3
+    assert limiter.in_flight == 0
+
+    # A caller throttled by the rate limiter doesn't hold a slot while it waits
+    paced = ConcurrencyLimiter(max_concurrency=1, rate_limiter=RateLimiter(requests_per_minute=60))
+    paced.rate_limiter._available_requests = 0.9
+
+    async def throttled():
+        async with paced.limit():
+            pass
+
+    waiting = asyncio.create_task(throttled())
+    await asyncio.sleep(0.05)
+    assert not paced._get_semaphore().locked()
+    await waiting
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_waits_for_token_budget():
+    """Test that the token bucket delays requests once the per-minute budget is spent"""
+    import time
+
+    rate_limiter = RateLimiter(tokens_per_minute=6000)
+    start = time.monotonic()
+    await rate_limiter.acquire(tokens=6000)
+    assert time.monotonic() - start < 0.05
+
+    # 6000 TPM refills 100 tokens per second
+    await rate_limiter.acquire(tokens=10)
+    assert time.monotonic() - start >= 0.09
+
+
 # Integration tests (these require API calls and will be skipped if no API key)
 @pytest.mark.asyncio
 async def test_integration_chat_flow():
@@ -0,0 +1,230 @@
+"""
+Tools Module for Week 3
+Registry of async Python tools and a tool-calling loop on the chat completions tools API
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+import llm_utils
+from backends import LLMBackend
+
+logger = logging.getLogger(__name__)
+
+ToolFunction = Callable[..., Awaitable[Any]]
+
+
+class ToolError(Exception):
+    """Raised for unknown tools and invalid tool arguments"""
+    pass
+
+
+class Tool(NamedTuple):
+    name: str
+    description: str
+    parameters: Dict[str, Any]
+    fn: ToolFunction
+    # Same arguments always give the same result, so results can be cached
+    deterministic: bool = False
+    timeout: float = 30.0
+
+
+class ToolCall(NamedTuple):
+    id: str
+    name: str
+    arguments: str
+    result: str
+    error: Optional[str] = None
+    cached: bool = False
+
+
+class ToolLoopResult(NamedTuple):
+    content: Optional[str]
+    messages: List[Dict[str, Any]]
+    tool_calls: List[ToolCall]
+    turns: int
+    usage: Dict[str, int]
+    # "completed", "max_turns" or "max_tokens"
+    stop_reason: str
+
+
+class ToolRegistry:
+    """
+    Named async tools the model may call
+
+    Results of deterministic tools are kept in an LRU keyed by the tool name
+    and its canonical arguments, so repeated calls (within one conversation
+    or across requests) skip the work.
+    """
+
+    def __init__(self, cache_size: int = 1024):
+        self.cache_size = cache_size
+        self._tools: Dict[str, Tool] = {}
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+
+    def add(self, tool: Tool) -> None:
+        self._tools[tool.name] = tool
+
+    def register(
+        self,
+        description: str,
+        parameters: Optional[Dict[str, Any]] = None,
+        name: Optional[str] = None,
+        deterministic: bool = False,
+        timeout: float = 30.0
+    ) -> Callable[[ToolFunction], ToolFunction]:
+        """
+        Decorator registering an async function as a tool
+
+        Args:
+            description: What the tool does, shown to the model
+            parameters: JSON schema of the keyword arguments (defaults to none)
+            name: Tool name (defaults to the function name)
+            deterministic: Whether results may be cached
+            timeout: Seconds a call may take
+        """
+        def decorator(fn: ToolFunction) -> ToolFunction:
+            self.add(Tool(
+                name=name or fn.__name__,
+                description=description,
+                parameters=parameters or {"type": "object", "properties": {}},
+                fn=fn,
+                deterministic=deterministic,
+                timeout=timeout,
+            ))
+            return fn
+        return decorator
+
+    def schemas(self) -> List[Dict[str, Any]]:
+        """Tool definitions in the chat completions tools format"""
+        return [
+            {
+                "type": "function",
+                "function": {"name": t.name, "description": t.description, "parameters": t.parameters},
+            }
+            for t in self._tools.values()
+        ]
+
+    async def call(self, name: str, arguments: str) -> ToolCall:
+        """
+        Run one tool call, never raising: failures are reported in the result for the model
+
+        Args:
+            name: Tool name
+            arguments: JSON object of keyword arguments, as sent by the model
+
+        Returns:
+            The call with its JSON-encoded result or error
+        """
+        try:
+            tool = self._tools.get(name)
+            if tool is None:
+                raise ToolError(f"Unknown tool '{name}'")
+            try:
+                kwargs = json.loads(arguments or "{}")
+            except json.JSONDecodeError as e:
+                raise ToolError(f"Arguments for '{name}' are not valid JSON: {e}")
+            if not isinstance(kwargs, dict):
+                raise ToolError(f"Arguments for '{name}' must be a JSON object")
+
+            key = f"{name}:{json.dumps(kwargs, sort_keys=True)}"
+            if tool.deterministic:
+                with self._lock:
+                    cached = self._cache.get(key)
+                    if cached is not None:
+                        self._cache.move_to_end(key)
+                        self.cache_hits += 1
+                        return ToolCall("", name, arguments, cached, cached=True)
+
+            value = await asyncio.wait_for(tool.fn(**kwargs), timeout=tool.timeout)
+            result = value if isinstance(value, str) else json.dumps(value, default=str)
+            if tool.deterministic:
+                with self._lock:
+                    self._cache[key] = result
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+            return ToolCall("", name, arguments, result)
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                e = ToolError(f"Tool '{name}' timed out")
+            logger.warning("Tool call %s failed: %s", name, e)
+            error = str(e) or type(e).__name__
+            return ToolCall("", name, arguments, json.dumps({"error": error}), error=error)
+
+
+async def run_tool_loop(
+    messages: List[Dict[str, Any]],
+    registry: ToolRegistry,
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.7,
+    max_turns: int = 5,
+    max_tokens: Optional[int] = None,
+    llm_backend: Optional[LLMBackend] = None
+) -> ToolLoopResult:
+    """
+    Let the model call tools until it answers
+
+    Each turn sends the conversation with the registry's tools. All tool
+    calls the model makes in one turn run concurrently, and their results
+    are sent back together in the next turn.
+
+    Args:
+        messages: Conversation so far
+        registry: Tools the model may call
+        model: OpenAI model to use
+        temperature: Sampling temperature
+        max_turns: Most model calls; the last one may not call tools, so it must answer
+        max_tokens: Stop once the turns have used this many tokens in total
+        llm_backend: Backend to call (defaults to get_llm_backend())
+
+    Returns:
+        The final answer, the full conversation and every tool call made
+
+    Raises:
+        LLMError: If a model call fails after all retries
+    """
+    messages = list(messages)
+    calls: List[ToolCall] = []
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    tools = registry.schemas()
+
+    for turn in range(1, max_turns + 1):
+        result = await llm_utils.get_chat_completion(
+            messages,
+            model=model,
+            temperature=temperature,
+            llm_backend=llm_backend,
+            tools=tools,
+            tool_choice="auto" if turn < max_turns else "none"
+        )
+        for key in usage:
+            usage[key] += (result.usage or {}).get(key, 0)
+
+        if not result.tool_calls:
+            messages.append({"role": "assistant", "content": result.content})
+            return ToolLoopResult(result.content, messages, calls, turn, usage, "completed")
+
+        messages.append({
+            "role": "assistant",
+            "content": result.content,
+            "tool_calls": [
+                {"id": c["id"], "type": "function", "function": {"name": c["name"], "arguments": c["arguments"]}}
+                for c in result.tool_calls
+            ],
+        })
+        executed = await asyncio.gather(*(registry.call(c["name"], c["arguments"]) for c in result.tool_calls))
+        for requested, call in zip(result.tool_calls, executed):
+            call = call._replace(id=requested["id"])
+            calls.append(call)
+            messages.append({"role": "tool", "tool_call_id": call.id, "content": call.result})
+
+        if max_tokens is not None and usage["total_tokens"] >= max_tokens:
+            return ToolLoopResult(None, messages, calls, turn, usage, "max_tokens")
+
+    return ToolLoopResult(None, messages, calls, max_turns, usage, "max_turns")
@@ -0,0 +1,516 @@
+"""
+Vector Store Module for Week 3
+Named, persistent chunk collections backed by memory-mapped float32 files
+"""
+
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ann_index import IVFIndex
+from lexical_index import LexicalIndex
+from similarity import SimilarityEngine, normalize, top_k_indices
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class VectorStoreError(Exception):
+    """Custom exception for vector store errors"""
+    pass
+
+
+class CollectionNotFoundError(VectorStoreError):
+    """Raised when a collection does not exist"""
+    pass
+
+
+class Collection:
+    """
+    A named set of chunks and their embeddings stored on disk
+
+    Layout of a collection directory:
+        meta.json     - name, model and vector dimensions
+        vectors.f32   - L2-normalized float32 rows, memory-mapped for queries
+        chunks.jsonl  - append-only log of row assignments and deletions
+        ivf.npz       - IVF index over the rows, trained on the first "ivf" query
+
+    Opening a collection maps the vector file without reading it, so even
+    large collections load instantly. Upserts of an existing id overwrite its
+    row in place. Deleted rows are masked out of queries until compact()
+    rewrites the files. The IVF index is trained once and reused; upserts add
+    appended rows to it in memory and close() saves it, while overwrites and
+    compaction discard it so it is retrained on the next query.
+
+    Writes may come from worker threads (ingestion) while queries run on
+    the event loop, so public methods hold the collection's lock. The vector
+    map and its alive mask are replaced together as one tuple, so a reader
+    never pairs a new map with an old mask.
+
+    Upserts append vectors before logging their rows, so a crash in between
+    leaves unlogged vectors at the end of the file. Opening a collection
+    truncates them, drops a torn last log line, and forgets logged rows
+    whose vectors never reached the file, so row numbers always match.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+
+        self.name: str = meta["name"]
+        self.model: str = meta["model"]
+        self.dimensions: Optional[int] = meta.get("dimensions")
+        self._ids: List[Optional[str]] = []
+        self._texts: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+        self._lexical: Optional[LexicalIndex] = None
+        self._ivf: Optional[IVFIndex] = None
+        # Rows were added to _ivf since it was last saved
+        self._ivf_dirty = False
+        self._lock = threading.RLock()
+        self._load_log()
+        self._align_vectors()
+        self._map_vectors()
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, "vectors.f32")
+
+    @property
+    def _log_path(self) -> str:
+        return os.path.join(self.path, "chunks.jsonl")
+
+    @property
+    def _ivf_path(self) -> str:
+        return os.path.join(self.path, "ivf.npz")
+
+    def _load_log(self) -> None:
+        if not os.path.exists(self._log_path):
+            return
+
+        with open(self._log_path, "rb") as f:
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            # A write cut short by a crash; later appends must start on a fresh line
+            logger.warning("Dropping a torn record at the end of '%s'", self._log_path)
+            with open(self._log_path, "r+b") as f:
+                f.truncate(end)
+
+        for line in data[:end].decode("utf-8").splitlines():
+            record = json.loads(line)
+            row = record["row"]
+            while len(self._ids) <= row:
+                self._ids.append(None)
+                self._texts.append(None)
+            previous = self._ids[row]
+            if previous is not None and self._rows.get(previous) == row:
+                del self._rows[previous]
+            if record.get("deleted"):
+                self._ids[row] = None
+                self._texts[row] = None
+            else:
+                self._ids[row] = record["id"]
+                self._texts[row] = record["text"]
+                self._rows[record["id"]] = row
+
+    def _align_vectors(self) -> None:
+        """Make the vector file hold exactly one row per logged row"""
+        if self.dimensions is None or not os.path.exists(self._vectors_path):
+            return
+
+        row_bytes = self.dimensions * np.dtype(np.float32).itemsize
+        stored = os.path.getsize(self._vectors_path) // row_bytes
+        if stored < len(self._ids):
+            logger.warning(
+                "Collection '%s' logs %d rows but stores %d vectors; dropping the rows without vectors",
+                self.name, len(self._ids), stored
+            )
+            for chunk_id in self._ids[stored:]:
+                if chunk_id is not None:
+                    del self._rows[chunk_id]
+            del self._ids[stored:]
+            del self._texts[stored:]
+
+        if os.path.getsize(self._vectors_path) != len(self._ids) * row_bytes:
+            # Vectors of an upsert that died before logging them, or a partial row
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(len(self._ids) * row_bytes)
+
+    def _map_vectors(self) -> None:
+        rows = len(self._ids)
+        if rows == 0 or self.dimensions is None:
+            vectors = np.empty((0, self.dimensions or 0), dtype=np.float32)
+        else:
+            vectors = np.memmap(
+                self._vectors_path, dtype=np.float32, mode="r+", shape=(rows, self.dimensions)
+            )
+        alive = np.array([row_id is not None for row_id in self._ids], dtype=bool)
+        # Vectors and alive mask, always swapped together
+        self._matrix: Tuple[np.ndarray, np.ndarray] = (vectors, alive)
+
+    def _write_meta(self) -> None:
+        meta = {"name": self.name, "model": self.model, "dimensions": self.dimensions}
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def info(self) -> Dict[str, Any]:
+        """Return a summary of the collection"""
+        return {
+            "name": self.name,
+            "model": self.model,
+            "dimensions": self.dimensions,
+            "count": len(self),
+        }
+
+    def upsert(
+        self,
+        ids: Sequence[str],
+        texts: Sequence[str],
+        embeddings: Sequence[Sequence[float]]
+    ) -> int:
+        """
+        Insert chunks, or replace chunks whose id already exists
+
+        Args:
+            ids: Chunk ids
+            texts: Chunk texts
+            embeddings: Chunk embeddings
+
+        Returns:
+            Number of chunks written
+
+        Raises:
+            VectorStoreError: If inputs are mismatched or have the wrong dimensions
+        """
+        with self._lock:
+            if not (len(ids) == len(texts) == len(embeddings)):
+                raise VectorStoreError("ids, texts and embeddings must have the same length")
+            if not ids:
+                return 0
+
+            vectors = normalize(np.asarray(embeddings, dtype=np.float32))
+            if self.dimensions is None:
+                self.dimensions = int(vectors.shape[1])
+                self._write_meta()
+            if vectors.shape[1] != self.dimensions:
+                raise VectorStoreError(
+                    f"Expected embeddings with {self.dimensions} dimensions, got {vectors.shape[1]}"
+                )
+
+            # Later duplicates of an id in the same call win
+            latest = {chunk_id: i for i, chunk_id in enumerate(ids)}
+            records = []
+            appended = []
+            for chunk_id, i in latest.items():
+                row = self._rows.get(chunk_id)
+                if row is None:
+                    row = len(self._ids) + len(appended)
+                    appended.append(i)
+                else:
+                    # The IVF lists hold the old vector; discard them before changing it
+                    self._drop_ivf()
+                    self._matrix[0][row] = vectors[i]
+                    self._texts[row] = texts[i]
+                records.append({"row": row, "id": chunk_id, "text": texts[i]})
+
+            # Vectors go to disk before the log, so a crash leaves only unlogged rows to truncate
+            if appended:
+                with open(self._vectors_path, "ab") as f:
+                    f.write(vectors[appended].tobytes())
+                for i in appended:
+                    self._ids.append(ids[i])
+                    self._texts.append(texts[i])
+                if self._ivf is not None:
+                    # New rows go straight into their nearest lists; the file is rewritten on close()
+                    self._ivf.add(vectors[appended])
+                    self._ivf_dirty = True
+            for record in records:
+                self._rows[record["id"]] = record["row"]
+                if self._lexical is not None:
+                    self._lexical.add(record["id"], record["text"])
+
+            self._append_log(records)
+            if isinstance(self._matrix[0], np.memmap):
+                self._matrix[0].flush()
+            self._map_vectors()
+            return len(records)
+
+    def delete(self, ids: Sequence[str]) -> int:
+        """
+        Delete chunks by id
+
+        Args:
+            ids: Chunk ids to delete; unknown ids are ignored
+
+        Returns:
+            Number of chunks deleted
+        """
+        with self._lock:
+            records = []
+            for chunk_id in set(ids):
+                row = self._rows.pop(chunk_id, None)
+                if row is None:
+                    continue
+                self._ids[row] = None
+                self._texts[row] = None
+                self._matrix[1][row] = False
+                if self._lexical is not None:
+                    self._lexical.remove(chunk_id)
+                records.append({"row": row, "deleted": True})
+
+            self._append_log(records)
+            # Reclaim space once most of the file is dead rows
+            if records and len(self) < len(self._ids) // 2:
+                self.compact()
+            return len(records)
+
+    def _append_log(self, records: List[Dict[str, Any]]) -> None:
+        if not records:
+            return
+        with open(self._log_path, "a") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+
+    def compact(self) -> None:
+        """Rewrite the collection files without deleted rows"""
+        with self._lock:
+            live = [row for row, chunk_id in enumerate(self._ids) if chunk_id is not None]
+            vectors = np.array(self._matrix[0][live], dtype=np.float32)
+            ids = [self._ids[row] for row in live]
+            texts = [self._texts[row] for row in live]
+
+            # Row numbers change, so the IVF index no longer applies
+            self._drop_ivf()
+            # Release the map before replacing the file underneath it
+            self._matrix = (np.empty((0, self.dimensions or 0), dtype=np.float32), np.zeros(0, dtype=bool))
+            tmp_vectors = self._vectors_path + ".tmp"
+            tmp_log = self._log_path + ".tmp"
+            with open(tmp_vectors, "wb") as f:
+                f.write(vectors.tobytes())
+            with open(tmp_log, "w") as f:
+                for row, (chunk_id, text) in enumerate(zip(ids, texts)):
+                    f.write(json.dumps({"row": row, "id": chunk_id, "text": text}) + "\n")
+            os.replace(tmp_vectors, self._vectors_path)
+            os.replace(tmp_log, self._log_path)
+
+            self._ids = ids
+            self._texts = texts
+            self._rows = {chunk_id: row for row, chunk_id in enumerate(ids)}
+            self._map_vectors()
+            logger.info("Compacted collection '%s' to %d rows", self.name, len(ids))
+
+    def _drop_ivf(self) -> None:
+        self._ivf = None
+        self._ivf_dirty = False
+        if os.path.exists(self._ivf_path):
+            os.remove(self._ivf_path)
+
+    def _ivf_index(self, nlist: Optional[int], nprobe: int) -> IVFIndex:
+        """IVF index whose ids are row numbers: loaded or trained once, then kept in step with appends"""
+        vectors, _ = self._matrix
+        index = self._ivf
+        if index is None and os.path.exists(self._ivf_path):
+            try:
+                index = IVFIndex.load(self._ivf_path)
+            except Exception as e:
+                logger.warning("Ignoring unreadable IVF index for '%s': %s", self.name, e)
+            if index is not None and (index.dimensions != self.dimensions or len(index) > len(vectors)):
+                index = None
+
+        if index is None:
+            index = IVFIndex(dimensions=self.dimensions, nlist=nlist, nprobe=nprobe)
+            index.add(vectors)
+            if not index.is_trained:
+                index.train()
+            index.save(self._ivf_path)
+        elif len(index) < len(vectors):
+            # Rows appended since the index was saved go straight into their nearest lists
+            index.add(vectors[len(index):])
+            self._ivf_dirty = True
+
+        index.nprobe = nprobe
+        self._ivf = index
+        return index
+
+    def query(
+        self,
+        vector: Sequence[float],
+        top_k: int = 3,
+        backend: str = "exact",
+        nlist: Optional[int] = None,
+        nprobe: int = 8
+    ) -> List[Dict[str, Any]]:
+        """
+        Find the chunks most similar to a query vector
+
+        Args:
+            vector: Query embedding
+            top_k: Number of results to return
+            backend: "exact" (scan every row) or "ivf" (approximate, via the saved IVF index)
+            nlist: IVF lists when the index is (re)trained (defaults to sqrt of the row count)
+            nprobe: IVF lists scanned per query
+
+        Returns:
+            List of dictionaries with chunk id, text and similarity score
+
+        Raises:
+            ValueError: If the backend is unknown
+            VectorStoreError: If the vector has the wrong dimensions
+        """
+        if backend not in ("exact", "ivf"):
+            raise ValueError(f"Unknown similarity backend: {backend}")
+
+        with self._lock:
+            if len(self) == 0:
+                return []
+
+            vectors, alive = self._matrix
+            try:
+                if backend == "ivf":
+                    # Ask for extra results so dead rows can be dropped and still leave top_k
+                    dead = len(alive) - int(alive.sum())
+                    candidates = self._ivf_index(nlist, nprobe).search(vector, top_k + dead)
+                    hits = [(row, score) for row, score in candidates if alive[row]][:top_k]
+                else:
+                    scores = SimilarityEngine.from_normalized(vectors).scores(vector)
+                    scores[~alive] = -np.inf
+                    hits = [(int(i), float(scores[i])) for i in top_k_indices(scores, min(top_k, len(self)))]
+            except ValueError as e:
+                raise VectorStoreError(str(e))
+
+            return [
+                {"id": self._ids[i], "chunk": self._texts[i], "similarity": score, "index": i}
+                for i, score in hits
+            ]
+
+    def close(self) -> None:
+        """Save the IVF index if rows were added since it was written; the collection stays usable"""
+        with self._lock:
+            if self._ivf is not None and self._ivf_dirty:
+                self._ivf.save(self._ivf_path)
+                self._ivf_dirty = False
+
+    @property
+    def lexical(self) -> LexicalIndex:
+        """BM25 index over the chunk texts, keyed by chunk id"""
+        with self._lock:
+            if self._lexical is None:
+                index = LexicalIndex()
+                for chunk_id, row in self._rows.items():
+                    index.add(chunk_id, self._texts[row])
+                self._lexical = index
+            return self._lexical
+
+    def lexical_query(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+        """
+        Find the chunks that best match a query's words with BM25, without embedding it
+
+        Args:
+            query: Query text
+            top_k: Number of results to return
+
+        Returns:
+            List of dictionaries with chunk id, text and BM25 score
+        """
+        with self._lock:
+            results = []
+            for chunk_id, score in self.lexical.search(query, top_k):
+                row = self._rows[chunk_id]
+                results.append({"id": chunk_id, "chunk": self._texts[row], "bm25": score, "index": row})
+            return results
+
+
+class VectorStore:
+    """Directory of named collections"""
+
+    def __init__(self, root: str = "vector_store"):
+        self.root = root
+        self._collections: Dict[str, Collection] = {}
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        if not COLLECTION_NAME_PATTERN.match(name):
+            raise VectorStoreError(
+                "Collection names may only contain letters, digits, '-' and '_' (max 64)"
+            )
+        return os.path.join(self.root, name)
+
+    def create_collection(
+        self,
+        name: str,
+        model: str = "text-embedding-3-small",
+        dimensions: Optional[int] = None
+    ) -> Collection:
+        """
+        Create a new, empty collection
+
+        Raises:
+            VectorStoreError: If the name is invalid or already taken
+        """
+        path = self._path(name)
+        if os.path.exists(path):
+            raise VectorStoreError(f"Collection '{name}' already exists")
+
+        os.makedirs(path)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"name": name, "model": model, "dimensions": dimensions}, f)
+        collection = Collection(path)
+        self._collections[name] = collection
+        return collection
+
+    def get_collection(self, name: str) -> Collection:
+        """
+        Open a collection, reusing it if it is already loaded
+
+        Raises:
+            CollectionNotFoundError: If the collection does not exist
+        """
+        if name in self._collections:
+            return self._collections[name]
+
+        path = self._path(name)
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            raise CollectionNotFoundError(f"Collection '{name}' not found")
+
+        collection = Collection(path)
+        self._collections[name] = collection
+        return collection
+
+    def list_collections(self) -> List[Dict[str, Any]]:
+        """Return info for every collection in the store"""
+        names = sorted(
+            entry for entry in os.listdir(self.root)
+            if os.path.exists(os.path.join(self.root, entry, "meta.json"))
+        )
+        return [self.get_collection(name).info() for name in names]
+
+    def close(self) -> None:
+        """Save the in-memory state of every loaded collection"""
+        for collection in list(self._collections.values()):
+            collection.close()
+
+    def delete_collection(self, name: str) -> None:
+        """
+        Delete a collection and its files
+
+        Raises:
+            CollectionNotFoundError: If the collection does not exist
+        """
+        path = self._path(name)
+        if not os.path.exists(path):
+            raise CollectionNotFoundError(f"Collection '{name}' not found")
+
+        self._collections.pop(name, None)
+        shutil.rmtree(path)